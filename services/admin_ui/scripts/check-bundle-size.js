@@ -0,0 +1,50 @@
+// Bundle-size budget, run after `vite build` (npm run build).
+//
+// Reads dist/.vite/manifest.json, follows the static imports of index.html's entry
+// chunk (what the browser must download before the first render) and fails when their
+// gzipped JavaScript exceeds BUNDLE_BUDGET_KB (default 150). Chunks only reached
+// through dynamic imports (the lazy pages and their vendor chunks) are listed but
+// don't count.
+//
+//   node scripts/check-bundle-size.js [distDir]
+//   BUNDLE_BUDGET_KB=120 npm run build
+import { readFileSync } from 'node:fs'
+import { join } from 'node:path'
+import { gzipSync } from 'node:zlib'
+
+const dist = process.argv[2] || 'dist'
+const budgetKb = Number(process.env.BUNDLE_BUDGET_KB || 150)
+
+const manifest = JSON.parse(readFileSync(join(dist, '.vite', 'manifest.json'), 'utf8'))
+const entries = Object.keys(manifest).filter((key) => manifest[key].isEntry)
+
+const initial = new Set()
+const visit = (key) => {
+  if (initial.has(key)) return
+  initial.add(key)
+  for (const imported of manifest[key].imports || []) visit(imported)
+}
+entries.forEach(visit)
+
+const sizes = (file) => {
+  const content = readFileSync(join(dist, file))
+  return { raw: content.length, gzip: gzipSync(content).length }
+}
+const kb = (bytes) => (bytes / 1024).toFixed(1).padStart(8)
+
+const rows = Object.entries(manifest)
+  .filter(([, chunk]) => chunk.file.endsWith('.js'))
+  .map(([key, chunk]) => ({ file: chunk.file, initial: initial.has(key), ...sizes(chunk.file) }))
+  .sort((a, b) => (b.initial - a.initial) || (b.gzip - a.gzip))
+
+console.log(`\n${'chunk'.padEnd(48)} ${'load'.padEnd(7)} ${'KB'.padStart(8)} ${'gzip KB'.padStart(8)}`)
+for (const row of rows) {
+  console.log(`${row.file.padEnd(48)} ${(row.initial ? 'initial' : 'lazy').padEnd(7)} ${kb(row.raw)} ${kb(row.gzip)}`)
+}
+
+const total = rows.filter((row) => row.initial).reduce((sum, row) => sum + row.gzip, 0)
+console.log(`\nInitial JS: ${(total / 1024).toFixed(1)} KB gzipped, budget ${budgetKb} KB`)
+if (total > budgetKb * 1024) {
+  console.error('Initial bundle over budget: lazy-load the page or library that grew it, or raise BUNDLE_BUDGET_KB.')
+  process.exit(1)
+}
@@ -1,15 +1,19 @@
+import { lazy, Suspense } from 'react'
 import { Link, Navigate, Route, BrowserRouter as Router, Routes } from 'react-router-dom'
 import './App.css'
 import { AuthProvider, useAuth } from './AuthContext'
-import CalendarView from './pages/CalendarView'
-import CustomersPage from './pages/CustomersPage'
-import DashboardPage from './pages/DashboardPage'
-import KanbanView from './pages/KanbanView'
 import LoginPage from './pages/LoginPage'
 import OrdersPage from './pages/OrdersPage'
-import ProductionView from './pages/ProductionView'
-import ProductsPage from './pages/ProductsPage'
-import SettingsPage from './pages/SettingsPage'
+
+// Pages other than the orders list (the landing page) are separate chunks, loaded
+// when first opened: charts, calendar and drag-and-drop stay out of the initial bundle.
+const CalendarView = lazy(() => import('./pages/CalendarView'))
+const CustomersPage = lazy(() => import('./pages/CustomersPage'))
+const DashboardPage = lazy(() => import('./pages/DashboardPage'))
+const KanbanView = lazy(() => import('./pages/KanbanView'))
+const ProductionView = lazy(() => import('./pages/ProductionView'))
+const ProductsPage = lazy(() => import('./pages/ProductsPage'))
+const SettingsPage = lazy(() => import('./pages/SettingsPage'))
 
 // Protected route wrapper
 function ProtectedRoute({ children, adminOnly = false }) {
@@ -59,23 +63,25 @@ function AppLayout() {
       </nav>
 
       <main className="main-content">
-        <Routes>
-          <Route path="/" element={<OrdersPage />} />
-          <Route path="/dashboard" element={<DashboardPage />} />
-          <Route path="/kanban" element={<KanbanView />} />
-          <Route path="/calendar" element={<CalendarView />} />
-          <Route path="/production" element={<ProductionView />} />
-          <Route path="/customers" element={<CustomersPage />} />
-          <Route path="/products" element={<ProductsPage />} />
-          <Route 
-            path="/settings" 
-            element={
-              <ProtectedRoute adminOnly>
-                <SettingsPage />
-              </ProtectedRoute>
-            } 
-          />
-        </Routes>
+        <Suspense fallback={<div className="loading">A carregar...</div>}>
+          <Routes>
+            <Route path="/" element={<OrdersPage />} />
+            <Route path="/dashboard" element={<DashboardPage />} />
+            <Route path="/kanban" element={<KanbanView />} />
+            <Route path="/calendar" element={<CalendarView />} />
+            <Route path="/production" element={<ProductionView />} />
+            <Route path="/customers" element={<CustomersPage />} />
+            <Route path="/products" element={<ProductsPage />} />
+            <Route 
+              path="/settings" 
+              element={
+                <ProtectedRoute adminOnly>
+                  <SettingsPage />
+                </ProtectedRoute>
+              } 
+            />
+          </Routes>
+        </Suspense>
       </main>
     </div>
   )
@@ -1,5 +1,6 @@
 import { createContext, useContext, useEffect, useState } from 'react'
 import { api } from './api'
+import { clearCache } from './queryCache'
 
 const AuthContext = createContext(null)
 
@@ -54,6 +55,7 @@ export const AuthProvider = ({ children }) => {
     setToken(null)
     setUser(null)
     localStorage.removeItem('token')
+    clearCache()
   }
 
   const value = {
@@ -1,4 +1,5 @@
 import axios from 'axios'
+import { clearCache, mutate, query } from './queryCache'
 
 const API_BASE_URL = '/api'
 
@@ -24,38 +25,80 @@ api.interceptors.response.use(
   (error) => {
     if (error.response?.status === 401) {
       localStorage.removeItem('token')
+      clearCache()
       window.location.href = '/login'
     }
     return Promise.reject(error)
   }
 )
 
+// Cached reads (see queryCache.js). Catalog data changes rarely and is kept across
+// reloads; order lists are always revalidated, but shown from the cache meanwhile.
+const CATALOG = { staleTime: 30000, persist: true }
+const LISTS = { staleTime: 0 }
+
 // Customers
-export const getCustomers = () => api.get('/customers')
+export const getCustomers = () => query(['customers'], () => api.get('/customers'), CATALOG)
 export const getCustomer = (id) => api.get(`/customers/${id}`)
-export const createCustomer = (data) => api.post('/customers', data)
-export const updateCustomer = (id, data) => api.put(`/customers/${id}`, data)
-export const deleteCustomer = (id) => api.delete(`/customers/${id}`)
+export const createCustomer = (data) => mutate(api.post('/customers', data), 'customers', 'orders')
+export const updateCustomer = (id, data) => mutate(api.put(`/customers/${id}`, data), 'customers', 'orders')
+export const deleteCustomer = (id) => mutate(api.delete(`/customers/${id}`), 'customers', 'orders', 'recurring')
 
 // Products
-export const getProducts = () => api.get('/products')
+export const getProducts = () => query(['products'], () => api.get('/products'), CATALOG)
 export const getProduct = (id) => api.get(`/products/${id}`)
-export const createProduct = (data) => api.post('/products', data)
-export const updateProduct = (id, data) => api.put(`/products/${id}`, data)
-export const deleteProduct = (id) => api.delete(`/products/${id}`)
+export const createProduct = (data) => mutate(api.post('/products', data), 'products', 'orders')
+export const updateProduct = (id, data) => mutate(api.put(`/products/${id}`, data), 'products', 'orders')
+export const deleteProduct = (id) => mutate(api.delete(`/products/${id}`), 'products', 'orders')
 
 // Orders
-export const getOrders = (params) => api.get('/orders', { params })
+// If-Match with the order version (ETag) makes the API reject edits to an order
+// someone else changed in the meantime (412); see isConflict.
+const ifMatch = (version) => (version ? { headers: { 'If-Match': `"${version}"` } } : {})
+
+// One key per distinct submission: retrying the same request never creates a duplicate
+export const newIdempotencyKey = () =>
+  (window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`)
+
+export const isConflict = (error) => [409, 412].includes(error?.response?.status)
+
+// Order changes also change the dashboard and production figures ('analytics')
+const ORDER_CHANGES = ['orders', 'analytics']
+
+export const getOrders = (params) => query(['orders', 'list', params], () => api.get('/orders', { params }), LISTS)
+export const searchOrders = (params) => query(['orders', 'search', params], () => api.get('/orders/search', { params }), LISTS)
+// One page of orders with customers/products as id-keyed maps; catalog: true adds all of them
+export const getOrdersBootstrap = (params) =>
+  query(['orders', 'bootstrap', params], () => api.get('/orders/bootstrap', { params }), LISTS)
+// Not cached: the version it returns is what edits send as If-Match
 export const getOrder = (id) => api.get(`/orders/${id}`)
-export const createOrder = (data) => api.post('/orders', data)
-export const updateOrder = (id, data) => api.put(`/orders/${id}`, data)
-export const updateOrderStatus = (id, status) => api.patch(`/orders/${id}/status`, { status })
-export const deleteOrder = (id) => api.delete(`/orders/${id}`)
+export const createOrder = (data, idempotencyKey) => mutate(
+  api.post('/orders', data, idempotencyKey ? { headers: { 'Idempotency-Key': idempotencyKey } } : {}),
+  ...ORDER_CHANGES,
+)
+export const updateOrder = (id, data, version) => mutate(api.put(`/orders/${id}`, data, ifMatch(version)), ...ORDER_CHANGES)
+export const updateOrderStatus = (id, status, version) =>
+  mutate(api.patch(`/orders/${id}/status`, { status }, ifMatch(version)), ...ORDER_CHANGES)
+export const deleteOrder = (id, version) => mutate(api.delete(`/orders/${id}`, ifMatch(version)), ...ORDER_CHANGES)
 export const getOrderHistory = (id) => api.get(`/orders/${id}/history`)
+export const updateOrdersStatus = (orderIds, status) =>
+  mutate(api.patch('/orders/status', { order_ids: orderIds, status }), ...ORDER_CHANGES)
+export const getOrderTimelines = (ids) => api.get('/orders/history', { params: { ids: ids.join(',') } })
 
 // Analytics
-export const getProductionNeeds = (date) => api.get(`/analytics/production-needs`, { params: { date } })
-export const getDashboardStats = (days = 30) => api.get('/analytics/dashboard', { params: { days } })
+export const getProductionNeeds = (date) =>
+  query(['analytics', 'production-needs', date], () => api.get(`/analytics/production-needs`, { params: { date } }), LISTS)
+export const getDashboardStats = (days = 30, params = {}) => query(
+  ['analytics', 'dashboard', days, params],
+  () => api.get('/analytics/dashboard', { params: { days, ...params } }),
+  { staleTime: 60000 },
+)
+
+// Dispatch
+export const getPackingLists = (params) => api.get('/dispatch/packing-lists', {
+  params,
+  responseType: params.format && params.format !== 'json' ? 'blob' : 'json',
+})
 
 // Auth
 const authAPI = {
@@ -80,23 +123,30 @@ const authAPI = {
 }
 
 // Users
-export const getUsers = () => api.get('/users')
+export const getUsers = () => query(['users'], () => api.get('/users'), { staleTime: 30000 })
 export const getUser = (id) => api.get(`/users/${id}`)
-export const createUser = (data) => api.post('/users', data)
-export const updateUser = (id, data) => api.put(`/users/${id}`, data)
-export const deleteUser = (id) => api.delete(`/users/${id}`)
+export const createUser = (data) => mutate(api.post('/users', data), 'users')
+export const updateUser = (id, data) => mutate(api.put(`/users/${id}`, data), 'users')
+export const deleteUser = (id) => mutate(api.delete(`/users/${id}`), 'users')
 
 // Recurring Plans
-export const getRecurringPlans = (customerId) => api.get(`/recurring/plans`, { params: { customer_id: customerId } })
+// Plans with items for many customers in one call: { customer_ids: [1, 2, 3] }
+export const getRecurringPlans = ({ customer_ids, ...params } = {}) => {
+  const allParams = { ...params, customer_ids: customer_ids?.join(',') }
+  return query(['recurring', allParams], () => api.get('/recurring/plans', { params: allParams }), { staleTime: 30000 })
+}
 export const getRecurringPlan = (id) => api.get(`/recurring/plans/${id}`)
-export const createRecurringPlan = (data) => api.post('/recurring/plans', data)
-export const updateRecurringPlan = (id, data) => api.put(`/recurring/plans/${id}`, data)
-export const deleteRecurringPlan = (id) => api.delete(`/recurring/plans/${id}`)
-export const createMonthlyPayment = (planId, month, year) => api.post(`/recurring/plans/${planId}/create-monthly-payment`, null, { params: { month, year } })
+export const createRecurringPlan = (data) => mutate(api.post('/recurring/plans', data), 'recurring')
+export const updateRecurringPlan = (id, data) => mutate(api.put(`/recurring/plans/${id}`, data), 'recurring')
+export const deleteRecurringPlan = (id) => mutate(api.delete(`/recurring/plans/${id}`), 'recurring')
+export const createMonthlyPayment = (planId, month, year) => mutate(
+  api.post(`/recurring/plans/${planId}/create-monthly-payment`, null, { params: { month, year } }),
+  'recurring', ...ORDER_CHANGES,
+)
 
 // Settings
-export const getSettings = () => api.get('/settings')
-export const updateSettings = (data) => api.put('/settings', data)
+export const getSettings = () => query(['settings'], () => api.get('/settings'), { staleTime: 300000, persist: true })
+export const updateSettings = (data) => mutate(api.put('/settings', data), 'settings')
 
 export { authAPI as api }
 export default api
@@ -1,15 +1,18 @@
 import { format, getDay, parse, startOfWeek } from 'date-fns'
-import { pt } from 'date-fns/locale'
+import { pt } from 'date-fns/locale/pt'
 import { useEffect, useState } from 'react'
 import { Calendar, dateFnsLocalizer } from 'react-big-calendar'
 import 'react-big-calendar/lib/css/react-big-calendar.css'
-import { getOrders, getSettings } from '../api'
+import { getOrder, getOrders, getSettings } from '../api'
+import { useCacheRefresh } from '../queryCache'
 import '../styles/calendar.css'
 
 const locales = {
   'pt': pt,
 }
 
+const CALENDAR_FIELDS = 'id,customer_id,delivery_date,status,total,customer.name'
+
 const localizer = dateFnsLocalizer({
   format,
   parse,
@@ -27,6 +30,9 @@ function CalendarView() {
   const [settings, setSettings] = useState(null)
   const [cutoffWarning, setCutoffWarning] = useState(null)
 
+  useCacheRefresh('orders', () => loadOrders())
+  useCacheRefresh('settings', () => loadSettings())
+
   useEffect(() => {
     loadOrders()
     loadSettings()
@@ -95,7 +101,8 @@ function CalendarView() {
 
   const loadOrders = async () => {
     try {
-      const response = await getOrders()
+      // Only what the calendar renders; full details are fetched when an order is opened
+      const response = await getOrders({ fields: CALENDAR_FIELDS })
       setOrders(response.data)
     } catch (error) {
       console.error('Erro ao carregar encomendas:', error)
@@ -105,9 +112,15 @@ function CalendarView() {
     }
   }
 
-  const handleSelectEvent = (event) => {
+  const handleSelectEvent = async (event) => {
     setSelectedOrder(event.resource)
     setShowModal(true)
+    try {
+      const response = await getOrder(event.resource.id)
+      setSelectedOrder(response.data)
+    } catch (error) {
+      console.error('Erro ao carregar encomenda:', error)
+    }
   }
 
   const eventStyleGetter = (event) => {
@@ -1,8 +1,10 @@
 import { useEffect, useState } from 'react'
 import { createCustomer, createMonthlyPayment, createRecurringPlan, deleteCustomer, deleteRecurringPlan, getCustomers, getProducts, getRecurringPlans, updateCustomer, updateRecurringPlan } from '../api'
+import { useCacheRefresh } from '../queryCache'
 
 function CustomersPage() {
   const [customers, setCustomers] = useState([])
+  const [plansByCustomer, setPlansByCustomer] = useState({})
   const [products, setProducts] = useState([])
   const [loading, setLoading] = useState(true)
   const [showModal, setShowModal] = useState(false)
@@ -26,6 +28,10 @@ function CustomersPage() {
     is_subscription: false
   })
 
+  // loadCustomers also loads the customers' plans
+  useCacheRefresh(['customers', 'recurring'], () => loadCustomers())
+  useCacheRefresh('products', () => loadProducts())
+
   useEffect(() => {
     loadCustomers()
     loadProducts()
@@ -35,6 +41,7 @@ function CustomersPage() {
     try {
       const response = await getCustomers()
       setCustomers(response.data)
+      await loadPlans(response.data)
     } catch (error) {
       console.error('Erro ao carregar clientes:', error)
       alert('Erro ao carregar clientes')
@@ -52,31 +59,41 @@ function CustomersPage() {
     }
   }
 
-  const loadPlan = async (customerId) => {
-    try {
-      const response = await getRecurringPlans(customerId)
-      if (response.data && response.data.length > 0) {
-        const plan = response.data[0]
-        setCurrentPlan(plan)
-        setPlanFormData({
-          day_of_week: plan.day_of_week,
-          start_date: plan.start_date,
-          end_date: plan.end_date || '',
-          active: plan.active,
-          items: plan.items || []
-        })
-      } else {
-        setCurrentPlan(null)
-        setPlanFormData({
-          day_of_week: 0,
-          start_date: new Date().toISOString().split('T')[0],
-          end_date: '',
-          active: true,
-          items: []
-        })
-      }
-    } catch (error) {
-      console.error('Erro ao carregar plano:', error)
+  // Plans of all subscription customers, with their items, in one request
+  const loadPlans = async (customerList = customers) => {
+    const ids = customerList.filter(c => c.is_subscription).map(c => c.id)
+    if (ids.length === 0) {
+      setPlansByCustomer({})
+      return {}
+    }
+    const response = await getRecurringPlans({ customer_ids: ids })
+    const byCustomer = {}
+    for (const plan of response.data) {
+      if (!byCustomer[plan.customer_id]) byCustomer[plan.customer_id] = plan
+    }
+    setPlansByCustomer(byCustomer)
+    return byCustomer
+  }
+
+  const showPlan = (plan) => {
+    if (plan) {
+      setCurrentPlan(plan)
+      setPlanFormData({
+        day_of_week: plan.day_of_week,
+        start_date: plan.start_date,
+        end_date: plan.end_date || '',
+        active: plan.active,
+        items: plan.items || []
+      })
+    } else {
+      setCurrentPlan(null)
+      setPlanFormData({
+        day_of_week: 0,
+        start_date: new Date().toISOString().split('T')[0],
+        end_date: '',
+        active: true,
+        items: []
+      })
     }
   }
 
@@ -131,7 +148,7 @@ function CustomersPage() {
 
   const handleOpenPlanModal = async (customer) => {
     setManagingPlanCustomer(customer)
-    await loadPlan(customer.id)
+    showPlan(plansByCustomer[customer.id])
     setShowPlanModal(true)
   }
 
@@ -155,7 +172,8 @@ function CustomersPage() {
         alert('Plano criado com sucesso!')
       }
       
-      await loadPlan(managingPlanCustomer.id)
+      const plans = await loadPlans()
+      showPlan(plans[managingPlanCustomer.id])
     } catch (error) {
       console.error('Erro ao salvar plano:', error)
       alert('Erro ao salvar plano: ' + (error.response?.data?.detail || error.message))
@@ -169,14 +187,8 @@ function CustomersPage() {
     try {
       await deleteRecurringPlan(currentPlan.id)
       alert('Plano excluído com sucesso!')
-      setCurrentPlan(null)
-      setPlanFormData({
-        day_of_week: 0,
-        start_date: new Date().toISOString().split('T')[0],
-        end_date: '',
-        active: true,
-        items: []
-      })
+      showPlan(null)
+      loadPlans()
     } catch (error) {
       console.error('Erro ao excluir plano:', error)
       alert('Erro ao excluir plano')
@@ -268,7 +280,9 @@ function CustomersPage() {
                   <td>{customer.pickup_location || '-'}</td>
                   <td>
                     {customer.is_subscription ? (
-                      <span className="status-badge status-delivered">✓ Mensal</span>
+                      <span className="status-badge status-delivered">
+                        ✓ Mensal{plansByCustomer[customer.id] ? ` · ${plansByCustomer[customer.id].items.length} itens` : ''}
+                      </span>
                     ) : (
                       <span className="status-badge status-pending">Avulso</span>
                     )}
@@ -1,6 +1,7 @@
 import { useEffect, useState } from 'react'
 import { Bar, BarChart, CartesianGrid, Cell, Legend, Line, LineChart, Pie, PieChart, ResponsiveContainer, Tooltip, XAxis, YAxis } from 'recharts'
 import { getDashboardStats } from '../api'
+import { useCacheRefresh } from '../queryCache'
 import '../styles/dashboard.css'
 
 const STATUS_COLORS = {
@@ -19,11 +20,29 @@ const STATUS_LABELS = {
   delivered: 'Entregue'
 }
 
+const BUCKET_LABELS = {
+  day: 'Dia',
+  week: 'Semana',
+  month: 'Mês'
+}
+
+function Change({ value }) {
+  if (value === null || value === undefined) return null
+  const color = value > 0 ? '#16a34a' : value < 0 ? '#dc2626' : '#6b7280'
+  return (
+    <div style={{ fontSize: '0.75rem', color }}>
+      {value > 0 ? '+' : ''}{value.toFixed(1)}% vs período anterior
+    </div>
+  )
+}
+
 function DashboardPage() {
   const [loading, setLoading] = useState(true)
   const [stats, setStats] = useState(null)
   const [dateRange, setDateRange] = useState('30')
 
+  useCacheRefresh('analytics', () => loadStats())
+
   useEffect(() => {
     loadStats()
   }, [dateRange])
@@ -31,7 +50,7 @@ function DashboardPage() {
   const loadStats = async () => {
     try {
       setLoading(true)
-      const { data } = await getDashboardStats(parseInt(dateRange))
+      const { data } = await getDashboardStats(parseInt(dateRange), { granularity: 'auto', compare: 'previous' })
       setStats(data)
     } catch (error) {
       console.error('Erro ao carregar estatísticas:', error)
@@ -56,6 +75,12 @@ function DashboardPage() {
     color: STATUS_COLORS[s.status] || '#94a3b8'
   }))
 
+  const bucketLabel = BUCKET_LABELS[stats.granularity] || 'Dia'
+  const change = stats.change_pct || {}
+  const revenueChange = stats.previous && stats.previous.total_orders > 0 && stats.total_orders > 0
+    ? ((stats.total_revenue / stats.total_orders) / (stats.previous.total_revenue / stats.previous.total_orders) - 1) * 100
+    : null
+
   return (
     <div className="dashboard-container">
       <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '2rem' }}>
@@ -72,6 +97,7 @@ function DashboardPage() {
             <option value="30">Últimos 30 dias</option>
             <option value="90">Últimos 90 dias</option>
             <option value="365">Último ano</option>
+            <option value="730">Últimos 2 anos</option>
           </select>
         </div>
       </div>
@@ -83,6 +109,7 @@ function DashboardPage() {
           <div className="kpi-content">
             <div className="kpi-label">Total de Encomendas</div>
             <div className="kpi-value">{stats.total_orders}</div>
+            <Change value={change.total_orders} />
           </div>
         </div>
 
@@ -91,6 +118,7 @@ function DashboardPage() {
           <div className="kpi-content">
             <div className="kpi-label">Total de Unidades</div>
             <div className="kpi-value">{stats.total_units.toLocaleString()}</div>
+            <Change value={change.total_units} />
           </div>
         </div>
 
@@ -99,6 +127,7 @@ function DashboardPage() {
           <div className="kpi-content">
             <div className="kpi-label">Receita Total</div>
             <div className="kpi-value">€{stats.total_revenue.toFixed(2)}</div>
+            <Change value={change.total_revenue} />
           </div>
         </div>
 
@@ -109,6 +138,7 @@ function DashboardPage() {
             <div className="kpi-value">
               €{stats.total_orders > 0 ? (stats.total_revenue / stats.total_orders).toFixed(2) : '0.00'}
             </div>
+            <Change value={revenueChange} />
           </div>
         </div>
       </div>
@@ -118,7 +148,7 @@ function DashboardPage() {
         
         {/* Orders Over Time */}
         <div className="chart-card">
-          <h3>Encomendas por Dia (Últimos 30 dias)</h3>
+          <h3>Encomendas por {bucketLabel}</h3>
           <ResponsiveContainer width="100%" height={300}>
             <LineChart data={stats.orders_by_day}>
               <CartesianGrid strokeDasharray="3 3" />
@@ -127,13 +157,16 @@ function DashboardPage() {
               <Tooltip />
               <Legend />
               <Line type="monotone" dataKey="count" stroke="#c47b27" strokeWidth={2} name="Encomendas" />
+              {stats.previous && (
+                <Line type="monotone" dataKey="previous_count" stroke="#c47b27" strokeOpacity={0.4} strokeDasharray="5 5" dot={false} name="Período anterior" />
+              )}
             </LineChart>
           </ResponsiveContainer>
         </div>
 
         {/* Revenue Over Time */}
         <div className="chart-card">
-          <h3>Receita por Dia (Últimos 30 dias)</h3>
+          <h3>Receita por {bucketLabel}</h3>
           <ResponsiveContainer width="100%" height={300}>
             <LineChart data={stats.orders_by_day}>
               <CartesianGrid strokeDasharray="3 3" />
@@ -142,6 +175,9 @@ function DashboardPage() {
               <Tooltip formatter={(value) => `€${value.toFixed(2)}`} />
               <Legend />
               <Line type="monotone" dataKey="revenue" stroke="#7a9e7e" strokeWidth={2} name="Receita (€)" />
+              {stats.previous && (
+                <Line type="monotone" dataKey="previous_revenue" stroke="#7a9e7e" strokeOpacity={0.4} strokeDasharray="5 5" dot={false} name="Período anterior (€)" />
+              )}
             </LineChart>
           </ResponsiveContainer>
         </div>
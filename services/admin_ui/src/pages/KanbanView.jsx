@@ -1,10 +1,13 @@
 import { DragDropContext, Draggable, Droppable } from '@hello-pangea/dnd'
 import { addWeeks, endOfWeek, format, isWithinInterval, startOfWeek } from 'date-fns'
-import { pt } from 'date-fns/locale'
+import { pt } from 'date-fns/locale/pt'
 import { useEffect, useState } from 'react'
-import { getOrders, updateOrderStatus } from '../api'
+import { getOrders, isConflict, updateOrderStatus } from '../api'
+import { useCacheRefresh } from '../queryCache'
 import '../styles/kanban.css'
 
+const KANBAN_FIELDS = 'id,customer_id,delivery_date,status,total,version,is_auto_generated,is_monthly_payment,customer.name,items.id'
+
 const COLUMNS = [
   { id: 'encomendado', label: 'Encomendado', color: '#fbbf24' },
   { id: 'pago', label: 'Pago', color: '#60a5fa' },
@@ -22,6 +25,8 @@ function KanbanView() {
   const weekStart = startOfWeek(selectedWeek, { weekStartsOn: 1 }) // Monday
   const weekEnd = endOfWeek(selectedWeek, { weekStartsOn: 1 }) // Sunday
 
+  useCacheRefresh('orders', () => loadOrders())
+
   useEffect(() => {
     loadOrders()
   }, [])
@@ -44,7 +49,7 @@ function KanbanView() {
 
   const loadOrders = async () => {
     try {
-      const response = await getOrders()
+      const response = await getOrders({ fields: KANBAN_FIELDS })
       setOrders(response.data)
     } catch (error) {
       console.error('Erro ao carregar encomendas:', error)
@@ -63,17 +68,23 @@ function KanbanView() {
     const orderId = parseInt(draggableId)
     const newStatus = destination.droppableId
 
+    const current = orders.find(order => order.id === orderId)
     try {
-      await updateOrderStatus(orderId, newStatus)
+      const { data } = await updateOrderStatus(orderId, newStatus, current?.version)
       
       // Update local state
       setOrders(prevOrders =>
         prevOrders.map(order =>
-          order.id === orderId ? { ...order, status: newStatus } : order
+          order.id === orderId ? { ...order, status: data.status, version: data.version } : order
         )
       )
     } catch (error) {
       console.error('Erro ao atualizar status:', error)
+      if (isConflict(error)) {
+        alert('Esta encomenda foi alterada por outro utilizador. O quadro foi atualizado.')
+        loadOrders()
+        return
+      }
       alert('Erro ao atualizar status')
     }
   }
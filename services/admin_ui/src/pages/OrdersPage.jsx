@@ -1,12 +1,21 @@
-import { differenceInHours, endOfWeek, format, isWithinInterval, startOfWeek } from 'date-fns'
-import { useEffect, useState } from 'react'
-import { createOrder, deleteOrder, getCustomers, getOrder, getOrderHistory, getOrders, getProducts, updateOrder, updateOrderStatus } from '../api'
+import { differenceInHours, endOfWeek, format, startOfWeek } from 'date-fns'
+import { useEffect, useMemo, useState } from 'react'
+import { createOrder, deleteOrder, getOrder, getOrderHistory, getOrdersBootstrap, isConflict, newIdempotencyKey, updateOrder, updateOrderStatus } from '../api'
+import { useCacheRefresh } from '../queryCache'
+
+const PAGE_SIZE = 50
+const CONFLICT_MESSAGE = 'Esta encomenda foi alterada por outro utilizador. A lista foi atualizada, tente novamente.'
 
 function OrdersPage() {
   const [orders, setOrders] = useState([])
-  const [filteredOrders, setFilteredOrders] = useState([])
-  const [customers, setCustomers] = useState([])
-  const [products, setProducts] = useState([])
+  const [total, setTotal] = useState(0)
+  const [urgentCount, setUrgentCount] = useState(0)
+  const [page, setPage] = useState(0)
+  const [search, setSearch] = useState('')
+  const [query, setQuery] = useState('')
+  const [customersById, setCustomersById] = useState({})
+  const [productsById, setProductsById] = useState({})
+  const [catalogLoaded, setCatalogLoaded] = useState(false)
   const [loading, setLoading] = useState(true)
   const [showModal, setShowModal] = useState(false)
   const [viewModal, setViewModal] = useState(false)
@@ -14,33 +23,61 @@ function OrdersPage() {
   const [selectedOrder, setSelectedOrder] = useState(null)
   const [history, setHistory] = useState([])
   const [editingOrderId, setEditingOrderId] = useState(null)
+  const [editingVersion, setEditingVersion] = useState(null)
   const [weekFilter, setWeekFilter] = useState('all') // 'all' | 'current'
-  const [sortBy, setSortBy] = useState('delivery_date') // 'delivery_date' | 'id'
+  const [sortBy, setSortBy] = useState('delivery_date') // 'delivery_date' | '-id'
   const [formData, setFormData] = useState({
     customer_id: '',
     delivery_date: '',
     notes: '',
     items: []
   })
+  // Same form contents -> same key, so a retried submit cannot create a second order
+  const createKey = useMemo(() => newIdempotencyKey(), [formData])
+
+  useCacheRefresh('orders', () => loadData())
 
+  // Debounce the search box before querying the server
   useEffect(() => {
-    loadData()
-  }, [])
+    const timer = setTimeout(() => {
+      setPage(0)
+      setQuery(search.trim())
+    }, 300)
+    return () => clearTimeout(timer)
+  }, [search])
 
   useEffect(() => {
-    applyFiltersAndSort()
-  }, [orders, weekFilter, sortBy])
+    loadData()
+  }, [query, weekFilter, sortBy, page])
+
+  const buildParams = () => {
+    const params = { sort: sortBy, skip: page * PAGE_SIZE, limit: PAGE_SIZE }
+    if (query) params.q = query
+    if (weekFilter === 'current') {
+      const now = new Date()
+      params.delivery_from = format(startOfWeek(now, { weekStartsOn: 1 }), 'yyyy-MM-dd') // Monday
+      params.delivery_to = format(endOfWeek(now, { weekStartsOn: 1 }), 'yyyy-MM-dd')
+    }
+    return params
+  }
 
+  // One request per load: the page of orders plus the customers and products it
+  // references; the first load also brings every customer and product for the forms
   const loadData = async () => {
     try {
-      const [ordersRes, customersRes, productsRes] = await Promise.all([
-        getOrders(),
-        getCustomers(),
-        getProducts()
-      ])
-      setOrders(ordersRes.data)
-      setCustomers(customersRes.data)
-      setProducts(productsRes.data)
+      const { data } = await getOrdersBootstrap({ ...buildParams(), urgent_hours: 24, catalog: !catalogLoaded })
+      const customerMap = { ...customersById, ...data.customers }
+      const productMap = { ...productsById, ...data.products }
+      setCustomersById(customerMap)
+      setProductsById(productMap)
+      setCatalogLoaded(true)
+      setOrders(data.orders.map(order => ({
+        ...order,
+        customer: customerMap[order.customer_id],
+        items: order.items.map(item => ({ ...item, product: productMap[item.product_id] }))
+      })))
+      setTotal(data.total)
+      setUrgentCount(data.urgent_count)
     } catch (error) {
       console.error('Erro ao carregar dados:', error)
       alert('Erro ao carregar dados')
@@ -49,48 +86,22 @@ function OrdersPage() {
     }
   }
 
-  const applyFiltersAndSort = () => {
-    let result = [...orders]
-
-    // Week filter
-    if (weekFilter === 'current') {
-      const now = new Date()
-      const weekStart = startOfWeek(now, { weekStartsOn: 1 }) // Monday
-      const weekEnd = endOfWeek(now, { weekStartsOn: 1 })
-      result = result.filter(order => {
-        if (!order.delivery_date) return false
-        const deliveryDate = new Date(order.delivery_date)
-        return isWithinInterval(deliveryDate, { start: weekStart, end: weekEnd })
-      })
-    }
+  const customers = useMemo(() => Object.values(customersById), [customersById])
+  const products = useMemo(() => Object.values(productsById), [productsById])
 
-    // Sort
-    if (sortBy === 'delivery_date') {
-      result.sort((a, b) => {
-        if (!a.delivery_date) return 1
-        if (!b.delivery_date) return -1
-        return new Date(a.delivery_date) - new Date(b.delivery_date)
-      })
-    } else {
-      result.sort((a, b) => b.id - a.id)
-    }
-
-    setFilteredOrders(result)
+  const openCreateOrder = () => {
+    setShowModal(true)
   }
 
-  const getUrgentOrders = () => {
-    const now = new Date()
-    return orders.filter(order => {
-      if (!order.delivery_date || order.status === 'delivered') return false
-      const deliveryDate = new Date(order.delivery_date)
-      const hoursUntil = differenceInHours(deliveryDate, now)
-      return hoursUntil >= 0 && hoursUntil <= 24
-    })
+  const isUrgentOrder = (order) => {
+    if (!order.delivery_date || order.status === 'delivered') return false
+    const hoursUntil = differenceInHours(new Date(order.delivery_date), new Date())
+    return hoursUntil >= 0 && hoursUntil <= 24
   }
 
   const exportToCSV = () => {
     const headers = ['ID', 'Cliente', 'Data de Entrega', 'Estado', 'Total', 'Observações', 'Itens']
-    const rows = filteredOrders.map(order => [
+    const rows = orders.map(order => [
       order.id,
       order.customer?.name || `Cliente #${order.customer_id}`,
       order.delivery_date ? format(new Date(order.delivery_date), 'dd/MM/yyyy') : '',
@@ -115,7 +126,7 @@ function OrdersPage() {
   const handleSubmit = async (e) => {
     e.preventDefault()
     try {
-      await createOrder(formData)
+      await createOrder(formData, createKey)
       setShowModal(false)
       setFormData({ customer_id: '', delivery_date: '', notes: '', items: [] })
       loadData()
@@ -156,6 +167,7 @@ function OrdersPage() {
     try {
       const { data } = await getOrder(orderId)
       setEditingOrderId(orderId)
+      setEditingVersion(data.version)
       setFormData({
         customer_id: data.customer_id,
         delivery_date: data.delivery_date ? String(data.delivery_date).slice(0, 10) : '',
@@ -176,23 +188,36 @@ function OrdersPage() {
   const handleEditSubmit = async (e) => {
     e.preventDefault()
     try {
-      await updateOrder(editingOrderId, formData)
+      await updateOrder(editingOrderId, formData, editingVersion)
       setEditModal(false)
       setEditingOrderId(null)
+      setEditingVersion(null)
       setFormData({ customer_id: '', delivery_date: '', notes: '', items: [] })
       loadData()
     } catch (error) {
       console.error('Erro ao atualizar encomenda:', error)
+      if (isConflict(error)) {
+        alert('Esta encomenda foi alterada por outro utilizador. Reabra-a para ver a versão atual.')
+        setEditModal(false)
+        loadData()
+        return
+      }
       alert('Erro ao atualizar encomenda')
     }
   }
 
   const handleStatusChange = async (orderId, newStatus) => {
+    const order = orders.find(o => o.id === orderId)
     try {
-      await updateOrderStatus(orderId, newStatus)
+      await updateOrderStatus(orderId, newStatus, order?.version)
       loadData()
     } catch (error) {
       console.error('Erro ao atualizar status:', error)
+      if (isConflict(error)) {
+        alert(CONFLICT_MESSAGE)
+        loadData()
+        return
+      }
       alert('Erro ao atualizar status')
     }
   }
@@ -201,10 +226,15 @@ function OrdersPage() {
     if (!confirm('Tem certeza que deseja excluir esta encomenda?')) return
     
     try {
-      await deleteOrder(id)
+      await deleteOrder(id, orders.find(o => o.id === id)?.version)
       loadData()
     } catch (error) {
       console.error('Erro ao excluir encomenda:', error)
+      if (isConflict(error)) {
+        alert(CONFLICT_MESSAGE)
+        loadData()
+        return
+      }
       alert('Erro ao excluir encomenda')
     }
   }
@@ -247,11 +277,11 @@ function OrdersPage() {
     return <div className="loading">A carregar...</div>
   }
 
-  const urgentOrders = getUrgentOrders()
+  const pageCount = Math.max(1, Math.ceil(total / PAGE_SIZE))
 
   return (
     <div>
-      {urgentOrders.length > 0 && (
+      {urgentCount > 0 && (
         <div className="alert alert-warning" style={{
           margin: '1rem',
           padding: '1rem',
@@ -260,7 +290,7 @@ function OrdersPage() {
           borderRadius: '0.375rem',
           color: '#92400e'
         }}>
-          <strong>URGENTE: {urgentOrders.length} encomenda{urgentOrders.length > 1 ? 's' : ''} urgente{urgentOrders.length > 1 ? 's' : ''}!</strong>
+          <strong>URGENTE: {urgentCount} encomenda{urgentCount > 1 ? 's' : ''} urgente{urgentCount > 1 ? 's' : ''}!</strong>
           {' '}Para entrega nas próximas 24 horas.
         </div>
       )}
@@ -268,9 +298,16 @@ function OrdersPage() {
       <div className="page-header">
         <h2>Encomendas</h2>
         <div style={{ display: 'flex', gap: '0.5rem', alignItems: 'center' }}>
+          <input
+            type="search"
+            placeholder="Pesquisar cliente, produto, notas..."
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+            style={{ padding: '0.5rem', borderRadius: '0.375rem', border: '1px solid var(--gray-300)' }}
+          />
           <select
             value={weekFilter}
-            onChange={(e) => setWeekFilter(e.target.value)}
+            onChange={(e) => { setPage(0); setWeekFilter(e.target.value) }}
             style={{ padding: '0.5rem', borderRadius: '0.375rem', border: '1px solid var(--gray-300)' }}
           >
             <option value="all">Todas</option>
@@ -278,16 +315,16 @@ function OrdersPage() {
           </select>
           <select
             value={sortBy}
-            onChange={(e) => setSortBy(e.target.value)}
+            onChange={(e) => { setPage(0); setSortBy(e.target.value) }}
             style={{ padding: '0.5rem', borderRadius: '0.375rem', border: '1px solid var(--gray-300)' }}
           >
             <option value="delivery_date">Ordenar por Data</option>
-            <option value="id">Ordenar por ID</option>
+            <option value="-id">Ordenar por ID</option>
           </select>
           <button className="btn btn-secondary" onClick={exportToCSV}>
             📥 Exportar CSV
           </button>
-          <button className="btn btn-primary" onClick={() => setShowModal(true)}>
+          <button className="btn btn-primary" onClick={openCreateOrder}>
             + Nova Encomenda
           </button>
         </div>
@@ -306,15 +343,15 @@ function OrdersPage() {
             </tr>
           </thead>
           <tbody>
-            {filteredOrders.length === 0 ? (
+            {orders.length === 0 ? (
               <tr>
                 <td colSpan="6" className="empty-state">
                   Nenhuma encomenda cadastrada
                 </td>
               </tr>
             ) : (
-              filteredOrders.map((order) => {
-                const isUrgent = urgentOrders.some(u => u.id === order.id)
+              orders.map((order) => {
+                const isUrgent = isUrgentOrder(order)
                 return (
                   <tr key={order.id} style={isUrgent ? { background: '#fef3c7' } : {}}>
                     <td>
@@ -398,6 +435,18 @@ function OrdersPage() {
         </table>
       </div>
 
+      {total > PAGE_SIZE && (
+        <div style={{ display: 'flex', gap: '0.5rem', alignItems: 'center', justifyContent: 'flex-end', margin: '1rem' }}>
+          <button className="btn btn-secondary btn-small" disabled={page === 0} onClick={() => setPage(page - 1)}>
+            ← Anterior
+          </button>
+          <span>Página {page + 1} de {pageCount} ({total} encomendas)</span>
+          <button className="btn btn-secondary btn-small" disabled={page + 1 >= pageCount} onClick={() => setPage(page + 1)}>
+            Seguinte →
+          </button>
+        </div>
+      )}
+
       {/* Create Order Modal */}
       {showModal && (
         <div className="modal-overlay" onClick={() => setShowModal(false)}>
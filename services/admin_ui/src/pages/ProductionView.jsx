@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
-import { getProductionNeeds } from '../api'
+import { getPackingLists, getProductionNeeds } from '../api'
+import { useCacheRefresh } from '../queryCache'
 import '../styles/production.css'
 
 function ProductionView() {
@@ -12,6 +13,8 @@ function ProductionView() {
   const [needs, setNeeds] = useState([])
   const [showRounded, setShowRounded] = useState(true)
 
+  useCacheRefresh('analytics', () => loadNeeds(targetDate))
+
   useEffect(() => {
     loadNeeds(targetDate)
   }, [targetDate])
@@ -45,6 +48,19 @@ function ProductionView() {
     link.click()
   }
 
+  const downloadPackingLists = async (format) => {
+    try {
+      const { data } = await getPackingLists({ start: targetDate, format })
+      const link = document.createElement('a')
+      link.href = URL.createObjectURL(data)
+      link.download = `embalagem_${targetDate}.${format}`
+      link.click()
+    } catch (error) {
+      console.error('Erro ao carregar listas de embalagem:', error)
+      alert('Erro ao carregar listas de embalagem')
+    }
+  }
+
   const missingToBatch = (quantity, batchSize) => {
     const q = Number(quantity) || 0
     const b = Number(batchSize) || 0
@@ -73,6 +89,8 @@ function ProductionView() {
             Arredondar por batch
           </label>
           <button className="btn btn-secondary" onClick={exportCSV}>📥 Exportar CSV</button>
+          <button className="btn btn-secondary" onClick={() => downloadPackingLists('txt')}>🧾 Listas de embalagem</button>
+          <button className="btn btn-secondary" onClick={() => downloadPackingLists('csv')}>📥 Embalagem CSV</button>
         </div>
       </div>
 
@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
 import { createProduct, deleteProduct, getProducts, updateProduct } from '../api'
+import { useCacheRefresh } from '../queryCache'
 
 function ProductsPage() {
   const [products, setProducts] = useState([])
@@ -16,6 +17,8 @@ function ProductsPage() {
     batch_size: ''
   })
 
+  useCacheRefresh('products', () => loadProducts())
+
   useEffect(() => {
     loadProducts()
   }, [])
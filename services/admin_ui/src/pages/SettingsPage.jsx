@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
 import { createUser, deleteUser, getSettings, getUsers, updateSettings, updateUser } from '../api'
+import { useCacheRefresh } from '../queryCache'
 import '../styles/users.css'
 
 const DAYS_OF_WEEK = [
@@ -37,6 +38,9 @@ function SettingsPage() {
     is_active: true,
   })
 
+  useCacheRefresh('settings', () => loadSettings())
+  useCacheRefresh('users', () => fetchUsers())
+
   useEffect(() => {
     loadSettings()
     fetchUsers()
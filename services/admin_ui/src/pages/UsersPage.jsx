@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
 import { createUser, deleteUser, getUsers, updateUser } from '../api'
+import { useCacheRefresh } from '../queryCache'
 import '../styles/users.css'
 
 export default function UsersPage() {
@@ -16,6 +17,8 @@ export default function UsersPage() {
     is_active: true,
   })
 
+  useCacheRefresh('users', () => fetchUsers())
+
   useEffect(() => {
     fetchUsers()
   }, [])
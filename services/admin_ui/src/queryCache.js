@@ -0,0 +1,149 @@
+import { useEffect, useRef } from 'react'
+
+// Shared cache for GET requests, so moving between pages doesn't refetch everything.
+//
+// - Keys are arrays whose first element names the resource: ['products'],
+//   ['orders', params]. Mutations invalidate whole resources (see api.js).
+// - Concurrent calls for the same key share one request.
+// - Stale-while-revalidate: a cached response is returned at once; if it is older than
+//   the query's staleTime it is refetched in the background, and pages that subscribed
+//   with useCacheRefresh reload when the new data differs.
+// - persist: true also keeps the response in IndexedDB, so a reload of the app shows
+//   the last catalog immediately (and revalidates it). clearCache() on logout.
+
+const DB_NAME = 'fam-admin-cache'
+const STORE = 'queries'
+
+const entries = new Map() // key -> { resource, data, fetchedAt, promise }
+const listeners = new Set() // { resources, notify }
+
+const keyOf = (key) => JSON.stringify(key)
+
+// --- IndexedDB (best effort: private windows and old browsers just don't persist) ---
+let dbPromise = null
+
+function openDb() {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve) => {
+      if (!window.indexedDB) return resolve(null)
+      const request = window.indexedDB.open(DB_NAME, 1)
+      request.onupgradeneeded = () => request.result.createObjectStore(STORE)
+      request.onsuccess = () => resolve(request.result)
+      request.onerror = () => resolve(null)
+    })
+  }
+  return dbPromise
+}
+
+async function idb(mode, operation) {
+  const db = await openDb()
+  if (!db) return null
+  return new Promise((resolve) => {
+    const request = operation(db.transaction(STORE, mode).objectStore(STORE))
+    request.onsuccess = () => resolve(request.result)
+    request.onerror = () => resolve(null)
+  })
+}
+
+const readPersisted = (key) => idb('readonly', (store) => store.get(key))
+const writePersisted = (key, value) => idb('readwrite', (store) => store.put(value, key))
+const deletePersisted = (key) => idb('readwrite', (store) => store.delete(key))
+
+// --- Cache ---
+function notify(resource) {
+  for (const listener of listeners) {
+    if (listener.resources.includes(resource)) listener.notify()
+  }
+}
+
+function revalidate(key, entry, fetcher, persist) {
+  if (entry.promise) return entry.promise
+  entries.set(key, entry)
+  entry.promise = fetcher()
+    .then((response) => {
+      // Invalidated while in flight: the response may predate the change, drop it
+      if (entries.get(key) !== entry) return response
+      const changed = entry.data !== undefined && JSON.stringify(entry.data) !== JSON.stringify(response.data)
+      entry.data = response.data
+      entry.fetchedAt = Date.now()
+      if (persist) writePersisted(key, { data: entry.data, fetchedAt: entry.fetchedAt })
+      if (changed) notify(entry.resource)
+      return response
+    })
+    .finally(() => {
+      entry.promise = null
+    })
+  return entry.promise
+}
+
+/**
+ * Cached GET: `fetcher` is called only when there is no usable response for `key`.
+ * Resolves to `{ data }` like the axios response it stands for.
+ */
+export async function query(key, fetcher, { staleTime = 0, persist = false } = {}) {
+  const k = keyOf(key)
+  let entry = entries.get(k)
+  if (!entry && persist) {
+    const stored = await readPersisted(k)
+    entry = entries.get(k) // another call may have filled it meanwhile
+    if (!entry && stored) {
+      entry = { resource: key[0], data: stored.data, fetchedAt: stored.fetchedAt, promise: null }
+      entries.set(k, entry)
+    }
+  }
+  if (!entry) {
+    entry = { resource: key[0], data: undefined, fetchedAt: 0, promise: null }
+  }
+  if (entry.data === undefined) {
+    return revalidate(k, entry, fetcher, persist)
+  }
+  if (Date.now() - entry.fetchedAt > staleTime) {
+    revalidate(k, entry, fetcher, persist).catch(() => {})
+  }
+  return { data: entry.data }
+}
+
+/** Drop every cached response of these resources and tell subscribed pages to reload. */
+export function invalidate(...resources) {
+  for (const [key, entry] of entries) {
+    if (resources.includes(entry.resource)) {
+      entries.delete(key)
+      deletePersisted(key)
+    }
+  }
+  // Persisted entries not loaded in this session
+  idb('readwrite', (store) => store.getAllKeys()).then((keys) => {
+    for (const key of keys || []) {
+      if (resources.includes(JSON.parse(key)[0])) deletePersisted(key)
+    }
+  })
+  resources.forEach(notify)
+}
+
+/** Run a mutation, then invalidate the resources it changes (also when it failed: a
+ * 409/412 means the cached copy was already out of date). */
+export function mutate(request, ...resources) {
+  return request.finally(() => invalidate(...resources))
+}
+
+/** Forget everything, in memory and in IndexedDB (logout: the next user mustn't see it). */
+export function clearCache() {
+  entries.clear()
+  idb('readwrite', (store) => store.clear())
+}
+
+/**
+ * Call `reload` whenever cached data of one of `resources` changes: a background
+ * revalidation brought different data, or a mutation invalidated it. `reload` should
+ * load through the cached api.js functions, which then return the fresh response.
+ */
+export function useCacheRefresh(resources, reload) {
+  const latest = useRef(reload)
+  latest.current = reload
+  const names = [].concat(resources)
+  useEffect(() => {
+    const listener = { resources: names, notify: () => latest.current() }
+    listeners.add(listener)
+    return () => listeners.delete(listener)
+  }, [names.join(',')])
+}
@@ -1,8 +1,39 @@
 import react from '@vitejs/plugin-react'
 import { defineConfig } from 'vite'
 
+// Vendor libraries in their own long-lived chunks, so a release that only changes app
+// code keeps them cached, and each heavy one loads with the pages that use it.
+const VENDOR_CHUNKS = {
+  'vendor-react': ['react', 'react-dom', 'react-router', 'react-router-dom', '@remix-run/router', 'scheduler'],
+  'vendor-charts': ['recharts', 'recharts-scale', 'victory-vendor', 'react-smooth', /^d3-/],
+  'vendor-calendar': ['react-big-calendar', 'react-overlays', 'date-arithmetic'],
+  'vendor-dnd': ['@hello-pangea/dnd', 'react-redux', 'redux', 'css-box-model', 'raf-schd'],
+}
+
+function packageName(id) {
+  const path = id.split('node_modules/').pop()
+  const parts = path.split('/')
+  return parts[0].startsWith('@') ? `${parts[0]}/${parts[1]}` : parts[0]
+}
+
+function manualChunks(id) {
+  if (!id.includes('node_modules/')) return undefined
+  const name = packageName(id)
+  for (const [chunk, packages] of Object.entries(VENDOR_CHUNKS)) {
+    if (packages.some((p) => (p instanceof RegExp ? p.test(name) : p === name))) return chunk
+  }
+  return undefined
+}
+
 export default defineConfig({
   plugins: [react()],
+  build: {
+    // dist/.vite/manifest.json is what scripts/check-bundle-size.js reads
+    manifest: true,
+    rollupOptions: {
+      output: { manualChunks }
+    }
+  },
   server: {
     host: '0.0.0.0',
     port: 3000,
@@ -0,0 +1,60 @@
+"""Alembic environment: migrates the database at DATABASE_URL to the models in app/models.py."""
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models, partitions  # noqa: F401  models registers every table on Base.metadata
+from app.db import DATABASE_URL, Base, get_engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Keep autogenerate away from what is managed outside the models: the partitioned
+    history table and its partitions (partitions.py) and the trigram indexes."""
+    if type_ == 'table':
+        if name in partitions.PARTITIONED_TABLES or name.endswith('_default'):
+            return False
+        if any(name.startswith(table) and partitions.PARTITION_NAME_RE.search(name)
+               for table in partitions.PARTITIONED_TABLES):
+            return False
+    if type_ == 'index' and name and name.endswith('_trgm'):
+        return False
+    return True
+
+
+def run_migrations_offline() -> None:
+    """Emit the SQL instead of running it (alembic upgrade head --sql)."""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={'paramstyle': 'named'},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    # app.migrations.upgrade() may hand over an open connection
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+    with get_engine().connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
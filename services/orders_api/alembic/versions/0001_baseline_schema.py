@@ -0,0 +1,472 @@
+"""Baseline schema
+
+The schema as create_all at app import plus migrate.py used to leave it. A database
+that already has the tables (created that way) gets the idempotent statements
+migrate.py ran instead of the CREATE TABLEs, so existing deployments upgrade in place.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 02:53:56.919857
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from app import history, partitions
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRIGRAM_INDEXES = {
+    'ix_customers_name_trgm': ('customers', 'name'),
+    'ix_products_name_trgm': ('products', 'name'),
+    'ix_orders_notes_trgm': ('orders', 'notes'),
+}
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table('orders'):
+        if bind.dialect.name == 'postgresql':
+            _upgrade_legacy(bind)
+        # Other databases were created by create_all and are already current
+    else:
+        _create_tables()
+
+    if bind.dialect.name == 'postgresql':
+        _create_trigram_indexes(bind)
+        # Monthly range partitions for order_status_history (no-op once converted)
+        partitions.partition_order_status_history(bind)
+    # Status history is recorded by a trigger on orders
+    history.install_triggers(bind)
+    bind.execute(text("""
+        INSERT INTO settings (production_day, order_cutoff_day, order_cutoff_hour, order_cutoff_minute)
+        SELECT 2, 6, 23, 59
+        WHERE NOT EXISTS (SELECT 1 FROM settings)
+    """))
+
+
+def _create_tables() -> None:
+    op.create_table('customers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('phone', sa.String(), nullable=True),
+    sa.Column('address', sa.String(), nullable=True),
+    sa.Column('pickup_location', sa.String(), nullable=True),
+    sa.Column('is_subscription', sa.Boolean(), nullable=False),
+    sa.Column('last_order_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_customers_last_order_at'), 'customers', ['last_order_at'], unique=False)
+    op.create_table('idempotency_keys',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('method', sa.String(length=10), nullable=False),
+    sa.Column('path', sa.Text(), nullable=False),
+    sa.Column('request_hash', sa.String(length=64), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('response_body', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key', 'method', 'path', name='uq_idempotency_keys_key_method_path')
+    )
+    op.create_index(op.f('ix_idempotency_keys_expires_at'), 'idempotency_keys', ['expires_at'], unique=False)
+    op.create_table('order_items_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_items_archive_order_id'), 'order_items_archive', ['order_id'], unique=False)
+    op.create_table('order_status_history_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('encomendado', 'pago', 'preparing', 'delivered', name='orderstatus'), nullable=False),
+    sa.Column('changed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_status_history_archive_order_id'), 'order_status_history_archive', ['order_id'], unique=False)
+    op.create_table('orders_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('customer_id', sa.Integer(), nullable=False),
+    sa.Column('delivery_date', sa.Date(), nullable=True),
+    sa.Column('status', sa.Enum('encomendado', 'pago', 'preparing', 'delivered', name='orderstatus'), nullable=False),
+    sa.Column('total', sa.Numeric(precision=12, scale=2), nullable=True),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.Column('recurring_plan_id', sa.Integer(), nullable=True),
+    sa.Column('is_auto_generated', sa.Boolean(), nullable=False),
+    sa.Column('is_monthly_payment', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_orders_archive_customer_id'), 'orders_archive', ['customer_id'], unique=False)
+    op.create_index(op.f('ix_orders_archive_delivery_date'), 'orders_archive', ['delivery_date'], unique=False)
+    op.create_table('products',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sku', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('cost_price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.Column('batch_size', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sku')
+    )
+    op.create_table('settings',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('production_day', sa.Integer(), nullable=False),
+    sa.Column('order_cutoff_day', sa.Integer(), nullable=False),
+    sa.Column('order_cutoff_hour', sa.Integer(), nullable=False),
+    sa.Column('order_cutoff_minute', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(), nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('full_name', sa.String(), nullable=True),
+    sa.Column('hashed_password', sa.String(), nullable=False),
+    sa.Column('role', sa.Enum('admin', 'manager', 'operator', name='userrole'), nullable=False),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('last_login', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+    op.create_table('recurring_plans',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('customer_id', sa.Integer(), nullable=False),
+    sa.Column('day_of_week', sa.Integer(), nullable=False),
+    sa.Column('start_date', sa.Date(), nullable=False),
+    sa.Column('end_date', sa.Date(), nullable=True),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.Column('prepaid_month', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('orders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('customer_id', sa.Integer(), nullable=False),
+    sa.Column('delivery_date', sa.Date(), nullable=True),
+    sa.Column('status', sa.Enum('encomendado', 'pago', 'preparing', 'delivered', name='orderstatus'), nullable=False),
+    sa.Column('total', sa.Numeric(precision=12, scale=2), nullable=True),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.Column('recurring_plan_id', sa.Integer(), nullable=True),
+    sa.Column('is_auto_generated', sa.Boolean(), nullable=False),
+    sa.Column('is_monthly_payment', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+    sa.ForeignKeyConstraint(['recurring_plan_id'], ['recurring_plans.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_orders_customer_created', 'orders', ['customer_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_orders_delivery_date'), 'orders', ['delivery_date'], unique=False)
+    op.create_index('uq_orders_plan_delivery_generated', 'orders', ['recurring_plan_id', 'delivery_date'], unique=True, postgresql_where=sa.text('is_auto_generated'), sqlite_where=sa.text('is_auto_generated'))
+    op.create_index('uq_orders_plan_delivery_payment', 'orders', ['recurring_plan_id', 'delivery_date'], unique=True, postgresql_where=sa.text('is_monthly_payment'), sqlite_where=sa.text('is_monthly_payment'))
+    op.create_table('recurring_plan_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('plan_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['plan_id'], ['recurring_plans.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('order_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_items_order_id'), 'order_items', ['order_id'], unique=False)
+    op.create_index(op.f('ix_order_items_product_id'), 'order_items', ['product_id'], unique=False)
+    op.create_table('order_status_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('encomendado', 'pago', 'preparing', 'delivered', name='orderstatus'), nullable=False),
+    sa.Column('changed_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def _create_trigram_indexes(bind) -> None:
+    """Trigram indexes for ILIKE substring search; skipped where pg_trgm isn't installed."""
+    available = bind.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+    if not available:
+        print("[WARN] pg_trgm is not available; order search will scan instead of using trigram indexes")
+        return
+    bind.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        bind.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)"))
+
+
+def _upgrade_legacy(bind) -> None:
+    """What migrate.py did on Postgres databases created by create_all."""
+    # Add pickup_location to customers
+    bind.execute(text(
+        """
+        ALTER TABLE customers
+        ADD COLUMN IF NOT EXISTS pickup_location TEXT;
+        """
+    ))
+    # Add new columns to products table
+    bind.execute(text("""
+        ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS description TEXT,
+        ADD COLUMN IF NOT EXISTS active BOOLEAN DEFAULT TRUE NOT NULL;
+    """))
+
+    # Conditionally rename columns if they exist
+    price_exists = bind.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name='products' AND column_name='price'
+    """)).scalar() is not None
+    if price_exists:
+        bind.execute(text("""
+            ALTER TABLE products
+            RENAME COLUMN price TO unit_price;
+        """))
+
+    cost_exists = bind.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name='products' AND column_name='cost'
+    """)).scalar() is not None
+    if cost_exists:
+        bind.execute(text("""
+            ALTER TABLE products
+            RENAME COLUMN cost TO cost_price;
+        """))
+
+    # Make sku NOT NULL (it's already unique)
+    bind.execute(text("""
+        UPDATE products SET sku = 'SKU-' || id WHERE sku IS NULL;
+        ALTER TABLE products ALTER COLUMN sku SET NOT NULL;
+    """))
+
+    # Add notes column to orders table
+    bind.execute(text("""
+        ALTER TABLE orders
+        ADD COLUMN IF NOT EXISTS notes TEXT;
+    """))
+
+    # Add batch_size to products
+    bind.execute(text("""
+        ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS batch_size INTEGER;
+    """))
+
+    # Create recurring tables
+    bind.execute(text("""
+        CREATE TABLE IF NOT EXISTS recurring_plans (
+            id SERIAL PRIMARY KEY,
+            customer_id INTEGER NOT NULL REFERENCES customers(id),
+            day_of_week INTEGER NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE,
+            active BOOLEAN NOT NULL DEFAULT TRUE,
+            prepaid_month BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        );
+    """))
+    bind.execute(text("""
+        CREATE TABLE IF NOT EXISTS recurring_plan_items (
+            id SERIAL PRIMARY KEY,
+            plan_id INTEGER NOT NULL REFERENCES recurring_plans(id),
+            product_id INTEGER NOT NULL REFERENCES products(id),
+            quantity INTEGER NOT NULL DEFAULT 1
+        );
+    """))
+
+    # Add subscription field to customers
+    bind.execute(text("""
+        ALTER TABLE customers
+        ADD COLUMN IF NOT EXISTS is_subscription BOOLEAN DEFAULT FALSE NOT NULL;
+    """))
+
+    # Add subscription tracking fields to orders
+    bind.execute(text("""
+        ALTER TABLE orders
+        ADD COLUMN IF NOT EXISTS recurring_plan_id INTEGER REFERENCES recurring_plans(id),
+        ADD COLUMN IF NOT EXISTS is_auto_generated BOOLEAN DEFAULT FALSE NOT NULL,
+        ADD COLUMN IF NOT EXISTS is_monthly_payment BOOLEAN DEFAULT FALSE NOT NULL;
+    """))
+
+    # Create settings table
+    bind.execute(text("""
+        CREATE TABLE IF NOT EXISTS settings (
+            id SERIAL PRIMARY KEY,
+            production_day INTEGER NOT NULL DEFAULT 2,
+            order_cutoff_day INTEGER NOT NULL DEFAULT 6,
+            order_cutoff_hour INTEGER NOT NULL DEFAULT 23,
+            order_cutoff_minute INTEGER NOT NULL DEFAULT 59,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+    """))
+
+    # Denormalized last order date for inactive-customer analytics
+    bind.execute(text("""
+        ALTER TABLE customers
+        ADD COLUMN IF NOT EXISTS last_order_at TIMESTAMPTZ;
+    """))
+    bind.execute(text("""
+        UPDATE customers c
+        SET last_order_at = o.last_order_at
+        FROM (
+            SELECT customer_id, MAX(created_at) AS last_order_at
+            FROM orders
+            GROUP BY customer_id
+        ) o
+        WHERE o.customer_id = c.id
+          AND c.last_order_at IS DISTINCT FROM o.last_order_at;
+    """))
+    bind.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_customers_last_order_at ON customers (last_order_at);
+        CREATE INDEX IF NOT EXISTS ix_orders_customer_created ON orders (customer_id, created_at);
+        CREATE INDEX IF NOT EXISTS ix_orders_delivery_date ON orders (delivery_date);
+        CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id);
+        CREATE INDEX IF NOT EXISTS ix_order_items_product_id ON order_items (product_id);
+    """))
+
+    # Archive tables for old delivered orders (python maintenance.py archive)
+    bind.execute(text("""
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            customer_id INTEGER NOT NULL,
+            delivery_date DATE,
+            status orderstatus NOT NULL,
+            total NUMERIC(12, 2) DEFAULT 0,
+            notes TEXT,
+            recurring_plan_id INTEGER,
+            is_auto_generated BOOLEAN NOT NULL DEFAULT FALSE,
+            is_monthly_payment BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMPTZ,
+            archived_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS ix_orders_archive_customer_id ON orders_archive (customer_id);
+        CREATE INDEX IF NOT EXISTS ix_orders_archive_delivery_date ON orders_archive (delivery_date);
+        CREATE TABLE IF NOT EXISTS order_items_archive (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            unit_price NUMERIC(10, 2) NOT NULL,
+            created_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS ix_order_items_archive_order_id ON order_items_archive (order_id);
+        CREATE TABLE IF NOT EXISTS order_status_history_archive (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            status orderstatus NOT NULL,
+            changed_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS ix_order_status_history_archive_order_id ON order_status_history_archive (order_id);
+    """))
+
+    # Optimistic locking version for orders, idempotency key store
+    bind.execute(text("""
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+        ALTER TABLE orders_archive ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id SERIAL PRIMARY KEY,
+            key VARCHAR(255) NOT NULL,
+            method VARCHAR(10) NOT NULL,
+            path TEXT NOT NULL,
+            request_hash VARCHAR(64) NOT NULL,
+            status_code INTEGER,
+            response_body TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            expires_at TIMESTAMPTZ NOT NULL,
+            CONSTRAINT uq_idempotency_keys_key_method_path UNIQUE (key, method, path)
+        );
+        CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+    """))
+
+    # At most one generated order per plan and delivery date and one monthly payment
+    # per plan and date. crud's ON CONFLICT inserts need these indexes, so existing
+    # duplicates abort the upgrade (nothing is stamped) until they are resolved by hand
+    duplicates = bind.execute(text("""
+        SELECT recurring_plan_id, delivery_date, is_monthly_payment, COUNT(*), STRING_AGG(id::text, ', ' ORDER BY id)
+        FROM orders
+        WHERE recurring_plan_id IS NOT NULL AND (is_auto_generated OR is_monthly_payment)
+        GROUP BY recurring_plan_id, delivery_date, is_monthly_payment
+        HAVING COUNT(*) > 1
+    """)).all()
+    if duplicates:
+        lines = [
+            f"  plan {plan_id} {delivery_date}: {count} {'payment' if is_payment else 'generated'} orders ({ids})"
+            for plan_id, delivery_date, is_payment, count, ids in duplicates
+        ]
+        raise RuntimeError(
+            f"{len(duplicates)} duplicate subscription orders; delete the extra orders and run "
+            "`alembic upgrade head` again:\n" + '\n'.join(lines)
+        )
+    bind.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_plan_delivery_generated
+            ON orders (recurring_plan_id, delivery_date) WHERE is_auto_generated;
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_plan_delivery_payment
+            ON orders (recurring_plan_id, delivery_date) WHERE is_monthly_payment;
+    """))
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    history.drop_triggers(bind)
+    op.drop_table('order_status_history')
+    op.drop_index(op.f('ix_order_items_product_id'), table_name='order_items')
+    op.drop_index(op.f('ix_order_items_order_id'), table_name='order_items')
+    op.drop_table('order_items')
+    op.drop_table('recurring_plan_items')
+    op.drop_index('uq_orders_plan_delivery_payment', table_name='orders', postgresql_where=sa.text('is_monthly_payment'), sqlite_where=sa.text('is_monthly_payment'))
+    op.drop_index('uq_orders_plan_delivery_generated', table_name='orders', postgresql_where=sa.text('is_auto_generated'), sqlite_where=sa.text('is_auto_generated'))
+    op.drop_index(op.f('ix_orders_delivery_date'), table_name='orders')
+    op.drop_index('ix_orders_customer_created', table_name='orders')
+    op.drop_table('orders')
+    op.drop_table('recurring_plans')
+    op.drop_index(op.f('ix_users_username'), table_name='users')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_table('users')
+    op.drop_table('settings')
+    op.drop_table('products')
+    op.drop_index(op.f('ix_orders_archive_delivery_date'), table_name='orders_archive')
+    op.drop_index(op.f('ix_orders_archive_customer_id'), table_name='orders_archive')
+    op.drop_table('orders_archive')
+    op.drop_index(op.f('ix_order_status_history_archive_order_id'), table_name='order_status_history_archive')
+    op.drop_table('order_status_history_archive')
+    op.drop_index(op.f('ix_order_items_archive_order_id'), table_name='order_items_archive')
+    op.drop_table('order_items_archive')
+    op.drop_index(op.f('ix_idempotency_keys_expires_at'), table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
+    op.drop_index(op.f('ix_customers_last_order_at'), table_name='customers')
+    op.drop_table('customers')
+    if bind.dialect.name == 'postgresql':
+        bind.execute(text("DROP FUNCTION IF EXISTS record_order_status()"))
+        bind.execute(text("DROP TYPE IF EXISTS orderstatus"))
+        bind.execute(text("DROP TYPE IF EXISTS userrole"))
@@ -0,0 +1,44 @@
+"""Demand forecast
+
+Fitted per-product, per-weekday smoothing parameters for app/forecast.py and the
+day they were fitted through. Both tables are derived data, refilled on demand.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 03:14:18.909256
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('forecast_params',
+    sa.Column('product_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('weekday', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('level', sa.Float(), nullable=False),
+    sa.Column('variance', sa.Float(), nullable=False),
+    sa.Column('observations', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('product_id', 'weekday')
+    )
+    op.create_table('forecast_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fitted_through', sa.Date(), nullable=False),
+    sa.Column('alpha', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('forecast_state')
+    op.drop_table('forecast_params')
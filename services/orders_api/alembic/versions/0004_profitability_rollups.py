@@ -0,0 +1,44 @@
+"""Profitability rollups
+
+Per-month margin rollups by customer and product for app/profitability.py. Only
+closed months are stored; they are derived data and can be cleared to recompute.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 03:16:43.562283
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('profitability_months',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('customer_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('product_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('cost', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('uncosted_revenue', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.PrimaryKeyConstraint('month', 'customer_id', 'product_id')
+    )
+    op.create_table('profitability_periods',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('month')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('profitability_periods')
+    op.drop_table('profitability_months')
@@ -0,0 +1,46 @@
+"""Outbox events
+
+Transactional outbox for order lifecycle events (order.created, order.paid,
+order.delivered), written with the order change and delivered by app/outbox.py.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 03:31:18.666169
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(length=64), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.Column('available_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('delivered_to', sa.JSON(), nullable=True),
+    sa.Column('dispatched_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('failed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_outbox_events_order_id'), 'outbox_events', ['order_id'], unique=False)
+    op.create_index('ix_outbox_events_pending', 'outbox_events', ['available_at', 'id'], unique=False, postgresql_where=sa.text('dispatched_at IS NULL AND failed_at IS NULL'), sqlite_where=sa.text('dispatched_at IS NULL AND failed_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_events_pending', table_name='outbox_events', postgresql_where=sa.text('dispatched_at IS NULL AND failed_at IS NULL'), sqlite_where=sa.text('dispatched_at IS NULL AND failed_at IS NULL'))
+    op.drop_index(op.f('ix_outbox_events_order_id'), table_name='outbox_events')
+    op.drop_table('outbox_events')
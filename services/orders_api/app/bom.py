@@ -0,0 +1,77 @@
+"""Ingredient needs from production needs (bill-of-materials explosion).
+
+Production per delivery date is computed as in crud.get_production_needs_by_date:
+ordered units rounded up to the product's batch_size. A product's recipe lists the
+ingredients for one batch of batch_yield units, so the batches to make are
+ceil(units / batch_yield) and the ingredient needs are one matrix product:
+
+    batches (dates x products) @ recipe (products x ingredients) = needs (dates x ingredients)
+
+The matrices are filled from index arrays with numpy, so a purchasing plan over many
+weeks costs a few array operations rather than a Python loop per order line.
+"""
+import numpy as np
+
+
+def _index(values):
+    """Sorted distinct values and, for each input value, its position among them."""
+    distinct, positions = np.unique(np.asarray(values, dtype=np.int64), return_inverse=True)
+    return distinct, positions.reshape(-1)
+
+
+def explode(production_rows, recipe_rows):
+    """
+    production_rows: (delivery_date, product_id, quantity, batch_size), one per date and product.
+    recipe_rows: (product_id, batch_yield, ingredient_id, quantity per batch).
+
+    Returns a dict of arrays: `dates` (ordinals), `product_ids`, `ingredient_ids`,
+    `units` and `batches` per product over the whole range, `needs` (dates x
+    ingredients) and `has_recipe` per product. Products without a recipe count towards
+    units but need no ingredients.
+    """
+    if not production_rows:
+        return {'dates': np.empty(0, np.int64), 'product_ids': np.empty(0, np.int64),
+                'ingredient_ids': np.empty(0, np.int64), 'units': np.empty(0), 'batches': np.empty(0),
+                'needs': np.empty((0, 0)), 'has_recipe': np.empty(0, bool)}
+
+    ordinals, product_col, quantity, batch_size = zip(*(
+        (d.toordinal(), product_id, qty, size) for d, product_id, qty, size in production_rows
+    ))
+    dates, date_idx = _index(ordinals)
+    product_ids, product_idx = _index(product_col)
+    quantity = np.asarray(quantity, dtype=np.int64)
+    batch_size = np.maximum(np.asarray([size or 1 for size in batch_size], dtype=np.int64), 1)
+    rounded = -(-quantity // batch_size) * batch_size
+
+    # Units per batch for each product: the recipe's batch_yield, else its batch_size
+    batch_yield = np.ones(len(product_ids), dtype=np.int64)
+    batch_yield[product_idx] = batch_size
+    recipe = np.zeros((len(product_ids), 0))
+    has_recipe = np.zeros(len(product_ids), dtype=bool)
+    ingredient_ids = np.empty(0, np.int64)
+    if recipe_rows:
+        recipe_product, recipe_yield, recipe_ingredient, per_batch = zip(*recipe_rows)
+        row_idx = np.searchsorted(product_ids, np.asarray(recipe_product, dtype=np.int64))
+        known = (row_idx < len(product_ids)) & (product_ids[np.minimum(row_idx, len(product_ids) - 1)]
+                                                == np.asarray(recipe_product, dtype=np.int64))
+        row_idx = row_idx[known]
+        ingredient_ids, col_idx = _index(np.asarray(recipe_ingredient, dtype=np.int64)[known])
+        recipe = np.zeros((len(product_ids), len(ingredient_ids)))
+        np.add.at(recipe, (row_idx, col_idx), np.asarray(per_batch, dtype=float)[known])
+        has_recipe[row_idx] = True
+        yields = np.asarray([y or 0 for y in recipe_yield], dtype=np.int64)[known]
+        custom = yields > 0
+        batch_yield[row_idx[custom]] = yields[custom]
+
+    units = np.zeros((len(dates), len(product_ids)), dtype=np.int64)
+    units[date_idx, product_idx] = rounded
+    batches = -(-units // batch_yield)
+    return {
+        'dates': dates,
+        'product_ids': product_ids,
+        'ingredient_ids': ingredient_ids,
+        'units': units.sum(axis=0),
+        'batches': batches.sum(axis=0),
+        'needs': batches @ recipe,
+        'has_recipe': has_recipe,
+    }
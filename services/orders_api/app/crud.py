@@ -1,15 +1,35 @@
+import logging
 from decimal import Decimal
 from typing import Any, Dict, List, Optional
 
-from sqlalchemy import extract
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload
 
-from . import models, schemas
+from . import models, outbox, projection, schemas
+
+logger = logging.getLogger(__name__)
+
+
+def _order_load_options(fieldset=None, embed=True):
+    """Loader options for order lists: the requested fieldset, or the full tree eagerly.
+    embed=False loads only the items, for responses that send customers and products
+    separately (see get_orders_bootstrap)."""
+    if fieldset is not None:
+        return projection.loader_options(models.Order, fieldset)
+    if not embed:
+        return [selectinload(models.Order.items)]
+    return [
+        joinedload(models.Order.customer),
+        selectinload(models.Order.items).joinedload(models.OrderItem.product),
+    ]
 
 
 # --- Customers ---
-def get_customers(db: Session):
-    return db.query(models.Customer).all()
+def get_customers(db: Session, fieldset=None):
+    query = db.query(models.Customer)
+    if fieldset is not None:
+        query = query.options(*projection.loader_options(models.Customer, fieldset))
+    return query.all()
 
 
 def get_customer(db: Session, customer_id: int):
@@ -45,8 +65,10 @@ def delete_customer(db: Session, customer_id: int):
 
 
 # --- Products ---
-def get_products(db: Session, active: Optional[bool] = None):
+def get_products(db: Session, active: Optional[bool] = None, fieldset=None):
     query = db.query(models.Product)
+    if fieldset is not None:
+        query = query.options(*projection.loader_options(models.Product, fieldset))
     if active is not None:
         query = query.filter(models.Product.active == active)
     return query.all()
@@ -79,14 +101,177 @@ def delete_product(db: Session, product_id: int):
     db_p = get_product(db, product_id)
     if not db_p:
         return False
+    recipe = get_recipe(db, product_id)
+    if recipe:
+        db.delete(recipe)
     db.delete(db_p)
     db.commit()
     return True
 
 
+# --- Bill of materials ---
+def get_ingredients(db: Session):
+    return db.query(models.Ingredient).order_by(models.Ingredient.name).all()
+
+
+def get_ingredient(db: Session, ingredient_id: int):
+    return db.get(models.Ingredient, ingredient_id)
+
+
+def create_ingredient(db: Session, ingredient: schemas.IngredientCreate):
+    db_i = models.Ingredient(**ingredient.dict())
+    db.add(db_i)
+    db.commit()
+    db.refresh(db_i)
+    return db_i
+
+
+def update_ingredient(db: Session, ingredient_id: int, ingredient: schemas.IngredientCreate):
+    db_i = get_ingredient(db, ingredient_id)
+    if not db_i:
+        return None
+    for key, value in ingredient.dict().items():
+        setattr(db_i, key, value)
+    db.commit()
+    db.refresh(db_i)
+    return db_i
+
+
+def delete_ingredient(db: Session, ingredient_id: int):
+    """False if not found; ValueError while a recipe still uses it."""
+    db_i = get_ingredient(db, ingredient_id)
+    if not db_i:
+        return False
+    used = db.query(models.RecipeIngredient.id).filter(models.RecipeIngredient.ingredient_id == ingredient_id).first()
+    if used:
+        raise ValueError('Ingredient is used in recipes')
+    db.delete(db_i)
+    db.commit()
+    return True
+
+
+def get_recipe(db: Session, product_id: int):
+    return (
+        db.query(models.Recipe)
+        .options(selectinload(models.Recipe.ingredients).joinedload(models.RecipeIngredient.ingredient))
+        .filter(models.Recipe.product_id == product_id)
+        .first()
+    )
+
+
+def set_recipe(db: Session, product_id: int, payload: schemas.RecipeCreate):
+    """Create or replace a product's recipe; None if the product doesn't exist."""
+    if not get_product(db, product_id):
+        return None
+    ingredient_ids = [line.ingredient_id for line in payload.ingredients]
+    if len(set(ingredient_ids)) != len(ingredient_ids):
+        raise ValueError('Each ingredient may appear only once in a recipe')
+    found = {i for (i,) in db.query(models.Ingredient.id).filter(models.Ingredient.id.in_(ingredient_ids))}
+    missing = sorted(set(ingredient_ids) - found)
+    if missing:
+        raise ValueError(f'Unknown ingredient ids: {missing}')
+    recipe = get_recipe(db, product_id) or models.Recipe(product_id=product_id)
+    recipe.batch_yield = payload.batch_yield  # type: ignore[assignment]
+    recipe.notes = payload.notes  # type: ignore[assignment]
+    recipe.ingredients = [
+        models.RecipeIngredient(ingredient_id=line.ingredient_id, quantity=line.quantity)
+        for line in payload.ingredients
+    ]
+    db.add(recipe)
+    db.commit()
+    return get_recipe(db, product_id)
+
+
+def delete_recipe(db: Session, product_id: int) -> bool:
+    recipe = get_recipe(db, product_id)
+    if not recipe:
+        return False
+    db.delete(recipe)
+    db.commit()
+    return True
+
+
+def get_ingredient_needs(db: Session, start, end, include_delivered: bool = False, by_date: bool = False):
+    """
+    Ingredients needed for the deliveries in [start, end]: production per date and
+    product from one GROUP BY, the recipes of those products from one query, and the
+    explosion as a matrix product in bom.explode.
+    """
+    from datetime import date as date_type
+
+    from . import bom
+
+    production = (
+        db.query(
+            models.Order.delivery_date,
+            models.OrderItem.product_id,
+            func.sum(models.OrderItem.quantity),
+            models.Product.batch_size,
+        )
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .join(models.Product, models.Product.id == models.OrderItem.product_id)
+        .filter(models.Order.delivery_date >= start, models.Order.delivery_date <= end)
+    )
+    if not include_delivered:
+        production = production.filter(models.Order.status != models.OrderStatus.delivered)
+    production_rows = production.group_by(
+        models.Order.delivery_date, models.OrderItem.product_id, models.Product.batch_size
+    ).all()
+
+    product_ids = sorted({product_id for _, product_id, _, _ in production_rows})
+    recipe_rows = []
+    if product_ids:
+        recipe_rows = (
+            db.query(models.Recipe.product_id, models.Recipe.batch_yield,
+                     models.RecipeIngredient.ingredient_id, models.RecipeIngredient.quantity)
+            .join(models.RecipeIngredient, models.RecipeIngredient.recipe_id == models.Recipe.id)
+            .filter(models.Recipe.product_id.in_(product_ids))
+            .all()
+        )
+    result = bom.explode(production_rows, recipe_rows)
+
+    ingredient_ids = [int(i) for i in result['ingredient_ids']]
+    ingredients = {i.id: i for i in db.query(models.Ingredient).filter(models.Ingredient.id.in_(ingredient_ids))}
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids))}
+    totals = result['needs'].sum(axis=0)
+
+    def ingredient_entry(column, quantity):
+        ingredient = ingredients[ingredient_ids[column]]
+        return {'ingredient_id': ingredient.id, 'name': ingredient.name, 'unit': ingredient.unit,
+                'quantity': round(float(quantity), 3)}
+
+    needs = {
+        'start': start,
+        'end': end,
+        'ingredients': sorted((ingredient_entry(c, q) for c, q in enumerate(totals)), key=lambda i: i['name']),
+        'products': [
+            {
+                'product_id': int(product_id),
+                'sku': products[int(product_id)].sku,
+                'name': products[int(product_id)].name,
+                'quantity': int(units),
+                'batches': int(batches),
+                'has_recipe': bool(has_recipe),
+            }
+            for product_id, units, batches, has_recipe in zip(
+                result['product_ids'], result['units'], result['batches'], result['has_recipe'])
+        ],
+    }
+    needs['products'].sort(key=lambda p: p['name'])
+    if by_date:
+        needs['by_date'] = [
+            {
+                'date': date_type.fromordinal(int(ordinal)),
+                'ingredients': [ingredient_entry(c, q) for c, q in enumerate(row) if q],
+            }
+            for ordinal, row in zip(result['dates'], result['needs'])
+        ]
+    return needs
+
+
 # --- Orders ---
-def get_orders(db: Session, status: Optional[str] = None, customer_id: Optional[int] = None):
-    query = db.query(models.Order)
+def get_orders(db: Session, status: Optional[str] = None, customer_id: Optional[int] = None, fieldset=None):
+    query = db.query(models.Order).options(*_order_load_options(fieldset))
     if status:
         query = query.filter(models.Order.status == status)
     if customer_id:
@@ -94,15 +279,122 @@ def get_orders(db: Session, status: Optional[str] = None, customer_id: Optional[
     return query.all()
 
 
+ORDER_SEARCH_SORTS = {
+    'delivery_date': lambda: (models.Order.delivery_date.asc().nullslast(), models.Order.id.asc()),
+    '-delivery_date': lambda: (models.Order.delivery_date.desc().nullslast(), models.Order.id.desc()),
+    'created_at': lambda: (models.Order.created_at.asc(), models.Order.id.asc()),
+    '-created_at': lambda: (models.Order.created_at.desc(), models.Order.id.desc()),
+    'id': lambda: (models.Order.id.asc(),),
+    '-id': lambda: (models.Order.id.desc(),),
+}
+
+
+def search_orders(
+    db: Session,
+    q: Optional[str] = None,
+    status: Optional[str] = None,
+    customer_id: Optional[int] = None,
+    delivery_from=None,
+    delivery_to=None,
+    urgent_hours: Optional[int] = None,
+    sort: str = 'delivery_date',
+    skip: int = 0,
+    limit: int = 50,
+    fieldset=None,
+    embed: bool = True,
+):
+    """
+    Search orders by customer name, notes or product name with filters and paging.
+    Substring matching uses ILIKE, which Postgres serves from the pg_trgm GIN indexes
+    (see the baseline migration); other databases fall back to a scan with the same semantics.
+    urgent_hours keeps undelivered orders due between today and now + N hours.
+    Returns (total matching count, orders on the requested page).
+    """
+    from datetime import datetime, timedelta, timezone
+
+    from sqlalchemy import or_
+
+    query = db.query(models.Order)
+    if q:
+        escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        pattern = f'%{escaped}%'
+        matching_products = db.query(models.Product.id).filter(models.Product.name.ilike(pattern, escape='\\'))
+        orders_with_product = db.query(models.OrderItem.order_id).filter(models.OrderItem.product_id.in_(matching_products))
+        matching_customers = db.query(models.Customer.id).filter(models.Customer.name.ilike(pattern, escape='\\'))
+        query = query.filter(or_(
+            models.Order.customer_id.in_(matching_customers),
+            models.Order.notes.ilike(pattern, escape='\\'),
+            models.Order.id.in_(orders_with_product),
+        ))
+    if status:
+        query = query.filter(models.Order.status == status)
+    if customer_id:
+        query = query.filter(models.Order.customer_id == customer_id)
+    if delivery_from:
+        query = query.filter(models.Order.delivery_date >= delivery_from)
+    if delivery_to:
+        query = query.filter(models.Order.delivery_date <= delivery_to)
+    if urgent_hours is not None:
+        now = datetime.now(timezone.utc)
+        query = query.filter(
+            models.Order.delivery_date >= now.date(),
+            models.Order.delivery_date <= (now + timedelta(hours=urgent_hours)).date(),
+            models.Order.status != models.OrderStatus.delivered,
+        )
+
+    total = query.order_by(None).count()
+    if limit == 0:
+        return total, []
+    orders = (
+        query.options(*_order_load_options(fieldset, embed))
+        .order_by(*ORDER_SEARCH_SORTS.get(sort, ORDER_SEARCH_SORTS['delivery_date'])())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return total, orders
+
+
+def get_orders_bootstrap(db: Session, catalog: bool = False, urgent_hours: int = 24, **search):
+    """
+    Everything the orders view needs in one response, normalized: a page of orders
+    (as search_orders(**search)) whose items carry only product_id, plus each customer
+    and product once in id-keyed maps instead of repeated inside every order and item.
+    catalog=True sends all customers and products (the create/edit form options);
+    otherwise only those the page references. urgent_count is the number of orders
+    search_orders(urgent_hours=...) would match.
+    """
+    total, orders = search_orders(db, embed=False, **search)
+    urgent_count, _ = search_orders(db, urgent_hours=urgent_hours, limit=0)
+
+    customers = db.query(models.Customer)
+    products = db.query(models.Product)
+    if not catalog:
+        customer_ids = {order.customer_id for order in orders}
+        product_ids = {item.product_id for order in orders for item in order.items}
+        customers = customers.filter(models.Customer.id.in_(customer_ids)) if customer_ids else []
+        products = products.filter(models.Product.id.in_(product_ids)) if product_ids else []
+    return {
+        'total': total,
+        'urgent_count': urgent_count,
+        'orders': orders,
+        'customers': {customer.id: customer for customer in customers},
+        'products': {product.id: product for product in products},
+    }
+
+
 def get_order(db: Session, order_id: int):
     return db.query(models.Order).filter(models.Order.id == order_id).first()
 
 
+def get_order_or_archived(db: Session, order_id: int):
+    """Live order, else the archived copy (read-only) if it was archived."""
+    return get_order(db, order_id) or db.get(models.OrderArchive, order_id)
+
+
 def create_order(db: Session, order_in: schemas.OrderCreate):
     order_data = order_in.dict(exclude={'items'})
     order = models.Order(**order_data)
-    db.add(order)
-    db.flush()  # get id
 
     total = Decimal('0')
     for item in order_in.items:
@@ -110,30 +402,44 @@ def create_order(db: Session, order_in: schemas.OrderCreate):
         if not product:
             raise ValueError(f"Product {item.product_id} not found")
         unit_price = Decimal(str(item.unit_price))
-        oi = models.OrderItem(
-            order_id=order.id,
+        order.items.append(models.OrderItem(
             product_id=product.id,
             quantity=item.quantity,
             unit_price=unit_price
-        )
-        db.add(oi)
+        ))
         total += unit_price * item.quantity
 
     order.total = total  # type: ignore[assignment]
-    db.commit()
+    db.add(order)
+    db.flush()  # insert order and items in one go
+    refresh_customer_last_order(db, order.customer_id)
+    outbox.record(db, 'order.created', [order])
+    db.commit()  # initial status history is recorded by the orders trigger
     db.refresh(order)
-
-    # Record initial status history
-    hist = models.OrderStatusHistory(order_id=order.id, status=order.status)
-    db.add(hist)
-    db.commit()
     return order
 
 
-def update_order(db: Session, order_id: int, order_in: schemas.OrderCreate):
+class VersionConflict(Exception):
+    """The order changed since the client read it (If-Match did not match its version)."""
+
+    def __init__(self, current_version: int):
+        super().__init__(f'Order was modified (current version {current_version})')
+        self.current_version = current_version
+
+
+def _check_version(order, expected_version: Optional[int]):
+    if expected_version is not None and order.version != expected_version:
+        raise VersionConflict(order.version)
+
+
+def update_order(db: Session, order_id: int, order_in: schemas.OrderCreate, expected_version: Optional[int] = None):
+    from sqlalchemy.orm.attributes import flag_modified
+
     order = get_order(db, order_id)
     if not order:
         return None
+    _check_version(order, expected_version)
+    previous_customer_id = order.customer_id
     
     # Update order fields
     order_data = order_in.dict(exclude={'items'})
@@ -160,50 +466,191 @@ def update_order(db: Session, order_id: int, order_in: schemas.OrderCreate):
         total += unit_price * item.quantity
     
     order.total = total  # type: ignore[assignment]
+    flag_modified(order, 'total')  # item changes alone must bump the version too
+    if order.customer_id != previous_customer_id:
+        db.flush()
+        refresh_customer_last_order(db, previous_customer_id)
+        refresh_customer_last_order(db, order.customer_id)
     db.commit()
     db.refresh(order)
     return order
 
 
-def update_order_status(db: Session, order_id: int, status: str):
+def update_order_status(db: Session, order_id: int, status: str, expected_version: Optional[int] = None):
     order = get_order(db, order_id)
     if not order:
         return None
-    order.status = models.OrderStatus(status) if isinstance(status, str) else status  # type: ignore[assignment]
-    # append history
-    hist = models.OrderStatusHistory(order_id=order_id, status=status)
-    db.add(hist)
-    db.commit()
+    _check_version(order, expected_version)
+    status = models.OrderStatus(status) if isinstance(status, str) else status
+    event_type = outbox.STATUS_EVENTS.get(status) if order.status != status else None
+    order.status = status  # type: ignore[assignment]
+    if event_type:
+        outbox.record(db, event_type, [order])
+    db.commit()  # history entry is written by the orders trigger in the same UPDATE
     db.refresh(order)
     return order
 
 
+def update_orders_status(db: Session, order_ids: List[int], status: str):
+    """
+    Set the status of many orders with a single UPDATE; the trigger records one history
+    entry per order. Returns (orders found, ids whose status actually changed).
+    """
+    status = models.OrderStatus(status)
+    ids = sorted(set(order_ids))
+    changed_ids = [
+        row.id for row in db.query(models.Order.id).filter(models.Order.id.in_(ids), models.Order.status != status)
+    ]
+    if changed_ids:
+        db.query(models.Order).filter(models.Order.id.in_(changed_ids)).update(
+            {models.Order.status: status, models.Order.version: models.Order.version + 1},
+            synchronize_session=False,
+        )
+        if status in outbox.STATUS_EVENTS:
+            outbox.record_ids(db, outbox.STATUS_EVENTS[status], changed_ids)
+        db.commit()
+    orders = (
+        db.query(models.Order)
+        .options(*_order_load_options())
+        .filter(models.Order.id.in_(ids))
+        .order_by(models.Order.id)
+        .all()
+    )
+    return orders, changed_ids
+
+
+def generate_orders_for_paid_subscriptions(db: Session, paid_orders: List[models.Order]) -> List[models.Order]:
+    """
+    When an order of a subscription customer is marked as paid and it is the first paid
+    order of its plan for that month, generate the rest of the month's weekly orders.
+    paid_orders are the orders that just became paid; they don't count as earlier ones.
+    """
+    from sqlalchemy import extract
+
+    paid_ids = [o.id for o in paid_orders]
+    generated = []
+    seen = set()
+    for order in paid_orders:
+        if not (order.customer and order.customer.is_subscription and order.delivery_date):
+            continue
+        # Get active recurring plan for this customer
+        active_plan = db.query(models.RecurringPlan).filter(
+            models.RecurringPlan.customer_id == order.customer_id,
+            models.RecurringPlan.active == True
+        ).first()
+        if not active_plan:
+            continue
+        month = order.delivery_date.month
+        year = order.delivery_date.year
+        if (active_plan.id, month, year) in seen:
+            continue
+        seen.add((active_plan.id, month, year))
+
+        # Check if this is the first order of the month to be marked as paid
+        earlier_paid_order = db.query(models.Order).filter(
+            models.Order.customer_id == order.customer_id,
+            models.Order.recurring_plan_id == active_plan.id,
+            models.Order.status == models.OrderStatus.pago,
+            models.Order.id.notin_(paid_ids)
+        ).filter(
+            extract('month', models.Order.delivery_date) == month,
+            extract('year', models.Order.delivery_date) == year
+        ).first()
+        if not earlier_paid_order:
+            logger.info('Generating monthly orders for plan %s, month %s/%s', active_plan.id, month, year)
+            generated.extend(generate_monthly_orders_from_plan(db, active_plan.id, month, year))
+    return generated
+
+
+def _synthesized_entry(order) -> Dict[str, Any]:
+    # Orders from before history was recorded: current status since creation, not stored
+    return {'id': None, 'order_id': order.id, 'status': order.status, 'changed_at': order.created_at}
+
+
 def get_order_history(db: Session, order_id: int):
     entries = db.query(models.OrderStatusHistory).filter(models.OrderStatusHistory.order_id == order_id).order_by(models.OrderStatusHistory.changed_at.asc()).all()
     if not entries:
-        # Backfill with current status as initial record
-        order = get_order(db, order_id)
+        entries = (
+            db.query(models.OrderStatusHistoryArchive)
+            .filter(models.OrderStatusHistoryArchive.order_id == order_id)
+            .order_by(models.OrderStatusHistoryArchive.changed_at.asc())
+            .all()
+        )
+    if not entries:
+        order = get_order_or_archived(db, order_id)
         if order:
-            hist = models.OrderStatusHistory(order_id=order_id, status=order.status)
-            db.add(hist)
-            db.commit()
-            entries = [hist]
+            entries = [_synthesized_entry(order)]
     return entries
 
 
-def delete_order(db: Session, order_id: int):
+def get_order_timelines(db: Session, order_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Status timelines for many orders at once: {order_id: [{status, changed_at}, ...]}.
+    One ordered query over live history, one over the archive for the rest; orders
+    without any entries get their current status. Unknown ids are left out.
+    """
+    ids = set(order_ids)
+    timelines: Dict[int, List[Dict[str, Any]]] = {}
+    for model in (models.OrderStatusHistory, models.OrderStatusHistoryArchive):
+        missing = ids - timelines.keys()
+        if not missing:
+            break
+        rows = (
+            db.query(model.order_id, model.status, model.changed_at)
+            .filter(model.order_id.in_(missing))
+            .order_by(model.order_id, model.changed_at, model.id)
+            .all()
+        )
+        for row in rows:
+            timelines.setdefault(row.order_id, []).append({'status': row.status, 'changed_at': row.changed_at})
+    missing = ids - timelines.keys()
+    for model in (models.Order, models.OrderArchive):
+        if not missing:
+            break
+        for order in db.query(model.id, model.status, model.created_at).filter(model.id.in_(missing)):
+            timelines[order.id] = [{'status': order.status, 'changed_at': order.created_at}]
+        missing = ids - timelines.keys()
+    return {order_id: timelines[order_id] for order_id in sorted(timelines)}
+
+
+def delete_order(db: Session, order_id: int, expected_version: Optional[int] = None):
     order = get_order(db, order_id)
     if not order:
         return False
+    _check_version(order, expected_version)
     # Delete status history first to satisfy FK constraints
     db.query(models.OrderStatusHistory).filter(models.OrderStatusHistory.order_id == order_id).delete()
     # Delete order items to satisfy FK constraints
     db.query(models.OrderItem).filter(models.OrderItem.order_id == order_id).delete()
+    customer_id = order.customer_id
     db.delete(order)
+    db.flush()
+    refresh_customer_last_order(db, customer_id)
     db.commit()
     return True
 
 
+def refresh_customer_last_order(db: Session, *customer_ids: int):
+    """Recompute the denormalized Customer.last_order_at from the customers' orders.
+
+    Must run after the order change is flushed; it is a single UPDATE backed by the
+    (customer_id, created_at) index on orders. Archived orders only count when the
+    customer has no live orders left.
+    """
+    def latest(model):
+        return (
+            db.query(func.max(model.created_at))
+            .filter(model.customer_id == models.Customer.id)
+            .correlate(models.Customer)
+            .scalar_subquery()
+        )
+
+    last_order = func.coalesce(latest(models.Order), latest(models.OrderArchive))
+    db.query(models.Customer).filter(models.Customer.id.in_(customer_ids)).update(
+        {models.Customer.last_order_at: last_order}, synchronize_session=False
+    )
+
+
 def get_production_needs_by_date(db: Session, target_date) -> List[Dict[str, Any]]:
     """Aggregate order items for a given delivery_date across all non-delivered orders."""
     from sqlalchemy import func
@@ -241,27 +688,281 @@ def get_production_needs_by_date(db: Session, target_date) -> List[Dict[str, Any
     return results
 
 
-def get_inactive_customers(db: Session, days: int = 30):
+DASHBOARD_GRANULARITIES = ('day', 'week', 'month')
+_BUCKET_DAYS = {'day': 1, 'week': 7, 'month': 30}
+# `auto` picks the finest bucket giving at most this many points; an explicit
+# granularity is coarsened if it would give more than DASHBOARD_MAX_POINTS.
+DASHBOARD_AUTO_POINTS = 62
+DASHBOARD_MAX_POINTS = 366
+
+
+def dashboard_granularity(days: int, requested: str = 'auto') -> str:
+    limit = DASHBOARD_AUTO_POINTS if requested == 'auto' else DASHBOARD_MAX_POINTS
+    start = 0 if requested == 'auto' else DASHBOARD_GRANULARITIES.index(requested)
+    for granularity in DASHBOARD_GRANULARITIES[start:]:
+        if days / _BUCKET_DAYS[granularity] <= limit:
+            return granularity
+    return 'month'
+
+
+def _bucket_start(db: Session, created_at, shift_days, granularity: str):
+    """Date of the day/week (Monday)/month `created_at + shift_days` falls in."""
+    from sqlalchemy import Date, case, cast
+
+    if db.get_bind().dialect.name == 'postgresql':
+        shifted = created_at + func.make_interval(0, 0, 0, shift_days)
+        return cast(func.date_trunc(granularity, shifted), Date)
+    shifted = func.date(created_at, case((shift_days > 0, func.printf('+%d days', shift_days)), else_='+0 days'))
+    if granularity == 'week':
+        return func.date(shifted, '-6 days', 'weekday 1')
+    if granularity == 'month':
+        return func.date(shifted, 'start of month')
+    return shifted
+
+
+def get_dashboard_series(db: Session, days: int, granularity: str = 'auto', compare: bool = False, now=None):
+    """
+    Orders, revenue and units per bucket for the last `days` days, with the period's
+    totals. With compare, the `days` before that are bucketed too, shifted forward by
+    `days` so each previous bucket lines up with the current one it compares to.
+
+    One query: orders are tagged with their period and bucket, grouped per (period,
+    bucket), and the period totals come from window sums over the groups.
+    """
+    from datetime import datetime, timedelta, timezone
+
+    from sqlalchemy import case, literal
+
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=days)
+    start = cutoff - timedelta(days=days) if compare else cutoff
+    granularity = dashboard_granularity(days, granularity)
+
+    units = (
+        db.query(models.OrderItem.order_id, func.sum(models.OrderItem.quantity).label('units'))
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .filter(models.Order.created_at >= start)
+        .group_by(models.OrderItem.order_id)
+        .subquery()
+    )
+    current = models.Order.created_at >= cutoff
+    shift = case((current, literal(0)), else_=literal(days))
+    tagged = (
+        db.query(
+            case((current, 'current'), else_='previous').label('period'),
+            _bucket_start(db, models.Order.created_at, shift, granularity).label('bucket'),
+            models.Order.id,
+            func.coalesce(models.Order.total, 0).label('total'),
+            func.coalesce(units.c.units, 0).label('units'),
+        )
+        .outerjoin(units, units.c.order_id == models.Order.id)
+        .filter(models.Order.created_at >= start)
+        .subquery()
+    )
+    count, revenue, quantity = func.count(tagged.c.id), func.sum(tagged.c.total), func.sum(tagged.c.units)
+    rows = (
+        db.query(
+            tagged.c.period, tagged.c.bucket, count, revenue,
+            func.sum(count).over(partition_by=tagged.c.period),
+            func.sum(revenue).over(partition_by=tagged.c.period),
+            func.sum(quantity).over(partition_by=tagged.c.period),
+        )
+        .group_by(tagged.c.period, tagged.c.bucket)
+        .order_by(tagged.c.bucket)
+        .all()
+    )
+
+    totals = {period: {'total_orders': 0, 'total_revenue': 0.0, 'total_units': 0} for period in ('current', 'previous')}
+    points: Dict[str, Dict[str, Any]] = {}
+    for period, bucket, n, amount, period_orders, period_revenue, period_units in rows:
+        totals[period] = {'total_orders': int(period_orders), 'total_revenue': float(period_revenue or 0),
+                          'total_units': int(period_units or 0)}
+        point = points.setdefault(str(bucket), {'date': str(bucket), 'count': 0, 'revenue': 0.0})
+        if compare:
+            point.setdefault('previous_count', 0)
+            point.setdefault('previous_revenue', 0.0)
+        prefix = '' if period == 'current' else 'previous_'
+        point[prefix + 'count'] = int(n)
+        point[prefix + 'revenue'] = float(amount or 0)
+
+    result = {'granularity': granularity, 'series': list(points.values()), **totals['current']}
+    if compare:
+        previous = totals['previous']
+        result['previous'] = {'start': start, 'end': cutoff, **previous}
+        result['change_pct'] = {
+            key: round((result[key] - previous[key]) / previous[key] * 100, 1) if previous[key] else None
+            for key in previous
+        }
+    return result
+
+
+def get_inactive_customers(db: Session, days: int = 30, skip: int = 0, limit: int = 100):
     from datetime import datetime, timedelta, timezone
 
-    from sqlalchemy import exists
+    from sqlalchemy import or_
 
     # Compute cutoff in Python (timezone-aware) to avoid DB-specific interval funcs
-    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=days)
+
+    # Range scan on the last_order_at index; customers that never ordered come first
+    customers = (
+        db.query(models.Customer)
+        .filter(or_(models.Customer.last_order_at.is_(None), models.Customer.last_order_at < cutoff))
+        .order_by(models.Customer.last_order_at.asc().nullsfirst(), models.Customer.id.asc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
+    # Lifetime revenue only for the customers on this page
+    customer_ids = [c.id for c in customers]
+    revenue = {}
+    if customer_ids:
+        for model in (models.Order, models.OrderArchive):
+            rows = (
+                db.query(model.customer_id, func.sum(model.total))
+                .filter(model.customer_id.in_(customer_ids))
+                .group_by(model.customer_id)
+                .all()
+            )
+            for customer_id, total in rows:
+                revenue[customer_id] = revenue.get(customer_id, Decimal('0')) + (total or Decimal('0'))
+
+    results = []
+    for c in customers:
+        days_since = None
+        if c.last_order_at:
+            last_order_at = c.last_order_at
+            if last_order_at.tzinfo is None:
+                last_order_at = last_order_at.replace(tzinfo=timezone.utc)
+            days_since = (now - last_order_at).days
+        results.append({
+            'id': c.id,
+            'name': c.name,
+            'email': c.email,
+            'phone': c.phone,
+            'address': c.address,
+            'last_order_at': c.last_order_at,
+            'days_since_last_order': days_since,
+            'lifetime_revenue': revenue.get(c.id) or Decimal('0'),
+        })
+    return results
+
+
+# --- Archive ---
+ARCHIVED_TABLES = (
+    (models.OrderStatusHistory, models.OrderStatusHistoryArchive, models.OrderStatusHistory.order_id),
+    (models.OrderItem, models.OrderItemArchive, models.OrderItem.order_id),
+    (models.Order, models.OrderArchive, models.Order.id),
+)
+
+
+def archive_delivered_orders(db: Session, before, batch_size: int = 500, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Move delivered orders with a delivery date before `before`, with their items and
+    status history, into the *_archive tables. Works in batches of batch_size orders,
+    each copied with INSERT ... SELECT and deleted in its own transaction.
+    """
+    from sqlalchemy import delete, insert, select
 
-    # Return customers for whom there is NO order on/after the cutoff date
-    # This includes customers with no orders at all
-    recent_orders_exists = (
+    candidates = (
         db.query(models.Order.id)
-        .filter(
-            models.Order.customer_id == models.Customer.id,
-            models.Order.created_at >= cutoff,
+        .filter(models.Order.status == models.OrderStatus.delivered)
+        .filter(models.Order.delivery_date < before)
+        .order_by(models.Order.id)
+    )
+    if dry_run:
+        return {'before': before, 'orders': candidates.order_by(None).count(), 'batches': 0, 'dry_run': True}
+
+    archived = batches = 0
+    while True:
+        order_ids = [row.id for row in candidates.limit(batch_size).all()]
+        if not order_ids:
+            break
+        for live, archive, order_column in ARCHIVED_TABLES:
+            columns = [c.name for c in live.__table__.columns]
+            db.execute(
+                insert(archive.__table__).from_select(
+                    columns, select(*[live.__table__.c[c] for c in columns]).where(order_column.in_(order_ids))
+                )
+            )
+            db.execute(delete(live.__table__).where(order_column.in_(order_ids)))
+        db.commit()
+        archived += len(order_ids)
+        batches += 1
+    return {'before': before, 'orders': archived, 'batches': batches, 'dry_run': False}
+
+
+# --- Dispatch ---
+def get_packing_rows(db: Session, start, end, include_delivered: bool = False):
+    """
+    Quantities per (pickup location, customer, product) for deliveries in [start, end],
+    from a single GROUP BY, ordered so each location and customer forms a contiguous run.
+    """
+    location = func.coalesce(models.Customer.pickup_location, '')
+    query = (
+        db.query(
+            location.label('pickup_location'),
+            models.Customer.id.label('customer_id'),
+            models.Customer.name.label('customer_name'),
+            models.Product.id.label('product_id'),
+            models.Product.sku,
+            models.Product.name.label('product_name'),
+            func.sum(models.OrderItem.quantity).label('quantity'),
+            func.count(func.distinct(models.Order.id)).label('order_count'),
         )
-        .exists()
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .join(models.Customer, models.Customer.id == models.Order.customer_id)
+        .join(models.Product, models.Product.id == models.OrderItem.product_id)
+        .filter(models.Order.delivery_date >= start, models.Order.delivery_date <= end)
+    )
+    if not include_delivered:
+        query = query.filter(models.Order.status != models.OrderStatus.delivered)
+    return (
+        query.group_by(location, models.Customer.id, models.Customer.name,
+                       models.Product.id, models.Product.sku, models.Product.name)
+        .order_by(location, models.Customer.name, models.Customer.id, models.Product.name)
+        .all()
     )
 
-    q = db.query(models.Customer).filter(~recent_orders_exists)
-    return q.all()
+
+def build_packing_lists(rows) -> Dict[str, Any]:
+    """Roll grouped packing rows up into per-location and per-customer lists in one pass."""
+    locations: List[Dict[str, Any]] = []
+    location = customer = location_key = None
+    location_products: Dict[int, Dict[str, Any]] = {}
+    total_quantity = 0
+    for r in rows:
+        if location is None or r.pickup_location != location_key:
+            location_key = r.pickup_location
+            location_products = {}
+            location = {
+                'pickup_location': r.pickup_location or None,
+                'total_quantity': 0,
+                'products': [],
+                'customers': [],
+            }
+            locations.append(location)
+            customer = None
+        if customer is None or r.customer_id != customer['customer_id']:
+            customer = {'customer_id': r.customer_id, 'name': r.customer_name, 'total_quantity': 0, 'items': []}
+            location['customers'].append(customer)
+        quantity = int(r.quantity)
+        customer['items'].append({'product_id': r.product_id, 'sku': r.sku, 'name': r.product_name, 'quantity': quantity})
+        customer['total_quantity'] += quantity
+        location['total_quantity'] += quantity
+        total_quantity += quantity
+        product = location_products.get(r.product_id)
+        if product is None:
+            product = location_products[r.product_id] = {
+                'product_id': r.product_id, 'sku': r.sku, 'name': r.product_name, 'quantity': 0,
+            }
+            location['products'].append(product)
+        product['quantity'] += quantity
+    for loc in locations:
+        loc['products'].sort(key=lambda p: p['name'])
+    return {'total_quantity': total_quantity, 'locations': locations}
 
 
 # --- Users ---
@@ -299,17 +1000,32 @@ def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
 
 
 # --- Recurring Plans ---
-def list_recurring_plans(db: Session, customer_id: Optional[int] = None):
+def list_recurring_plans(db: Session, customer_ids=None, active: Optional[bool] = None, fieldset=None):
+    """
+    Plans of the given customers (all when None) with their items, in three queries
+    however many plans match: plans, then items (and products when expanded) with
+    selectin IN batches. A fieldset selects columns/relationships as on /orders.
+    """
     q = db.query(models.RecurringPlan)
-    if customer_id is not None:
-        q = q.filter(models.RecurringPlan.customer_id == customer_id)
-    return q.all()
+    if fieldset is not None:
+        q = q.options(*projection.loader_options(models.RecurringPlan, fieldset))
+    else:
+        q = q.options(selectinload(models.RecurringPlan.items))
+    if customer_ids is not None:
+        q = q.filter(models.RecurringPlan.customer_id.in_(customer_ids))
+    if active is not None:
+        q = q.filter(models.RecurringPlan.active == active)
+    return q.order_by(models.RecurringPlan.customer_id, models.RecurringPlan.id).all()
 
 
 def get_recurring_plan(db: Session, plan_id: int):
     return db.query(models.RecurringPlan).filter(models.RecurringPlan.id == plan_id).first()
 
 
+def _plan_items(payload: schemas.RecurringPlanCreate):
+    return [models.RecurringPlanItem(product_id=item.product_id, quantity=item.quantity) for item in payload.items]
+
+
 def create_recurring_plan(db: Session, payload: schemas.RecurringPlanCreate):
     plan = models.RecurringPlan(
         customer_id=payload.customer_id,
@@ -318,11 +1034,9 @@ def create_recurring_plan(db: Session, payload: schemas.RecurringPlanCreate):
         end_date=payload.end_date,
         active=payload.active,
         prepaid_month=payload.prepaid_month,
+        items=_plan_items(payload),
     )
     db.add(plan)
-    db.flush()
-    for item in payload.items:
-        db.add(models.RecurringPlanItem(plan_id=plan.id, product_id=item.product_id, quantity=item.quantity))
     db.commit()
     db.refresh(plan)
     return plan
@@ -338,10 +1052,8 @@ def update_recurring_plan(db: Session, plan_id: int, payload: schemas.RecurringP
     plan.end_date = payload.end_date  # type: ignore[assignment]
     plan.active = payload.active  # type: ignore[assignment]
     plan.prepaid_month = payload.prepaid_month  # type: ignore[assignment]
-    # Replace items
-    db.query(models.RecurringPlanItem).filter(models.RecurringPlanItem.plan_id == plan_id).delete()
-    for item in payload.items:
-        db.add(models.RecurringPlanItem(plan_id=plan.id, product_id=item.product_id, quantity=item.quantity))
+    # Replace items; the old ones are deleted as orphans
+    plan.items = _plan_items(payload)
     db.commit()
     db.refresh(plan)
     return plan
@@ -351,112 +1063,221 @@ def delete_recurring_plan(db: Session, plan_id: int) -> bool:
     plan = get_recurring_plan(db, plan_id)
     if not plan:
         return False
-    db.query(models.RecurringPlanItem).filter(models.RecurringPlanItem.plan_id == plan_id).delete()
-    db.delete(plan)
+    db.delete(plan)  # items go with it
     db.commit()
     return True
 
 
+MONTH_NAMES = {
+    1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
+    5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto',
+    9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
+}
+
+
+def _month_bounds(month: int, year: int):
+    from calendar import monthrange
+    from datetime import date
+
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def _plan_delivery_dates(plan: models.RecurringPlan, month: int, year: int):
+    """All dates in the month falling on the plan's day_of_week and inside its start/end period."""
+    from datetime import timedelta
+
+    first_day, last_day = _month_bounds(month, year)
+    # day_of_week: 0=Monday, 6=Sunday
+    current_date = first_day + timedelta(days=(plan.day_of_week - first_day.weekday()) % 7)
+    delivery_dates = []
+    while current_date <= last_day:
+        if current_date >= plan.start_date and (not plan.end_date or current_date <= plan.end_date):
+            delivery_dates.append(current_date)
+        current_date += timedelta(days=7)
+    return delivery_dates
+
+
+def _priced_plan_items(db: Session, plan_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Load the items of many plans with their current product prices in one query.
+    Returns {plan_id: {'items': [rows], 'weekly_total': Decimal}}, the weekly total
+    being aggregated by the database with a window over each plan's items.
+    """
+    if not plan_ids:
+        return {}
+    weekly_total = func.sum(models.RecurringPlanItem.quantity * models.Product.unit_price).over(
+        partition_by=models.RecurringPlanItem.plan_id
+    )
+    rows = (
+        db.query(
+            models.RecurringPlanItem.plan_id,
+            models.RecurringPlanItem.product_id,
+            models.RecurringPlanItem.quantity,
+            models.Product.unit_price,
+            weekly_total.label('weekly_total'),
+        )
+        .join(models.Product, models.Product.id == models.RecurringPlanItem.product_id)
+        .filter(models.RecurringPlanItem.plan_id.in_(plan_ids))
+        .order_by(models.RecurringPlanItem.plan_id, models.RecurringPlanItem.id)
+        .all()
+    )
+    priced: Dict[int, Dict[str, Any]] = {}
+    for r in rows:
+        entry = priced.setdefault(r.plan_id, {'items': [], 'weekly_total': Decimal(str(r.weekly_total or 0))})
+        entry['items'].append(r)
+    return priced
+
+
+def _monthly_payment_row(plan: models.RecurringPlan, priced: Dict[str, Any], delivery_dates, month: int, year: int):
+    """Row for the monthly payment order covering every delivery of the month."""
+    week_count = len(delivery_dates)
+    return {
+        'customer_id': plan.customer_id,
+        'delivery_date': delivery_dates[0],
+        'status': models.OrderStatus.encomendado,
+        'total': priced['weekly_total'] * week_count,
+        'recurring_plan_id': plan.id,
+        'is_monthly_payment': True,
+        'is_auto_generated': False,
+        'notes': f"Pagamento Mensal - {MONTH_NAMES.get(month, str(month))} {year} ({week_count} entregas)",
+        'week_count': week_count,
+    }
+
+
+def _insert_monthly_payments(db: Session, payments: List[Dict[str, Any]], priced_by_plan: Dict[int, Dict[str, Any]]):
+    """
+    Insert monthly payment orders and their items; a plan that already has a payment
+    order for that date (created concurrently) is skipped. Returns {plan_id: order_id}.
+    """
+    inserted = db.execute(
+        _insert_ignoring_duplicates(db, models.Order.__table__, 'is_monthly_payment')
+        .returning(models.Order.__table__.c.id, models.Order.__table__.c.recurring_plan_id),
+        [{k: v for k, v in p.items() if k != 'week_count'} for p in payments],
+    )
+    order_ids = {row.recurring_plan_id: row.id for row in inserted}
+    week_counts = {p['recurring_plan_id']: p['week_count'] for p in payments}
+    # Order items hold the total quantities for the month
+    item_rows = [
+        {'order_id': order_id, 'product_id': item.product_id,
+         'quantity': item.quantity * week_counts[plan_id], 'unit_price': item.unit_price}
+        for plan_id, order_id in order_ids.items()
+        for item in priced_by_plan[plan_id]['items']
+    ]
+    if item_rows:
+        db.execute(models.OrderItem.__table__.insert(), item_rows)
+    outbox.record_ids(db, 'order.created', order_ids.values())
+    return order_ids
+
+
+def _lock_plan_month(db: Session, plan_id: int, month: int, year: int):
+    """
+    Serialize work on one plan's month until the transaction ends (Postgres advisory
+    lock); concurrent callers wait here and then see each other's orders. Other
+    databases rely on the unique indexes on orders alone.
+    """
+    from sqlalchemy import text
+
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text('SELECT pg_advisory_xact_lock(:plan_id, :period)'),
+                   {'plan_id': plan_id, 'period': year * 100 + month})
+
+
+def _insert_ignoring_duplicates(db: Session, table, index_where: str):
+    """INSERT ... ON CONFLICT (recurring_plan_id, delivery_date) DO NOTHING for the dialect."""
+    from sqlalchemy import insert, text
+
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(table)
+    return dialect_insert(table).on_conflict_do_nothing(
+        index_elements=['recurring_plan_id', 'delivery_date'], index_where=text(index_where)
+    )
+
+
 def generate_monthly_orders_from_plan(db: Session, plan_id: int, month: int, year: int):
     """
     Generate weekly orders for a subscription plan for the specified month.
     Returns list of created orders.
+
+    Safe under concurrency: runs under the plan/month advisory lock, and the insert
+    skips dates that already have a generated order (unique index), so simultaneous
+    calls produce exactly one order per delivery date.
     """
-    from calendar import monthrange
-    from datetime import date, timedelta
-    
     plan = get_recurring_plan(db, plan_id)
     if not plan or not plan.active:
         return []
+    _lock_plan_month(db, plan_id, month, year)
     
-    # Get the first and last day of the month
-    first_day = date(year, month, 1)
-    last_day_num = monthrange(year, month)[1]
-    last_day = date(year, month, last_day_num)
-    
-    # Check if plan is active for this month
-    if plan.start_date > last_day:
-        return []  # Plan hasn't started yet
-    if plan.end_date and plan.end_date < first_day:
-        return []  # Plan already ended
-    
-    # Find all occurrences of the plan's day_of_week in the month
-    # day_of_week: 0=Monday, 6=Sunday
-    delivery_dates = []
-    current_date = first_day
-    while current_date <= last_day:
-        if current_date.weekday() == plan.day_of_week:
-            # Check if date is within plan period
-            if current_date >= plan.start_date:
-                if not plan.end_date or current_date <= plan.end_date:
-                    delivery_dates.append(current_date)
-        current_date += timedelta(days=1)
+    delivery_dates = _plan_delivery_dates(plan, month, year)
     
     # Skip the first delivery date (it's the monthly payment order, not a weekly delivery)
     if delivery_dates:
         delivery_dates = delivery_dates[1:]  # Remove first occurrence
     
-    # Get plan items
-    plan_items = db.query(models.RecurringPlanItem).filter(
-        models.RecurringPlanItem.plan_id == plan_id
-    ).all()
-    
-    if not plan_items:
+    # Get plan items with their prices
+    priced = _priced_plan_items(db, [plan_id]).get(plan_id)
+    if not priced:
         return []  # No products in plan
     
-    # Create orders for each delivery date
-    created_orders = []
-    for delivery_date in delivery_dates:
-        # Check if order already exists for this date and plan
-        existing = db.query(models.Order).filter(
-            models.Order.recurring_plan_id == plan_id,
-            models.Order.delivery_date == delivery_date
-        ).first()
-        
-        if existing:
-            continue  # Skip if already generated
-        
-        # Weekly deliveries have total = 0 (already paid in monthly payment)
-        # Items keep their prices for production reference
-        
-        # Create order
-        order = models.Order(
-            customer_id=plan.customer_id,
-            delivery_date=delivery_date,
-            status=models.OrderStatus.pago,  # Subscription orders are already paid
-            total=0,  # No cost - already covered by monthly payment
-            recurring_plan_id=plan_id,
-            is_auto_generated=True,
-            notes=f"Entrega semanal - Pagamento coberto pelo plano mensal"
-        )
-        db.add(order)
-        db.flush()  # Get order ID
-        
-        # Add order items (with prices for production reference)
-        for plan_item in plan_items:
-            product = db.query(models.Product).get(plan_item.product_id)
-            order_item = models.OrderItem(
-                order_id=order.id,
-                product_id=plan_item.product_id,
-                quantity=plan_item.quantity,
-                unit_price=product.unit_price
+    # Skip dates that already have an order for this plan
+    existing_dates = set()
+    if delivery_dates:
+        existing_dates = {
+            d for (d,) in db.query(models.Order.delivery_date).filter(
+                models.Order.recurring_plan_id == plan_id,
+                models.Order.delivery_date.in_(delivery_dates)
             )
-            db.add(order_item)
-        
-        # Add status history
-        history = models.OrderStatusHistory(
-            order_id=order.id,
-            status=models.OrderStatus.pago  # Subscription orders start as paid
-        )
-        db.add(history)
-        
-        created_orders.append(order)
+        }
     
+    # Weekly deliveries have total = 0 (already paid in monthly payment)
+    # Items keep their prices for production reference
+    rows = [
+        {
+            'customer_id': plan.customer_id,
+            'delivery_date': delivery_date,
+            'status': models.OrderStatus.pago,  # Subscription orders are already paid
+            'total': 0,  # No cost - already covered by monthly payment
+            'recurring_plan_id': plan_id,
+            'is_auto_generated': True,
+            'is_monthly_payment': False,
+            'notes': "Entrega semanal - Pagamento coberto pelo plano mensal",
+        }
+        for delivery_date in delivery_dates
+        if delivery_date not in existing_dates  # Skip if already generated
+    ]
+    if not rows:
+        db.commit()
+        return []
+
+    # Dates another transaction generated meanwhile are skipped by ON CONFLICT
+    inserted = db.execute(
+        _insert_ignoring_duplicates(db, models.Order.__table__, 'is_auto_generated')
+        .returning(models.Order.__table__.c.id),
+        rows,
+    )
+    order_ids = [row.id for row in inserted]
+    if order_ids:
+        db.execute(models.OrderItem.__table__.insert(), [
+            {'order_id': order_id, 'product_id': item.product_id, 'quantity': item.quantity,
+             'unit_price': item.unit_price}
+            for order_id in order_ids
+            for item in priced['items']
+        ])
+        refresh_customer_last_order(db, plan.customer_id)
+        outbox.record_ids(db, 'order.created', order_ids)
     db.commit()
-    for order in created_orders:
-        db.refresh(order)
     
-    return created_orders
+    return (
+        db.query(models.Order)
+        .options(*_order_load_options())
+        .filter(models.Order.id.in_(order_ids))
+        .order_by(models.Order.delivery_date)
+        .all()
+    ) if order_ids else []
 
 
 def create_monthly_payment_order(db: Session, plan_id: int, month: int, year: int):
@@ -465,119 +1286,98 @@ def create_monthly_payment_order(db: Session, plan_id: int, month: int, year: in
     This is the "master" order that the customer pays to unlock weekly deliveries.
     Returns the created order or None if plan is invalid or payment already exists.
     """
-    from calendar import monthrange
-    from datetime import date, timedelta
-    
     plan = get_recurring_plan(db, plan_id)
     if not plan or not plan.active:
         return None
     
-    # Get the first delivery date of the month (first occurrence of day_of_week)
-    first_day = date(year, month, 1)
-    last_day_num = monthrange(year, month)[1]
-    last_day = date(year, month, last_day_num)
-    
-    # Check if plan is active for this month
-    if plan.start_date > last_day:
-        return None  # Plan hasn't started yet
-    if plan.end_date and plan.end_date < first_day:
-        return None  # Plan already ended
-    
-    # Find first occurrence of plan's day_of_week in the month
-    first_delivery_date = None
-    current_date = first_day
-    while current_date <= last_day:
-        if current_date.weekday() == plan.day_of_week:
-            if current_date >= plan.start_date:
-                if not plan.end_date or current_date <= plan.end_date:
-                    first_delivery_date = current_date
-                    break
-        current_date += timedelta(days=1)
-    
-    if not first_delivery_date:
+    delivery_dates = _plan_delivery_dates(plan, month, year)
+    if not delivery_dates:
         return None  # No valid delivery date in this month
+    _lock_plan_month(db, plan_id, month, year)
     
     # Check if monthly payment already exists for this month
+    first_day, last_day = _month_bounds(month, year)
     existing = db.query(models.Order).filter(
         models.Order.recurring_plan_id == plan_id,
-        models.Order.is_monthly_payment == True
-    ).filter(
-        extract('month', models.Order.delivery_date) == month,
-        extract('year', models.Order.delivery_date) == year
+        models.Order.is_monthly_payment == True,
+        models.Order.delivery_date.between(first_day, last_day)
     ).first()
     
     if existing:
         return existing  # Already created
     
-    # Get plan items
-    plan_items = db.query(models.RecurringPlanItem).filter(
-        models.RecurringPlanItem.plan_id == plan_id
-    ).all()
-    
-    if not plan_items:
+    priced_by_plan = _priced_plan_items(db, [plan_id])
+    if plan_id not in priced_by_plan:
         return None  # No products in plan
     
-    # Calculate monthly total (sum of all weekly deliveries)
-    # Count occurrences of day_of_week in month
-    week_count = 0
-    current_date = first_day
-    while current_date <= last_day:
-        if current_date.weekday() == plan.day_of_week:
-            if current_date >= plan.start_date:
-                if not plan.end_date or current_date <= plan.end_date:
-                    week_count += 1
-        current_date += timedelta(days=1)
-    
-    # Calculate total for all weeks
-    total = sum(
-        (db.query(models.Product).get(item.product_id).unit_price or 0) * item.quantity * week_count
-        for item in plan_items
-    )
-    
-    # Get month name in Portuguese
-    month_names = {
-        1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
-        5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto',
-        9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
-    }
-    month_name = month_names.get(month, str(month))
+    payment = _monthly_payment_row(plan, priced_by_plan[plan_id], delivery_dates, month, year)
+    order_ids = _insert_monthly_payments(db, [payment], priced_by_plan)
+    if order_ids:
+        refresh_customer_last_order(db, plan.customer_id)
+    db.commit()
     
-    # Create monthly payment order
-    order = models.Order(
-        customer_id=plan.customer_id,
-        delivery_date=first_delivery_date,
-        status=models.OrderStatus.encomendado,
-        total=total,
-        recurring_plan_id=plan_id,
-        is_monthly_payment=True,
-        is_auto_generated=False,
-        notes=f"Pagamento Mensal - {month_name} {year} ({week_count} entregas)"
-    )
-    db.add(order)
-    db.flush()
+    return db.query(models.Order).options(*_order_load_options()).filter(
+        models.Order.recurring_plan_id == plan_id,
+        models.Order.is_monthly_payment == True,
+        models.Order.delivery_date == payment['delivery_date']
+    ).first()
+
+
+def run_monthly_billing(db: Session, month: int, year: int) -> Dict[str, Any]:
+    """
+    Create the monthly payment order for every active plan with deliveries in the month.
+
+    Idempotent per (plan, month): plans that already have a payment order for the month
+    are reported as already billed, including ones created by a concurrent run. Plans,
+    existing payments and priced items are each loaded with a single query regardless of
+    the number of subscribers.
+    """
+    from sqlalchemy import or_
+
+    first_day, last_day = _month_bounds(month, year)
+    plans = db.query(models.RecurringPlan).filter(
+        models.RecurringPlan.active == True,
+        models.RecurringPlan.start_date <= last_day,
+        or_(models.RecurringPlan.end_date.is_(None), models.RecurringPlan.end_date >= first_day)
+    ).order_by(models.RecurringPlan.id).all()
     
-    # Add order items (total quantities for the month)
-    for plan_item in plan_items:
-        product = db.query(models.Product).get(plan_item.product_id)
-        order_item = models.OrderItem(
-            order_id=order.id,
-            product_id=plan_item.product_id,
-            quantity=plan_item.quantity * week_count,  # Monthly total
-            unit_price=product.unit_price
+    already_billed = {
+        plan_id for (plan_id,) in db.query(models.Order.recurring_plan_id).filter(
+            models.Order.recurring_plan_id.in_([p.id for p in plans]),
+            models.Order.is_monthly_payment == True,
+            models.Order.delivery_date.between(first_day, last_day)
         )
-        db.add(order_item)
+    } if plans else set()
     
-    # Add status history
-    history = models.OrderStatusHistory(
-        order_id=order.id,
-        status=models.OrderStatus.encomendado
-    )
-    db.add(history)
+    pending = [p for p in plans if p.id not in already_billed]
+    priced_by_plan = _priced_plan_items(db, [p.id for p in pending])
+    
+    payments = []
+    skipped = []
+    for plan in pending:
+        delivery_dates = _plan_delivery_dates(plan, month, year)
+        priced = priced_by_plan.get(plan.id)
+        if not delivery_dates or not priced:
+            skipped.append(plan.id)  # No delivery this month or no products in plan
+            continue
+        payments.append(_monthly_payment_row(plan, priced, delivery_dates, month, year))
     
+    order_ids = _insert_monthly_payments(db, payments, priced_by_plan) if payments else {}
+    created = [p for p in payments if p['recurring_plan_id'] in order_ids]
+    if created:
+        refresh_customer_last_order(db, *{p['customer_id'] for p in created})
     db.commit()
-    db.refresh(order)
     
-    return order
+    return {
+        'month': month,
+        'year': year,
+        'plans_considered': len(plans),
+        'created': len(created),
+        'already_billed': len(already_billed) + len(payments) - len(created),
+        'skipped_plan_ids': skipped,
+        'total_amount': sum((Decimal(str(p['total'])) for p in created), Decimal('0')),
+        'order_ids': sorted(order_ids.values()),
+    }
 
 
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate, hashed_password: Optional[str] = None):
@@ -1,13 +1,186 @@
+import itertools
+import logging
 import os
+import threading
+import time
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.sql import Delete, Insert, Update
 
 load_dotenv()
 
 DATABASE_URL = os.getenv('DATABASE_URL', 'postgresql+psycopg2://fam_user:changeme@db:5432/fam_db')
+# Comma-separated read replica URLs; when empty every query goes to the primary
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+# Replicas further behind than this are skipped and reads fall back to the primary
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+# How long a measured replica lag is trusted before it is checked again
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '2'))
+# After a write, the same client reads from the primary for this long (read-your-writes)
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+PRIMARY_STICKY_COOKIE = 'fam_read_primary'
+# Seconds a new connection may take before giving up (startup warm-up, readiness checks)
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+
+logger = logging.getLogger(__name__)
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
+
+# Engines are created on first use, so importing the app (and forking workers from a
+# preloaded app) never opens a connection. `engine` and `replica_engines` still work as
+# module attributes via __getattr__ below.
+_engine = None
+_replica_engines = None
+_replica_cycle = None
+_engine_lock = threading.Lock()
+_lag_cache = {}  # engine -> (checked_at, lag_seconds)
+_lag_lock = threading.Lock()
+
+
+def _create_engine(url: str):
+    connect_args = {'connect_timeout': DB_CONNECT_TIMEOUT} if url.startswith('postgresql') else {}
+    return create_engine(url, pool_pre_ping=True, connect_args=connect_args)
+
+
+def get_engine():
+    """The primary engine."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine(DATABASE_URL)
+    return _engine
+
+
+def get_replica_engines() -> list:
+    global _replica_engines, _replica_cycle
+    if _replica_engines is None:
+        with _engine_lock:
+            if _replica_engines is None:
+                engines = [_create_engine(url) for url in DATABASE_REPLICA_URLS]
+                _replica_cycle = itertools.cycle(engines)
+                _replica_engines = engines
+    return _replica_engines
+
+
+def __getattr__(name):
+    if name == 'engine':
+        return get_engine()
+    if name == 'replica_engines':
+        return get_replica_engines()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def warm_up() -> bool:
+    """Open one pooled connection so the first request doesn't pay for the handshake.
+
+    Returns False, without raising, when the database is unreachable; the pool simply
+    connects on the first request instead.
+    """
+    try:
+        with get_engine().connect() as conn:
+            conn.execute(text('SELECT 1'))
+        return True
+    except Exception as e:
+        logger.warning('Database not reachable at startup: %s', e)
+        return False
+
+
+def reset_after_fork() -> None:
+    """Forget pooled connections inherited from a parent process without closing them
+    (the parent still owns them); the child's pools start empty."""
+    for created in [_engine, *(_replica_engines or [])]:
+        if created is not None:
+            created.dispose(close=False)
+
+
+def dispose_engines() -> None:
+    """Close pooled connections (worker shutdown)."""
+    for created in [_engine, *(_replica_engines or [])]:
+        if created is not None:
+            created.dispose()
+
+
+def measure_replica_lag(replica) -> float:
+    """Return how many seconds the replica is behind its primary.
+
+    Non-Postgres engines (e.g. SQLite files used in local tests) have no replication
+    and always report zero lag. Unreachable replicas report infinite lag.
+    """
+    if replica.dialect.name != 'postgresql':
+        return 0.0
+    try:
+        with replica.connect() as conn:
+            lag = conn.execute(text(
+                """
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                END
+                """
+            )).scalar()
+    except Exception as e:
+        logger.warning('Replica %s unavailable: %s', replica.url.host, e)
+        return float('inf')
+    return float(lag or 0)
+
+
+def replica_lag(replica) -> float:
+    """Cached variant of measure_replica_lag, refreshed every REPLICA_LAG_CHECK_SECONDS."""
+    now = time.monotonic()
+    with _lag_lock:
+        cached = _lag_cache.get(replica)
+    if cached and now - cached[0] < REPLICA_LAG_CHECK_SECONDS:
+        return cached[1]
+    lag = measure_replica_lag(replica)
+    with _lag_lock:
+        _lag_cache[replica] = (now, lag)
+    return lag
+
+
+def pick_replica():
+    """Round-robin over replicas within the lag budget; None means use the primary."""
+    replicas = get_replica_engines()
+    for _ in range(len(replicas)):
+        candidate = next(_replica_cycle)
+        if replica_lag(candidate) <= REPLICA_MAX_LAG_SECONDS:
+            return candidate
+    return None
+
+
+class PrimarySession(Session):
+    """Session bound to the primary engine, resolved when the first statement runs."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        return get_engine()
+
+
+SessionLocal = sessionmaker(class_=PrimarySession, autoflush=False, autocommit=False)
+
+
+class RoutingSession(Session):
+    """Session that sends reads to a replica and writes to the primary.
+
+    Once the session writes anything (or is told to via stick_to_primary) it stays on
+    the primary for the rest of its life, so read-your-writes flows never observe a
+    lagging replica. The chosen replica is pinned per session for consistent reads.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get('use_primary') or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.info['use_primary'] = True
+            return get_engine()
+        if 'replica' not in self.info:
+            self.info['replica'] = pick_replica() or get_engine()
+        return self.info['replica']
+
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autoflush=False, autocommit=False)
+
+
+def stick_to_primary(session: Session) -> None:
+    """Force a routing session to use the primary for all further statements."""
+    session.info['use_primary'] = True
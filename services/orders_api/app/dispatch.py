@@ -0,0 +1,96 @@
+"""Printable and CSV renderings of the packing lists from crud.get_packing_rows.
+
+Both are generators over the grouped rows, emitting customer and location
+subtotals as each contiguous run ends, so responses can be streamed.
+"""
+import csv
+import io
+
+NO_LOCATION = 'Sem local de recolha'
+
+
+def _runs(rows):
+    """
+    Yield ('row', r), ('customer', location, customer_id, name, qty), ('location', name, qty, products)
+    and finally ('total', qty); products are (sku, name, qty) totals for the location.
+    """
+    location = customer = None
+    location_qty = customer_qty = total = 0
+    customer_name = None
+    products = {}
+    for r in rows:
+        if customer is not None and (r.pickup_location != location or r.customer_id != customer):
+            yield ('customer', location, customer, customer_name, customer_qty)
+            customer_qty = 0
+        if location is not None and r.pickup_location != location:
+            yield ('location', location or NO_LOCATION, location_qty, sorted(products.values(), key=lambda p: p[1]))
+            location_qty = 0
+            products = {}
+        location, customer, customer_name = r.pickup_location, r.customer_id, r.customer_name
+        quantity = int(r.quantity)
+        customer_qty += quantity
+        location_qty += quantity
+        total += quantity
+        sku, name, qty = products.get(r.product_id, (r.sku, r.product_name, 0))
+        products[r.product_id] = (sku, name, qty + quantity)
+        yield ('row', r)
+    if customer is not None:
+        yield ('customer', location, customer, customer_name, customer_qty)
+        yield ('location', location or NO_LOCATION, location_qty, sorted(products.values(), key=lambda p: p[1]))
+    yield ('total', total)
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    writer.writerow(['pickup_location', 'customer_id', 'customer', 'sku', 'product', 'quantity', 'row_type'])
+    yield flush()
+    for event in _runs(rows):
+        kind = event[0]
+        if kind == 'row':
+            r = event[1]
+            writer.writerow([r.pickup_location, r.customer_id, r.customer_name, r.sku, r.product_name,
+                             int(r.quantity), 'item'])
+        elif kind == 'customer':
+            writer.writerow([event[1], event[2], event[3], '', '', event[4], 'customer_subtotal'])
+        elif kind == 'location':
+            for sku, name, quantity in event[3]:
+                writer.writerow([event[1], '', '', sku, name, quantity, 'location_product_total'])
+            writer.writerow([event[1], '', '', '', '', event[2], 'location_subtotal'])
+        else:
+            writer.writerow(['', '', '', '', '', event[1], 'total'])
+        yield flush()
+
+
+def iter_text(rows, start, end):
+    period = start.isoformat() if start == end else f'{start.isoformat()} a {end.isoformat()}'
+    yield f'LISTAS DE EMBALAGEM - {period}\n'
+    location = customer = None
+    for event in _runs(rows):
+        kind = event[0]
+        if kind == 'row':
+            r = event[1]
+            if r.pickup_location != location:
+                location, customer = r.pickup_location, None
+                title = location or NO_LOCATION
+                yield f'\n{"=" * 60}\n{title}\n{"=" * 60}\n'
+            if r.customer_id != customer:
+                customer = r.customer_id
+                yield f'\n  {r.customer_name} (#{r.customer_id})\n'
+            yield f'    [ ] {int(r.quantity):>4} x {r.product_name} ({r.sku})\n'
+        elif kind == 'customer':
+            yield f'    {"-" * 40}\n    {event[4]:>8} unidades\n'
+        elif kind == 'location':
+            yield f'\n  Total {event[1]}:\n'
+            for sku, name, quantity in event[3]:
+                yield f'    {quantity:>8} x {name} ({sku})\n'
+            yield f'    {event[2]:>8} unidades\n'
+        else:
+            yield f'\nTOTAL GERAL: {event[1]} unidades\n'
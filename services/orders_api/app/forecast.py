@@ -0,0 +1,245 @@
+"""Demand forecasts per product and weekday from order history.
+
+Walk-in and one-off orders (everything not generated by a recurring plan) are summed
+per product and delivery date. For each product and weekday, the series of those
+daily quantities (one point per week) is smoothed exponentially:
+
+    level    <- level + a * (y - level)
+    variance <- variance + a * ((y - level before)^2 - variance)
+
+with a = max(FORECAST_ALPHA, 1 / observations): the first weeks give a plain running
+mean and later weeks weigh recent demand more. Each closed day updates every product at
+once as numpy vectors. Days without any order at all are taken as days the shop was
+closed and skipped, so they don't drag the levels down.
+
+The fitted parameters live in forecast_params, with the last day folded in kept in
+forecast_state, so all workers share them. refresh() only folds in the days closed
+since then; changing FORECAST_ALPHA (or refit=True) refits from FORECAST_HISTORY_DAYS
+of history. Each worker also keeps the parameters in memory until the next day closes.
+
+Subscription demand is not forecast: it is already on the books as the plans'
+generated orders and is added to the suggested quantity as ordered.
+"""
+import os
+import threading
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+FORECAST_ALPHA = float(os.getenv('FORECAST_ALPHA', '0.3'))
+FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', '365'))
+
+
+class FittedModel:
+    """Parameters per product (rows, in product_ids order) and weekday (columns)."""
+    __slots__ = ('product_ids', 'level', 'variance', 'observations', 'fitted_through', 'alpha')
+
+    def __init__(self, product_ids, level, variance, observations, fitted_through, alpha):
+        self.product_ids = product_ids
+        self.level = level
+        self.variance = variance
+        self.observations = observations
+        self.fitted_through = fitted_through
+        self.alpha = alpha
+
+    @classmethod
+    def empty(cls, fitted_through, alpha):
+        return cls(np.empty(0, np.int64), np.zeros((0, 7)), np.zeros((0, 7)), np.zeros((0, 7), np.int64),
+                   fitted_through, alpha)
+
+    def add_products(self, product_ids):
+        """Append zero rows for products not seen before; returns the row of each id."""
+        new = np.setdiff1d(np.asarray(product_ids, dtype=np.int64), self.product_ids)
+        if len(new):
+            self.product_ids = np.concatenate([self.product_ids, new])
+            order = np.argsort(self.product_ids, kind='stable')
+            self.product_ids = self.product_ids[order]
+            pad = np.zeros((len(new), 7))
+            self.level = np.concatenate([self.level, pad])[order]
+            self.variance = np.concatenate([self.variance, pad])[order]
+            self.observations = np.concatenate([self.observations, pad.astype(np.int64)])[order]
+        return np.searchsorted(self.product_ids, np.asarray(product_ids, dtype=np.int64))
+
+    def update(self, trading_days, rows):
+        """Fold in closed days: trading_days are the dates with any order, rows are
+        (delivery_date, product_id, quantity) of one-off demand on those days."""
+        if not trading_days:
+            return
+        day_index = {day: i for i, day in enumerate(trading_days)}
+        if rows:
+            days, product_col, quantities = zip(*rows)
+            product_rows = self.add_products(product_col)
+        demand = np.zeros((len(trading_days), len(self.product_ids)))
+        if rows:
+            np.add.at(demand, ([day_index[d] for d in days], product_rows), np.asarray(quantities, dtype=float))
+
+        for i, day in enumerate(trading_days):
+            w = day.weekday()
+            n = self.observations[:, w] + 1
+            a = np.maximum(self.alpha, 1.0 / n)
+            error = demand[i] - self.level[:, w]
+            self.variance[:, w] += np.where(n > 1, a * (error ** 2 - self.variance[:, w]), 0.0)
+            self.level[:, w] += a * error
+            self.observations[:, w] = n
+
+    def predict(self, day, confidence):
+        """(forecast, lower, upper) per product for `day`. The band widens with the
+        number of weeks ahead as for simple exponential smoothing."""
+        w = day.weekday()
+        weeks_ahead = max(1, ((day - self.fitted_through).days + 6) // 7)
+        spread = np.sqrt(self.variance[:, w] * (1 + (weeks_ahead - 1) * self.alpha ** 2))
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        forecast = np.where(self.observations[:, w] > 0, self.level[:, w], 0.0)
+        return forecast, np.maximum(forecast - z * spread, 0.0), forecast + z * spread
+
+
+def _one_off_demand(db: Session, after, through):
+    """(delivery_date, product_id, quantity) of orders not generated by a plan."""
+    return (
+        db.query(models.Order.delivery_date, models.OrderItem.product_id, func.sum(models.OrderItem.quantity))
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .filter(models.Order.delivery_date > after, models.Order.delivery_date <= through)
+        .filter(models.Order.recurring_plan_id.is_(None))
+        .group_by(models.Order.delivery_date, models.OrderItem.product_id)
+        .all()
+    )
+
+
+def _trading_days(db: Session, after, through):
+    return [
+        d for (d,) in db.query(models.Order.delivery_date)
+        .filter(models.Order.delivery_date > after, models.Order.delivery_date <= through)
+        .distinct()
+        .order_by(models.Order.delivery_date)
+    ]
+
+
+def _load(db: Session):
+    state = db.query(models.ForecastState).first()
+    if state is None:
+        return None
+    params = db.query(models.ForecastParam).order_by(models.ForecastParam.product_id).all()
+    model = FittedModel.empty(state.fitted_through, state.alpha)
+    if params:
+        model.add_products(sorted({p.product_id for p in params}))
+        rows = np.searchsorted(model.product_ids, [p.product_id for p in params])
+        columns = [p.weekday for p in params]
+        model.level[rows, columns] = [p.level for p in params]
+        model.variance[rows, columns] = [p.variance for p in params]
+        model.observations[rows, columns] = [p.observations for p in params]
+    return model
+
+
+def _save(db: Session, model: FittedModel):
+    db.query(models.ForecastParam).delete()
+    rows, columns = np.nonzero(model.observations)
+    if len(rows):
+        db.execute(insert(models.ForecastParam), [
+            {'product_id': int(model.product_ids[r]), 'weekday': int(c), 'level': float(model.level[r, c]),
+             'variance': float(model.variance[r, c]), 'observations': int(model.observations[r, c])}
+            for r, c in zip(rows, columns)
+        ])
+    state = db.query(models.ForecastState).first() or models.ForecastState(id=1)
+    state.fitted_through = model.fitted_through
+    state.alpha = model.alpha
+    db.add(state)
+
+
+def refresh(db: Session, today=None, refit: bool = False) -> FittedModel:
+    """Bring the stored parameters up to yesterday and return them. Concurrent callers
+    on Postgres wait for each other (advisory lock) instead of fitting twice."""
+    closed_through = (today or date.today()) - timedelta(days=1)
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext('fam_forecast'))"))
+    model = None if refit else _load(db)
+    if model is None or model.alpha != FORECAST_ALPHA:
+        model = FittedModel.empty(closed_through - timedelta(days=FORECAST_HISTORY_DAYS), FORECAST_ALPHA)
+    if model.fitted_through < closed_through:
+        after = model.fitted_through
+        model.update(_trading_days(db, after, closed_through), _one_off_demand(db, after, closed_through))
+        model.fitted_through = closed_through
+        _save(db, model)
+    db.commit()
+    return model
+
+
+_cached = None
+_cache_lock = threading.Lock()
+
+
+def get_model(db: Session) -> FittedModel:
+    """This worker's copy of the parameters, refreshed once per closed day."""
+    global _cached
+    with _cache_lock:
+        if _cached is None or _cached.fitted_through < date.today() - timedelta(days=1):
+            _cached = refresh(db)
+        return _cached
+
+
+def forecast(db: Session, start, days: int, confidence: float, product_id=None):
+    """
+    Expected one-off demand per product for each date in [start, start + days), with a
+    confidence band, next to what is already ordered for that date. `suggested` is
+    what to bake: subscription orders plus the larger of the one-off orders so far and
+    the band's upper bound, rounded up to the product's batch_size.
+    """
+    model = get_model(db)
+    end = start + timedelta(days=days - 1)
+    ordered = {}
+    query = (
+        db.query(models.Order.delivery_date, models.OrderItem.product_id,
+                 models.Order.recurring_plan_id.isnot(None), func.sum(models.OrderItem.quantity))
+        .join(models.Order, models.Order.id == models.OrderItem.order_id)
+        .filter(models.Order.delivery_date >= start, models.Order.delivery_date <= end)
+        .filter(models.Order.is_monthly_payment.isnot(True))
+    )
+    if product_id is not None:
+        query = query.filter(models.OrderItem.product_id == product_id)
+    for day, pid, subscription, quantity in query.group_by(
+            models.Order.delivery_date, models.OrderItem.product_id, models.Order.recurring_plan_id.isnot(None)):
+        ordered.setdefault((day, pid), [0, 0])[1 if subscription else 0] += int(quantity)
+
+    product_ids = {int(p) for p in model.product_ids} | {pid for _, pid in ordered}
+    if product_id is not None:
+        product_ids &= {product_id}
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids))}
+    rows = {int(p): i for i, p in enumerate(model.product_ids)}
+    by_name = sorted(products, key=lambda p: products[p].name)
+
+    result = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        expected, lower, upper = model.predict(day, confidence)
+        lines = []
+        for pid in by_name:
+            row = rows.get(pid)
+            one_off, subscription = ordered.get((day, pid), (0, 0))
+            f = float(expected[row]) if row is not None else 0.0
+            if f < 0.05 and not one_off and not subscription:
+                continue
+            hi = float(upper[row]) if row is not None else 0.0
+            needed = subscription + max(one_off, int(np.ceil(hi)))
+            batch = products[pid].batch_size or 1
+            lines.append({
+                'product_id': pid,
+                'sku': products[pid].sku,
+                'name': products[pid].name,
+                'forecast': round(f, 2),
+                'lower': round(float(lower[row]), 2) if row is not None else 0.0,
+                'upper': round(hi, 2),
+                'ordered': one_off,
+                'subscription_ordered': subscription,
+                'suggested': -(-needed // batch) * batch,
+            })
+        result.append({'date': day, 'products': lines})
+    return {
+        'fitted_through': model.fitted_through,
+        'alpha': model.alpha,
+        'confidence': confidence,
+        'days': result,
+    }
@@ -0,0 +1,83 @@
+"""Order status history, written by the database.
+
+A trigger on `orders` appends an order_status_history row when an order is inserted
+and whenever an UPDATE changes its status, so the transition and its history entry
+are one statement and the application never inserts history itself. A bulk
+`UPDATE orders SET status = ... WHERE id IN (...)` records one entry per order that
+actually changed.
+
+The trigger is installed by the baseline migration (alembic/versions) and whenever
+create_all creates order_status_history (see models.py). Bulk loaders that write their own backdated
+history (perf/datagen.py) drop it for the duration of the load.
+"""
+import logging
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+POSTGRES_TRIGGER = [
+    """
+    CREATE OR REPLACE FUNCTION record_order_status() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' OR NEW.status IS DISTINCT FROM OLD.status THEN
+            INSERT INTO order_status_history (order_id, status, changed_at)
+            VALUES (NEW.id, NEW.status, clock_timestamp());
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_orders_status_history ON orders",
+    """
+    CREATE TRIGGER trg_orders_status_history
+    AFTER INSERT OR UPDATE OF status ON orders
+    FOR EACH ROW EXECUTE FUNCTION record_order_status()
+    """,
+]
+
+SQLITE_TRIGGER = [
+    "DROP TRIGGER IF EXISTS trg_orders_status_history_insert",
+    """
+    CREATE TRIGGER trg_orders_status_history_insert AFTER INSERT ON orders
+    BEGIN
+        INSERT INTO order_status_history (order_id, status, changed_at)
+        VALUES (NEW.id, NEW.status, CURRENT_TIMESTAMP);
+    END
+    """,
+    "DROP TRIGGER IF EXISTS trg_orders_status_history_update",
+    """
+    CREATE TRIGGER trg_orders_status_history_update AFTER UPDATE OF status ON orders
+    WHEN NEW.status IS NOT OLD.status
+    BEGIN
+        INSERT INTO order_status_history (order_id, status, changed_at)
+        VALUES (NEW.id, NEW.status, CURRENT_TIMESTAMP);
+    END
+    """,
+]
+
+DROP_TRIGGER = {
+    'postgresql': ["DROP TRIGGER IF EXISTS trg_orders_status_history ON orders"],
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS trg_orders_status_history_insert",
+        "DROP TRIGGER IF EXISTS trg_orders_status_history_update",
+    ],
+}
+
+
+def install_triggers(conn) -> None:
+    statements = {'postgresql': POSTGRES_TRIGGER, 'sqlite': SQLITE_TRIGGER}.get(conn.dialect.name)
+    if statements is None:
+        logger.warning('No status history trigger for %s; history will not be recorded', conn.dialect.name)
+        return
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def drop_triggers(conn) -> None:
+    for statement in DROP_TRIGGER.get(conn.dialect.name, []):
+        conn.execute(text(statement))
+
+
+def on_history_table_created(target, connection, **kw) -> None:
+    install_triggers(connection)
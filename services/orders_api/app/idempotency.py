@@ -0,0 +1,129 @@
+"""Idempotency keys for retried writes.
+
+A client sends `Idempotency-Key: <uuid>` with POST /orders or a bulk endpoint. The
+first request reserves the key (unique per key, method and path) before doing any
+work and stores its response when it succeeds; a retry with the same key and body
+gets the stored response back (with `Idempotent-Replayed: true`) instead of creating
+the order again. A retry while the first request is still running gets 409, and the
+same key with a different body gets 422. Failed requests release the key so they can
+be retried. Stored responses expire after IDEMPOTENCY_TTL_HOURS.
+
+The work and its stored response are committed in one transaction (the handler's own
+commits only flush), so a worker that dies in between leaves neither. Its reservation
+then lapses after IDEMPOTENCY_LEASE_SECONDS and a retry runs the request again.
+"""
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', '24'))
+# How long a reservation without a stored response blocks retries (longer than any request)
+LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '300'))
+MAX_KEY_LENGTH = 255
+
+
+def _request_hash(request, payload: Any) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f'{request.url.query}\n{body}'.encode()).hexdigest()
+
+
+def _reserve(db: Session, key: str, request, request_hash: str):
+    now = datetime.now(timezone.utc)
+    record = models.IdempotencyKey(
+        key=key, method=request.method, path=request.url.path, request_hash=request_hash,
+        expires_at=now + timedelta(seconds=LEASE_SECONDS),
+    )
+    db.add(record)
+    try:
+        db.commit()
+        return record, None
+    except IntegrityError:
+        db.rollback()
+    existing = db.query(models.IdempotencyKey).filter_by(key=key, method=request.method, path=request.url.path).one()
+    expires_at = existing.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= now:
+        db.delete(existing)
+        db.commit()
+        return _reserve(db, key, request, request_hash)
+    return None, existing
+
+
+@contextmanager
+def _one_transaction(db: Session):
+    """Turn the commits of crud functions called inside into flushes; the caller commits."""
+    db.commit = db.flush
+    try:
+        yield
+    finally:
+        del db.commit
+
+
+def _response(body, status_code: int = 200, headers=None, replayed: bool = False):
+    headers = dict(headers(body)) if headers else {}
+    if replayed:
+        headers['Idempotent-Replayed'] = 'true'
+    return JSONResponse(body, status_code=status_code, headers=headers)
+
+
+def run(db: Session, key: Optional[str], request, payload: Any, handler: Callable[[], Any], response_model=None,
+        headers: Optional[Callable[[Any], dict]] = None):
+    """Run handler() at most once per key; without a key it simply runs it. headers(body)
+    gives extra response headers, also on replays (e.g. the ETag of a created order)."""
+    if not key:
+        if headers is None:
+            return handler()
+        return _response(_encode(handler(), response_model), headers=headers)
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f'Idempotency-Key longer than {MAX_KEY_LENGTH} characters')
+
+    request_hash = _request_hash(request, payload)
+    record, existing = _reserve(db, key, request, request_hash)
+    if existing is not None:
+        if existing.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail='Idempotency-Key was already used with a different request')
+        if existing.status_code is None:
+            raise HTTPException(status_code=409, detail='A request with this Idempotency-Key is still in progress')
+        return _response(json.loads(existing.response_body), existing.status_code, headers, replayed=True)
+
+    try:
+        with _one_transaction(db):
+            body = _encode(handler(), response_model)
+            db.query(models.IdempotencyKey).filter_by(id=record.id).update({
+                'status_code': 200, 'response_body': json.dumps(body),
+                'expires_at': datetime.now(timezone.utc) + timedelta(hours=TTL_HOURS),
+            })
+        db.commit()
+    except Exception:
+        db.rollback()
+        db.query(models.IdempotencyKey).filter_by(id=record.id).delete()
+        db.commit()
+        raise
+    return _response(body, headers=headers)
+
+
+def _encode(result, response_model):
+    if response_model is not None:
+        # response_model is a pydantic TypeAdapter, e.g. TypeAdapter(schemas.OrderRead)
+        return response_model.dump_python(response_model.validate_python(result, from_attributes=True), mode='json')
+    return jsonable_encoder(result)
+
+
+def purge_expired(db: Session) -> int:
+    deleted = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.expires_at <= datetime.now(timezone.utc)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -1,18 +1,45 @@
-from datetime import timedelta
-from typing import List, Optional
-
-from fastapi import Depends, FastAPI, HTTPException, status
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-
-from . import auth, crud, db, models, schemas
-from .db import SessionLocal, engine
-
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title='FAM Orders API')
+from sqlalchemy.orm.exc import StaleDataError
+
+from . import (auth, crud, db, dispatch, idempotency, metrics, migrations, models,
+               outbox, profiling, projection, schemas, tracing)
+from .db import ReadSessionLocal, SessionLocal
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema changes are applied by `alembic upgrade head` before workers start. The pool
+    # is warmed in the background: the worker serves (and /health/live answers) right
+    # away, even while the database is slow or unreachable
+    warm_up = asyncio.get_running_loop().run_in_executor(None, db.warm_up)
+    dispatcher = None
+    if outbox.ENABLED and outbox.IN_APP_DISPATCHER:
+        dispatcher = outbox.Dispatcher(SessionLocal, outbox.configured_sinks())
+        dispatcher.start()
+    yield
+    if dispatcher:
+        dispatcher.stop()
+    await warm_up
+    db.dispose_engines()
+    if tracing.ENABLED:
+        tracing.exporter.shutdown()
+
+
+app = FastAPI(title='FAM Orders API', lifespan=lifespan)
+if profiling.ENABLED:
+    app.router.route_class = profiling.ProfilingRoute
 
 # CORS middleware for React app
 app.add_middleware(
@@ -21,7 +48,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed", "X-Trace-Id"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+if tracing.ENABLED:
+    # Spans per request, crud call and SQL statement; nothing is installed otherwise
+    tracing.instrument()
+    app.add_middleware(tracing.TracingMiddleware)
+
+if db.DATABASE_REPLICA_URLS:
+    @app.middleware('http')
+    async def read_your_writes(request: Request, call_next):
+        # Clients that just wrote keep reading from the primary until replicas catch up
+        response = await call_next(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(db.PRIMARY_STICKY_COOKIE, '1', max_age=db.REPLICA_STICKY_SECONDS, httponly=True)
+        return response
+
 
 def get_db():
     db_session = SessionLocal()
@@ -31,11 +74,102 @@ def get_db():
         db_session.close()
 
 
+def get_read_db(request: Request):
+    """Session for read-only endpoints, routed to a replica when one is healthy."""
+    db_session = ReadSessionLocal()
+    if request.cookies.get(db.PRIMARY_STICKY_COOKIE):
+        db.stick_to_primary(db_session)
+    try:
+        yield db_session
+    finally:
+        db_session.close()
+
+
+@app.exception_handler(crud.VersionConflict)
+def version_conflict_handler(request: Request, exc: crud.VersionConflict):
+    return JSONResponse(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        content={'detail': str(exc), 'current_version': exc.current_version},
+        headers={'ETag': f'"{exc.current_version}"'},
+    )
+
+
+@app.exception_handler(StaleDataError)
+def stale_data_handler(request: Request, exc: StaleDataError):
+    # Another request updated the same row between our read and our write
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT,
+                        content={'detail': 'Order was modified concurrently, reload and retry'})
+
+
+def if_match_version(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """Order version from an If-Match header ("3" or W/"3"); None when absent or *."""
+    if not if_match or if_match.strip() == '*':
+        return None
+    try:
+        return int(if_match.strip().removeprefix('W/').strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='If-Match must be the ETag of the order')
+
+
+def set_etag(response: Response, order) -> None:
+    response.headers['ETag'] = f'"{order.version}"'
+
+
+def order_etag(body: dict) -> dict:
+    """ETag header of a serialized order (idempotent responses, replays included)."""
+    return {'ETag': f'"{body["version"]}"'}
+
+
+ORDER_ADAPTER = TypeAdapter(schemas.OrderRead)
+ORDER_LIST_ADAPTER = TypeAdapter(List[schemas.OrderRead])
+BILLING_SUMMARY_ADAPTER = TypeAdapter(schemas.BillingRunSummary)
+
+
 @app.get('/health')
+@app.get('/health/live')
 def health():
+    """Liveness: the worker is up and serving, whatever the state of the database."""
     return JSONResponse({'status': 'ok'})
 
 
+@app.get('/health/ready')
+def health_ready():
+    """Readiness: the database answers and its schema is at the latest migration."""
+    try:
+        with db.get_engine().connect() as conn:
+            revision = migrations.current_revision(conn)
+    except Exception as e:
+        return JSONResponse({'status': 'unavailable', 'detail': f'database: {e.__class__.__name__}'},
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    head = migrations.head_revision()
+    if revision != head:
+        return JSONResponse({'status': 'unavailable', 'detail': f'schema at {revision}, expected {head}'},
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JSONResponse({'status': 'ok', 'schema': revision})
+
+
+@app.get('/metrics', include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+
+# --- Profiling (admin only) ---
+@app.get('/admin/profiles')
+def list_profiles(current_user: models.User = Depends(auth.require_role([models.UserRole.admin]))):
+    return profiling.list_profiles()
+
+
+@app.get('/admin/profiles/{profile_id}')
+def download_profile(
+    profile_id: str,
+    current_user: models.User = Depends(auth.require_role([models.UserRole.admin]))
+):
+    path = profiling.profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail='Profile not found')
+    return FileResponse(path, filename=profile_id, media_type='application/octet-stream')
+
+
 # --- Authentication ---
 @app.post('/auth/login', response_model=schemas.Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
@@ -152,10 +286,34 @@ async def delete_user(
     return {'message': 'User deleted successfully'}
 
 
+def parse_fieldset(model, fields: Optional[str], expand: Optional[str]):
+    try:
+        return projection.parse_fieldset(model, fields, expand)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def projection_payload(data):
+    # Decimals as strings, matching how the response models serialize them
+    return jsonable_encoder(data, custom_encoder={Decimal: str})
+
+
+def projected(rows, fieldset):
+    """Serialize only the requested fields; bypasses the full response model."""
+    return JSONResponse(projection_payload([projection.serialize(row, fieldset) for row in rows]))
+
+
 # --- Customers ---
 @app.get('/customers', response_model=List[schemas.CustomerRead])
-def list_customers(db: Session = Depends(get_db)):
-    return crud.get_customers(db)
+def list_customers(
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """fields/expand return a sparse fieldset, e.g. ?fields=id,name,pickup_location"""
+    fieldset = parse_fieldset(models.Customer, fields, expand)
+    customers = crud.get_customers(db, fieldset=fieldset)
+    return projected(customers, fieldset) if fieldset else customers
 
 
 @app.get('/customers/{customer_id}', response_model=schemas.CustomerRead)
@@ -189,8 +347,16 @@ def delete_customer(customer_id: int, db: Session = Depends(get_db)):
 
 # --- Products ---
 @app.get('/products', response_model=List[schemas.ProductRead])
-def list_products(active: Optional[bool] = None, db: Session = Depends(get_db)):
-    return crud.get_products(db, active)
+def list_products(
+    active: Optional[bool] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """fields/expand return a sparse fieldset, e.g. ?fields=id,name,unit_price"""
+    fieldset = parse_fieldset(models.Product, fields, expand)
+    products = crud.get_products(db, active, fieldset=fieldset)
+    return projected(products, fieldset) if fieldset else products
 
 
 @app.get('/products/{product_id}', response_model=schemas.ProductRead)
@@ -222,97 +388,262 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     return {'message': 'Product deleted successfully'}
 
 
+@app.get('/products/{product_id}/recipe', response_model=schemas.RecipeRead)
+def read_recipe(product_id: int, db: Session = Depends(get_db)):
+    recipe = crud.get_recipe(db, product_id)
+    if not recipe:
+        raise HTTPException(status_code=404, detail='Recipe not found')
+    return recipe
+
+
+@app.put('/products/{product_id}/recipe', response_model=schemas.RecipeRead)
+def set_recipe(product_id: int, payload: schemas.RecipeCreate, db: Session = Depends(get_db)):
+    """Ingredients for one batch of batch_yield units (default: the product's batch_size)."""
+    try:
+        recipe = crud.set_recipe(db, product_id, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not recipe:
+        raise HTTPException(status_code=404, detail='Product not found')
+    return recipe
+
+
+@app.delete('/products/{product_id}/recipe')
+def delete_recipe(product_id: int, db: Session = Depends(get_db)):
+    if not crud.delete_recipe(db, product_id):
+        raise HTTPException(status_code=404, detail='Recipe not found')
+    return {'message': 'Recipe deleted successfully'}
+
+
+# --- Ingredients ---
+@app.get('/ingredients', response_model=List[schemas.IngredientRead])
+def list_ingredients(db: Session = Depends(get_read_db)):
+    return crud.get_ingredients(db)
+
+
+@app.post('/ingredients', response_model=schemas.IngredientRead)
+def create_ingredient(i: schemas.IngredientCreate, db: Session = Depends(get_db)):
+    return crud.create_ingredient(db, i)
+
+
+@app.put('/ingredients/{ingredient_id}', response_model=schemas.IngredientRead)
+def update_ingredient(ingredient_id: int, i: schemas.IngredientCreate, db: Session = Depends(get_db)):
+    ingredient = crud.update_ingredient(db, ingredient_id, i)
+    if not ingredient:
+        raise HTTPException(status_code=404, detail='Ingredient not found')
+    return ingredient
+
+
+@app.delete('/ingredients/{ingredient_id}')
+def delete_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
+    try:
+        success = crud.delete_ingredient(db, ingredient_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not success:
+        raise HTTPException(status_code=404, detail='Ingredient not found')
+    return {'message': 'Ingredient deleted successfully'}
+
+
 # --- Orders ---
 @app.get('/orders', response_model=List[schemas.OrderRead])
 def list_orders(
     status: Optional[str] = None,
     customer_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Without fields/expand every order embeds its customer and items with products.
+    Sparse fieldset for the calendar: GET /orders?fields=id,delivery_date,status,customer.name
+    Only the listed columns are selected and only the named relationships are loaded;
+    expand=items.product includes whole related rows.
+    """
+    fieldset = parse_fieldset(models.Order, fields, expand)
+    orders = crud.get_orders(db, status, customer_id, fieldset=fieldset)
+    return projected(orders, fieldset) if fieldset else orders
+
+
+@app.get('/orders/search', response_model=schemas.OrderSearchResult)
+def search_orders(
+    q: Optional[str] = None,
+    status: Optional[str] = None,
+    customer_id: Optional[int] = None,
+    delivery_from: Optional[date] = None,
+    delivery_to: Optional[date] = None,
+    urgent_hours: Optional[int] = Query(None, ge=0),
+    sort: str = 'delivery_date',
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=0, le=500),
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Server-side search over customer name, notes and product names.
+    Example: GET /orders/search?q=croissant&urgent_hours=24&sort=-delivery_date&limit=50
+    fields/expand work as on GET /orders.
+    """
+    fieldset = parse_fieldset(models.Order, fields, expand)
+    if sort not in crud.ORDER_SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail=f'Invalid sort. Allowed: {list(crud.ORDER_SEARCH_SORTS)}')
+    total, orders = crud.search_orders(
+        db, q=q, status=status, customer_id=customer_id,
+        delivery_from=delivery_from, delivery_to=delivery_to, urgent_hours=urgent_hours,
+        sort=sort, skip=skip, limit=limit, fieldset=fieldset,
+    )
+    if fieldset:
+        return JSONResponse(projection_payload({
+            'total': total,
+            'items': [projection.serialize(order, fieldset) for order in orders],
+        }))
+    return {'total': total, 'items': orders}
+
+
+@app.get('/orders/bootstrap', response_model=schemas.OrdersBootstrap)
+def orders_bootstrap(
+    q: Optional[str] = None,
+    status: Optional[str] = None,
+    customer_id: Optional[int] = None,
+    delivery_from: Optional[date] = None,
+    delivery_to: Optional[date] = None,
+    sort: str = 'delivery_date',
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=0, le=500),
+    urgent_hours: int = Query(24, ge=0),
+    catalog: bool = False,
+    db: Session = Depends(get_read_db)
+):
+    """
+    The orders view in one round trip: a page of orders as on /orders/search, with
+    customers and products sent once in maps keyed by id instead of embedded in every
+    order and item, plus the count of undelivered orders due within urgent_hours.
+    catalog=true includes every customer and product (for the order forms).
+    Example: GET /orders/bootstrap?q=croissant&limit=50&catalog=true
+    """
+    if sort not in crud.ORDER_SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail=f'Invalid sort. Allowed: {list(crud.ORDER_SEARCH_SORTS)}')
+    return crud.get_orders_bootstrap(
+        db, catalog=catalog, urgent_hours=urgent_hours,
+        q=q, status=status, customer_id=customer_id, delivery_from=delivery_from, delivery_to=delivery_to,
+        sort=sort, skip=skip, limit=limit,
+    )
+
+
+@app.patch('/orders/status', response_model=List[schemas.OrderRead])
+def update_orders_status(
+    payload: schemas.OrderBulkStatusUpdate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    return crud.get_orders(db, status, customer_id)
+    """Move many orders to one status in a single statement (e.g. a Kanban column)."""
+    allowed = [s.value for s in models.OrderStatus]
+    if payload.status not in allowed:
+        raise HTTPException(status_code=400, detail=f'Invalid status: {payload.status}. Allowed: {allowed}')
+
+    def update():
+        found = {row.id for row in db.query(models.Order.id).filter(models.Order.id.in_(payload.order_ids))}
+        missing = set(payload.order_ids) - found
+        if missing:
+            raise HTTPException(status_code=404, detail=f'Orders not found: {sorted(missing)}')
+        orders, changed_ids = crud.update_orders_status(db, payload.order_ids, payload.status)
+        if payload.status == 'pago':
+            crud.generate_orders_for_paid_subscriptions(db, [o for o in orders if o.id in set(changed_ids)])
+        return orders
+    return idempotency.run(db, idempotency_key, request, payload, update, ORDER_LIST_ADAPTER)
+
+
+@app.get('/orders/history', response_model=Dict[int, List[schemas.OrderTimelineEntry]])
+def order_timelines(ids: str = Query(..., description='comma-separated order ids'), db: Session = Depends(get_read_db)):
+    """Status timelines for many orders: GET /orders/history?ids=12,15,18"""
+    try:
+        order_ids = [int(i) for i in ids.split(',') if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail='ids must be comma-separated integers')
+    if len(order_ids) > 1000:
+        raise HTTPException(status_code=400, detail='At most 1000 ids per request')
+    return crud.get_order_timelines(db, order_ids)
 
 
 @app.get('/orders/{order_id}', response_model=schemas.OrderRead)
-def read_order(order_id: int, db: Session = Depends(get_db)):
-    order = crud.get_order(db, order_id)
+def read_order(order_id: int, response: Response, db: Session = Depends(get_db)):
+    order = crud.get_order_or_archived(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail='Order not found')
+    set_etag(response, order)
     return order
 
 
 @app.post('/orders', response_model=schemas.OrderRead)
-def create_order(o: schemas.OrderCreate, db: Session = Depends(get_db)):
-    try:
-        order = crud.create_order(db, o)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    return order
+def create_order(
+    o: schemas.OrderCreate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Send an Idempotency-Key header to make retries safe (see idempotency.py)."""
+    def create():
+        try:
+            return crud.create_order(db, o)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return idempotency.run(db, idempotency_key, request, o, create, ORDER_ADAPTER, headers=order_etag)
 
 
 @app.put('/orders/{order_id}', response_model=schemas.OrderRead)
-def update_order(order_id: int, o: schemas.OrderCreate, db: Session = Depends(get_db)):
+def update_order(
+    order_id: int,
+    o: schemas.OrderCreate,
+    response: Response,
+    expected_version: Optional[int] = Depends(if_match_version),
+    db: Session = Depends(get_db)
+):
+    """With If-Match: <ETag>, fails with 412 if someone else changed the order meanwhile."""
     try:
-        order = crud.update_order(db, order_id, o)
+        order = crud.update_order(db, order_id, o, expected_version=expected_version)
         if not order:
             raise HTTPException(status_code=404, detail='Order not found')
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    set_etag(response, order)
     return order
 
 
 @app.patch('/orders/{order_id}/status', response_model=schemas.OrderRead)
-def update_order_status(order_id: int, payload: schemas.OrderStatusUpdate, db: Session = Depends(get_db)):
-    from datetime import datetime
-
-    from sqlalchemy import extract
-    
+def update_order_status(
+    order_id: int,
+    payload: schemas.OrderStatusUpdate,
+    response: Response,
+    expected_version: Optional[int] = Depends(if_match_version),
+    db: Session = Depends(get_db)
+):
     status = payload.status
     # Validate against enum values
     allowed = [s.value for s in models.OrderStatus]
-    print(f"DEBUG: Received status='{status}', allowed={allowed}")
     if status not in allowed:
-        print(f"DEBUG: Status '{status}' not in allowed values!")
         raise HTTPException(status_code=400, detail=f'Invalid status: {status}. Allowed: {allowed}')
     
-    order = crud.update_order_status(db, order_id, status)
+    order = crud.update_order_status(db, order_id, status, expected_version=expected_version)
     if not order:
         raise HTTPException(status_code=404, detail='Order not found')
     
     # If marking as "pago" and customer has subscription with recurring plan, generate monthly orders
-    if status == 'pago' and order.customer and order.customer.is_subscription:
-        # Get active recurring plan for this customer
-        active_plan = db.query(models.RecurringPlan).filter(
-            models.RecurringPlan.customer_id == order.customer_id,
-            models.RecurringPlan.active == True
-        ).first()
-        
-        if active_plan and order.delivery_date:
-            # Generate orders for this month if this is the first order of the month
-            month = order.delivery_date.month
-            year = order.delivery_date.year
-            
-            # Check if this is the first order of the month to be marked as paid
-            first_order_of_month = db.query(models.Order).filter(
-                models.Order.customer_id == order.customer_id,
-                models.Order.recurring_plan_id == active_plan.id,
-                models.Order.status == models.OrderStatus.pago,
-                models.Order.id != order_id  # Exclude current order
-            ).filter(
-                extract('month', models.Order.delivery_date) == month,
-                extract('year', models.Order.delivery_date) == year
-            ).first()
-            
-            if not first_order_of_month:
-                # This is the first paid order of the month, generate the rest
-                print(f"Generating monthly orders for plan {active_plan.id}, month {month}/{year}")
-                crud.generate_monthly_orders_from_plan(db, active_plan.id, month, year)
+    if status == 'pago':
+        crud.generate_orders_for_paid_subscriptions(db, [order])
     
+    set_etag(response, order)
     return order
 
 
 @app.delete('/orders/{order_id}')
-def delete_order(order_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_order(db, order_id)
+def delete_order(
+    order_id: int,
+    expected_version: Optional[int] = Depends(if_match_version),
+    db: Session = Depends(get_db)
+):
+    success = crud.delete_order(db, order_id, expected_version=expected_version)
     if not success:
         raise HTTPException(status_code=404, detail='Order not found')
     return {'message': 'Order deleted successfully'}
@@ -320,14 +651,14 @@ def delete_order(order_id: int, db: Session = Depends(get_db)):
 
 @app.get('/orders/{order_id}/history', response_model=List[schemas.OrderStatusHistoryRead])
 def get_order_history(order_id: int, db: Session = Depends(get_db)):
-    order = crud.get_order(db, order_id)
+    order = crud.get_order_or_archived(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail='Order not found')
     return crud.get_order_history(db, order_id)
 
 
 @app.get('/analytics/production-needs')
-def production_needs(date: str, db: Session = Depends(get_db)):
+def production_needs(date: str, db: Session = Depends(get_read_db)):
     try:
         needs = crud.get_production_needs_by_date(db, date)
         return needs
@@ -335,30 +666,93 @@ def production_needs(date: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get('/analytics/ingredient-needs', response_model=schemas.IngredientNeeds)
+def ingredient_needs(
+    start: date,
+    end: Optional[date] = None,
+    by_date: bool = False,
+    include_delivered: bool = False,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Ingredient totals for the deliveries between start and end (inclusive, defaults to
+    start), from each product's recipe, for purchasing. by_date=true adds the needs per
+    delivery date. Products without a recipe are listed with has_recipe=false.
+    Example: GET /analytics/ingredient-needs?start=2025-11-03&end=2025-11-30
+    """
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail='end must not be before start')
+    return crud.get_ingredient_needs(db, start, end, include_delivered=include_delivered, by_date=by_date)
+
+
+@app.get('/analytics/forecast', response_model=schemas.DemandForecast)
+def demand_forecast(
+    start: Optional[date] = None,
+    days: int = Query(7, ge=1, le=56),
+    confidence: float = Query(0.9, gt=0, lt=1),
+    product_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Expected walk-in/one-off demand per product for the next `days` days (from start,
+    default today) with a `confidence` band, next to what is already ordered, and a
+    suggested quantity to bake. Fitted per product and weekday on the order history
+    (see forecast.py); the first call after a day closes folds that day in.
+    """
+    from . import forecast
+
+    start = start or date.today()
+    return forecast.forecast(db, start, days, confidence, product_id=product_id)
+
+
+@app.get('/analytics/profitability', response_model=schemas.ProfitabilityReport, response_model_exclude_none=True)
+def profitability(
+    start: date,
+    end: Optional[date] = None,
+    group_by: str = Query('product', pattern='^(product|customer|month)$'),
+    db: Session = Depends(get_db)
+):
+    """
+    Revenue, cost and gross margin per product, customer or month for the whole months
+    from start to end (defaults to start's month). Subscription deliveries are valued
+    through their monthly payment order. Closed months are computed once and stored
+    (see profitability.py). Example: GET /analytics/profitability?start=2025-01-01&end=2025-12-31&group_by=customer
+    """
+    from . import profitability
+
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail='end must not be before start')
+    return profitability.report(db, start, end, group_by)
+
+
 @app.get('/analytics/inactive-customers', response_model=List[schemas.InactiveCustomerRead])
-def inactive_customers(days: int = 30, db: Session = Depends(get_db)):
-    customers = crud.get_inactive_customers(db, days)
+def inactive_customers(days: int = 30, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
+    customers = crud.get_inactive_customers(db, days, skip=skip, limit=limit)
     return customers
 
 
 @app.get('/analytics/dashboard')
-def dashboard_stats(days: int = 30, db: Session = Depends(get_db)):
+def dashboard_stats(
+    days: int = 30,
+    granularity: str = Query('auto', pattern='^(auto|day|week|month)$'),
+    compare: Optional[str] = Query(None, pattern='^previous$'),
+    db: Session = Depends(get_read_db),
+):
+    """Dashboard figures for the last `days` days. `orders_by_day` has one point per
+    day, week or month (granularity=auto keeps long ranges to about 60 points); with
+    compare=previous each point and the totals also carry the period before."""
     from datetime import datetime, timedelta, timezone
 
     from sqlalchemy import func
 
     # Calculate date filter
-    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-    
-    # Total orders (filtered by date)
-    total_orders = db.query(func.count(models.Order.id)).filter(
-        models.Order.created_at >= cutoff
-    ).scalar()
-    
-    # Total revenue (filtered)
-    total_revenue = db.query(func.sum(models.Order.total)).filter(
-        models.Order.created_at >= cutoff
-    ).scalar() or 0
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=days)
+
+    # Totals and orders per bucket (and for the previous period) in one query
+    series = crud.get_dashboard_series(db, days, granularity, compare == 'previous', now=now)
     
     # Orders by status (filtered)
     orders_by_status = db.query(
@@ -390,37 +784,79 @@ def dashboard_stats(days: int = 30, db: Session = Depends(get_db)):
     ).order_by(func.sum(models.Order.total).desc()
     ).limit(10).all()
     
-    # Orders by day (for the selected period)
-    orders_by_day = db.query(
-        func.date(models.Order.created_at).label('date'),
-        func.count(models.Order.id).label('count'),
-        func.sum(models.Order.total).label('revenue')
-    ).filter(models.Order.created_at >= cutoff
-    ).group_by(func.date(models.Order.created_at)
-    ).order_by(func.date(models.Order.created_at).asc()
-    ).all()
-    
-    # Total units sold (filtered)
-    total_units = db.query(func.sum(models.OrderItem.quantity)
-    ).join(models.Order, models.Order.id == models.OrderItem.order_id
-    ).filter(models.Order.created_at >= cutoff
-    ).scalar() or 0
-    
-    return {
-        'total_orders': total_orders,
-        'total_revenue': float(total_revenue),
-        'total_units': int(total_units),
+    stats = {
+        'total_orders': series['total_orders'],
+        'total_revenue': series['total_revenue'],
+        'total_units': series['total_units'],
         'orders_by_status': [{'status': s.value, 'count': c} for s, c in orders_by_status],
         'top_products': [{'id': p.id, 'name': p.name, 'total_units': int(p.total_units)} for p in top_products],
         'top_customers': [{'id': c.id, 'name': c.name, 'total_revenue': float(c.total_revenue)} for c in top_customers],
-        'orders_by_day': [{'date': str(d), 'count': c, 'revenue': float(r)} for d, c, r in orders_by_day]
+        'granularity': series['granularity'],
+        'orders_by_day': series['series'],
     }
+    if compare:
+        stats['previous'] = series['previous']
+        stats['change_pct'] = series['change_pct']
+    return stats
+
+
+# --- Dispatch ---
+@app.get('/dispatch/packing-lists', response_model=schemas.PackingLists)
+def packing_lists(
+    start: date,
+    end: Optional[date] = None,
+    format: str = Query('json', pattern='^(json|csv|txt)$'),
+    include_delivered: bool = False,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Packing lists per pickup location and customer (product x quantity) for deliveries
+    between start and end (inclusive, defaults to start), with customer and location
+    subtotals. format=csv or format=txt streams a spreadsheet or printable version.
+    """
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail='end must not be before start')
+    rows = crud.get_packing_rows(db, start, end, include_delivered=include_delivered)
+    filename = f'packing-{start.isoformat()}' + (f'_{end.isoformat()}' if end != start else '')
+    if format == 'csv':
+        return StreamingResponse(
+            dispatch.iter_csv(rows), media_type='text/csv; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename="{filename}.csv"'},
+        )
+    if format == 'txt':
+        return StreamingResponse(dispatch.iter_text(rows, start, end), media_type='text/plain; charset=utf-8')
+    return {'start': start, 'end': end, **crud.build_packing_lists(rows)}
 
 
 # --- Recurring Plans ---
 @app.get('/recurring/plans', response_model=List[schemas.RecurringPlanRead])
-def list_plans(customer_id: Optional[int] = None, db: Session = Depends(get_db)):
-    return crud.list_recurring_plans(db, customer_id)
+def list_plans(
+    customer_id: Optional[int] = None,
+    customer_ids: Optional[str] = Query(None, description='comma-separated customer ids'),
+    active: Optional[bool] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Plans with their items for one or many customers in one call:
+    GET /recurring/plans?customer_ids=3,8,21&expand=items.product
+    fields/expand work as on GET /orders.
+    """
+    ids = None
+    if customer_ids is not None or customer_id is not None:
+        try:
+            ids = {int(i) for i in (customer_ids or '').split(',') if i.strip()}
+        except ValueError:
+            raise HTTPException(status_code=400, detail='customer_ids must be comma-separated integers')
+        if customer_id is not None:
+            ids.add(customer_id)
+        if len(ids) > 1000:
+            raise HTTPException(status_code=400, detail='At most 1000 customer ids per request')
+    fieldset = parse_fieldset(models.RecurringPlan, fields, expand)
+    plans = crud.list_recurring_plans(db, ids, active=active, fieldset=fieldset)
+    return projected(plans, fieldset) if fieldset else plans
 
 
 @app.get('/recurring/plans/{plan_id}', response_model=schemas.RecurringPlanRead)
@@ -453,7 +889,14 @@ def delete_plan(plan_id: int, db: Session = Depends(get_db)):
 
 
 @app.post('/recurring/plans/{plan_id}/generate-orders', response_model=List[schemas.OrderRead])
-def generate_orders_from_plan(plan_id: int, month: int, year: int, db: Session = Depends(get_db)):
+def generate_orders_from_plan(
+    plan_id: int,
+    month: int,
+    year: int,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """
     Generate weekly orders for a subscription plan for the specified month.
     Example: POST /recurring/plans/1/generate-orders?month=11&year=2025
@@ -462,14 +905,47 @@ def generate_orders_from_plan(plan_id: int, month: int, year: int, db: Session =
     if not plan:
         raise HTTPException(status_code=404, detail='Plan not found')
     
-    orders = crud.generate_monthly_orders_from_plan(db, plan_id, month, year)
-    return orders
+    def generate():
+        return crud.generate_monthly_orders_from_plan(db, plan_id, month, year)
+    return idempotency.run(db, idempotency_key, request, None, generate, ORDER_LIST_ADAPTER)
 
 
+@app.post('/recurring/plans/{plan_id}/create-monthly-payment', response_model=schemas.OrderRead)
+def create_monthly_payment(plan_id: int, month: int, year: int, db: Session = Depends(get_db)):
+    """
+    Create (or return the existing) monthly payment order for one plan.
+    Example: POST /recurring/plans/1/create-monthly-payment?month=11&year=2025
+    """
+    plan = crud.get_recurring_plan(db, plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail='Plan not found')
     
+    order = crud.create_monthly_payment_order(db, plan_id, month, year)
+    if not order:
+        raise HTTPException(status_code=400, detail='Plan has no billable deliveries in this month')
     return order
 
 
+@app.post('/recurring/billing-run', response_model=schemas.BillingRunSummary)
+def billing_run(
+    month: int,
+    year: int,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: models.User = Depends(auth.require_role([models.UserRole.admin, models.UserRole.manager])),
+    db: Session = Depends(get_db)
+):
+    """
+    Create monthly payment orders for every active plan in one operation.
+    Safe to re-run: plans already billed for the month are skipped.
+    Example: POST /recurring/billing-run?month=11&year=2025
+    """
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail='Invalid month')
+    return idempotency.run(db, idempotency_key, request, None,
+                           lambda: crud.run_monthly_billing(db, month, year), BILLING_SUMMARY_ADAPTER)
+
+
 # --- Settings ---
 @app.get('/settings', response_model=schemas.SettingsRead)
 def get_settings(db: Session = Depends(get_db)):
@@ -0,0 +1,183 @@
+"""Request timing, SQL statement accounting and slow-query logging.
+
+Metrics are kept in-process and exposed in Prometheus text format by the /metrics
+endpoint. Each worker process reports its own counters.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statements slower than this are logged with their parameters and route
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    """Per-request accumulator shared with the SQLAlchemy event hooks."""
+    __slots__ = ('scope', 'statements', 'db_seconds')
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get('route')
+        return route.path if route is not None else 'unmatched'
+
+
+_current_request: contextvars.ContextVar = contextvars.ContextVar('fam_request_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_latency = {}  # (method, route, status) -> Histogram
+        self.request_statements = {}  # (method, route) -> Histogram
+        self.request_db_seconds = {}  # (method, route) -> float
+        self.statements_total = 0
+        self.db_seconds_total = 0.0
+        self.slow_queries = {}  # route -> count
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        with self._lock:
+            self.request_latency.setdefault((method, route, str(status)), Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.request_statements.setdefault((method, route), Histogram(STATEMENT_BUCKETS)).observe(stats.statements)
+            key = (method, route)
+            self.request_db_seconds[key] = self.request_db_seconds.get(key, 0.0) + stats.db_seconds
+
+    def observe_statement(self, seconds: float, slow_route=None) -> None:
+        with self._lock:
+            self.statements_total += 1
+            self.db_seconds_total += seconds
+            if slow_route is not None:
+                self.slow_queries[slow_route] = self.slow_queries.get(slow_route, 0) + 1
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append('# HELP fam_http_request_duration_seconds HTTP request latency by route.')
+            lines.append('# TYPE fam_http_request_duration_seconds histogram')
+            for (method, route, status), hist in sorted(self.request_latency.items()):
+                _render_histogram(lines, 'fam_http_request_duration_seconds', hist,
+                                  {'method': method, 'route': route, 'status': status})
+
+            lines.append('# HELP fam_http_request_db_statements SQL statements executed per request.')
+            lines.append('# TYPE fam_http_request_db_statements histogram')
+            for (method, route), hist in sorted(self.request_statements.items()):
+                _render_histogram(lines, 'fam_http_request_db_statements', hist, {'method': method, 'route': route})
+
+            lines.append('# HELP fam_http_request_db_seconds_total Time spent in SQL per route.')
+            lines.append('# TYPE fam_http_request_db_seconds_total counter')
+            for (method, route), seconds in sorted(self.request_db_seconds.items()):
+                lines.append(f'fam_http_request_db_seconds_total{_labels({"method": method, "route": route})} {seconds:.6f}')
+
+            lines.append('# HELP fam_db_statements_total SQL statements executed by this process.')
+            lines.append('# TYPE fam_db_statements_total counter')
+            lines.append(f'fam_db_statements_total {self.statements_total}')
+            lines.append('# HELP fam_db_seconds_total Time spent in SQL by this process.')
+            lines.append('# TYPE fam_db_seconds_total counter')
+            lines.append(f'fam_db_seconds_total {self.db_seconds_total:.6f}')
+
+            lines.append(f'# HELP fam_db_slow_queries_total Statements slower than {SLOW_QUERY_MS:g}ms.')
+            lines.append('# TYPE fam_db_slow_queries_total counter')
+            for route, count in sorted(self.slow_queries.items()):
+                lines.append(f'fam_db_slow_queries_total{_labels({"route": route})} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: dict) -> str:
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _render_histogram(lines: list, name: str, hist: Histogram, labels: dict) -> None:
+    for bound, count in zip(hist.buckets, hist.counts):
+        lines.append(f'{name}_bucket{_labels({**labels, "le": f"{bound:g}"})} {count}')
+    lines.append(f'{name}_bucket{_labels({**labels, "le": "+Inf"})} {hist.count}')
+    lines.append(f'{name}_sum{_labels(labels)} {hist.sum:.6f}')
+    lines.append(f'{name}_count{_labels(labels)} {hist.count}')
+
+
+registry = Registry()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('fam_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['fam_query_start'].pop()
+    stats = _current_request.get()
+    slow_route = None
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_route = stats.route if stats is not None else '-'
+        params = repr(parameters)
+        if len(params) > 1000:
+            params = params[:1000] + '...'
+        logger.warning('Slow query (%.1fms) route=%s params=%s: %s', elapsed * 1000, slow_route, params, statement)
+    registry.observe_statement(elapsed, slow_route)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage for every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current_request.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            registry.observe_request(scope['method'], stats.route, status_code, elapsed, stats)
+            _current_request.reset(token)
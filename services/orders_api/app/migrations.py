@@ -0,0 +1,39 @@
+"""Schema migrations with alembic (alembic.ini, alembic/versions).
+
+The API no longer creates tables on startup; run `alembic upgrade head` once per
+deploy before starting workers (the `migrate` service in docker-compose does). Scripts
+that need a schema (seed.py, perf/datagen.py) call upgrade() themselves, and
+/health/ready reports not ready until the database is at the head revision.
+"""
+from functools import lru_cache
+from pathlib import Path
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / 'alembic.ini'
+
+# alembic is imported inside the functions: API workers only need it for the first
+# readiness check, not at import time
+
+
+def alembic_config():
+    from alembic.config import Config
+
+    return Config(str(ALEMBIC_INI))
+
+
+def upgrade(revision: str = 'head') -> None:
+    from alembic import command
+
+    command.upgrade(alembic_config(), revision)
+
+
+@lru_cache(maxsize=None)
+def head_revision() -> str:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(conn):
+    from alembic.runtime.migration import MigrationContext
+
+    return MigrationContext.configure(conn).get_current_revision()
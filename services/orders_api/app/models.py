@@ -1,9 +1,11 @@
 import enum
 
-from sqlalchemy import (Boolean, Column, Date, DateTime, Enum, ForeignKey,
-                        Integer, Numeric, String, Text, func)
-from sqlalchemy.orm import relationship
+from sqlalchemy import (JSON, Boolean, Column, Date, DateTime, Enum, Float, ForeignKey,
+                        Index, Integer, Numeric, String, Text, UniqueConstraint,
+                        event, func, text)
+from sqlalchemy.orm import foreign, relationship
 
+from . import history
 from .db import Base
 
 
@@ -42,6 +44,7 @@ class Customer(Base):
     address = Column(String, nullable=True)
     pickup_location = Column(String, nullable=True)  # local de recolha preferido
     is_subscription = Column(Boolean, default=False, nullable=False)  # mensal subscription
+    last_order_at = Column(DateTime(timezone=True), nullable=True, index=True)  # maintained by order create/delete
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     orders = relationship('Order', back_populates='customer')
@@ -64,9 +67,18 @@ class Product(Base):
 
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        Index('ix_orders_customer_created', 'customer_id', 'created_at'),
+        # One generated delivery per plan and date, one monthly payment per plan and month
+        # (its delivery date is the month's first delivery); see crud.generate_monthly_orders_from_plan
+        Index('uq_orders_plan_delivery_generated', 'recurring_plan_id', 'delivery_date', unique=True,
+              postgresql_where=text('is_auto_generated'), sqlite_where=text('is_auto_generated')),
+        Index('uq_orders_plan_delivery_payment', 'recurring_plan_id', 'delivery_date', unique=True,
+              postgresql_where=text('is_monthly_payment'), sqlite_where=text('is_monthly_payment')),
+    )
     id = Column(Integer, primary_key=True)
     customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
-    delivery_date = Column(Date, nullable=True)
+    delivery_date = Column(Date, nullable=True, index=True)
     status = Column(Enum(OrderStatus), default=OrderStatus.encomendado, nullable=False)
     total = Column(Numeric(12, 2), default=0)
     notes = Column(Text, nullable=True)
@@ -74,6 +86,9 @@ class Order(Base):
     is_auto_generated = Column(Boolean, default=False, nullable=False)  # Auto-generated from subscription
     is_monthly_payment = Column(Boolean, default=False, nullable=False)  # Monthly payment order (not delivery)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # optimistic locking, sent as ETag
+
+    __mapper_args__ = {'version_id_col': version}
 
     customer = relationship('Customer', back_populates='orders')
     items = relationship('OrderItem', back_populates='order', cascade='all, delete-orphan')
@@ -83,8 +98,8 @@ class Order(Base):
 class OrderItem(Base):
     __tablename__ = 'order_items'
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
-    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False, index=True)
     quantity = Column(Integer, nullable=False, default=1)
     unit_price = Column(Numeric(10, 2), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -104,6 +119,9 @@ class RecurringPlan(Base):
     prepaid_month = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    items = relationship('RecurringPlanItem', back_populates='plan', cascade='all, delete-orphan',
+                         order_by='RecurringPlanItem.id')
+
 
 class RecurringPlanItem(Base):
     __tablename__ = 'recurring_plan_items'
@@ -112,6 +130,43 @@ class RecurringPlanItem(Base):
     product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
     quantity = Column(Integer, nullable=False, default=1)
 
+    plan = relationship('RecurringPlan', back_populates='items')
+    product = relationship('Product')
+
+
+# Bill of materials: what one batch of a product takes (see bom.py)
+class Ingredient(Base):
+    __tablename__ = 'ingredients'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    unit = Column(String, nullable=False, default='kg')  # kg, l, un, ...
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class Recipe(Base):
+    __tablename__ = 'recipes'
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), unique=True, nullable=False)
+    # Units one batch yields; if None, the product's batch_size (or 1)
+    batch_yield = Column(Integer, nullable=True)
+    notes = Column(Text, nullable=True)
+
+    product = relationship('Product')
+    ingredients = relationship('RecipeIngredient', back_populates='recipe', cascade='all, delete-orphan',
+                               order_by='RecipeIngredient.id')
+
+
+class RecipeIngredient(Base):
+    __tablename__ = 'recipe_ingredients'
+    __table_args__ = (UniqueConstraint('recipe_id', 'ingredient_id', name='uq_recipe_ingredient'),)
+    id = Column(Integer, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), nullable=False)
+    ingredient_id = Column(Integer, ForeignKey('ingredients.id'), nullable=False, index=True)
+    quantity = Column(Numeric(12, 4), nullable=False)  # per batch, in the ingredient's unit
+
+    recipe = relationship('Recipe', back_populates='ingredients')
+    ingredient = relationship('Ingredient')
+
 
 class OrderStatusHistory(Base):
     __tablename__ = 'order_status_history'
@@ -123,6 +178,131 @@ class OrderStatusHistory(Base):
     order = relationship('Order')
 
 
+# Rows are written by a trigger on orders, see history.py
+event.listen(OrderStatusHistory.__table__, 'after_create', history.on_history_table_created)
+
+
+# Archive of old delivered orders (see crud.archive_delivered_orders). Same columns as
+# the live tables, original ids kept, no foreign keys so rows can be moved freely.
+class OrderArchive(Base):
+    __tablename__ = 'orders_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    customer_id = Column(Integer, nullable=False, index=True)
+    delivery_date = Column(Date, nullable=True, index=True)
+    status = Column(Enum(OrderStatus), nullable=False)
+    total = Column(Numeric(12, 2), default=0)
+    notes = Column(Text, nullable=True)
+    recurring_plan_id = Column(Integer, nullable=True)
+    is_auto_generated = Column(Boolean, default=False, nullable=False)
+    is_monthly_payment = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime(timezone=True))
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    archived = True
+    customer = relationship('Customer', primaryjoin=lambda: foreign(OrderArchive.customer_id) == Customer.id, viewonly=True)
+    items = relationship('OrderItemArchive', primaryjoin=lambda: OrderArchive.id == foreign(OrderItemArchive.order_id),
+                         viewonly=True, order_by=lambda: OrderItemArchive.id)
+
+
+class OrderItemArchive(Base):
+    __tablename__ = 'order_items_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, nullable=False, index=True)
+    product_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False, default=1)
+    unit_price = Column(Numeric(10, 2), nullable=False)
+    created_at = Column(DateTime(timezone=True))
+
+    product = relationship('Product', primaryjoin=lambda: foreign(OrderItemArchive.product_id) == Product.id, viewonly=True)
+
+
+class OrderStatusHistoryArchive(Base):
+    __tablename__ = 'order_status_history_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, nullable=False, index=True)
+    status = Column(Enum(OrderStatus), nullable=False)
+    changed_at = Column(DateTime(timezone=True))
+
+
+class IdempotencyKey(Base):
+    """Stored response of a POST/PATCH sent with an Idempotency-Key header (see idempotency.py)."""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        UniqueConstraint('key', 'method', 'path', name='uq_idempotency_keys_key_method_path'),
+    )
+    id = Column(Integer, primary_key=True)
+    key = Column(String(255), nullable=False)
+    method = Column(String(10), nullable=False)
+    path = Column(Text, nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is still running
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class OutboxEvent(Base):
+    """Order lifecycle event written in the transaction that changed the order, delivered
+    to the configured sinks by the outbox dispatcher (see outbox.py)."""
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        # What the dispatcher polls: undelivered events that are due
+        Index('ix_outbox_events_pending', 'available_at', 'id',
+              postgresql_where=text('dispatched_at IS NULL AND failed_at IS NULL'),
+              sqlite_where=text('dispatched_at IS NULL AND failed_at IS NULL')),
+    )
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String(64), nullable=False)
+    order_id = Column(Integer, nullable=False, index=True)  # no FK: events outlive archived orders
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    available_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # next attempt
+    attempts = Column(Integer, nullable=False, server_default='0')
+    delivered_to = Column(JSON, nullable=True)  # names of the sinks that already have it
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)
+    failed_at = Column(DateTime(timezone=True), nullable=True)  # gave up after OUTBOX_MAX_ATTEMPTS
+    last_error = Column(Text, nullable=True)
+
+
+class ForecastParam(Base):
+    """Smoothed demand of one product on one weekday (see forecast.py). Derived data."""
+    __tablename__ = 'forecast_params'
+    product_id = Column(Integer, primary_key=True, autoincrement=False)
+    weekday = Column(Integer, primary_key=True, autoincrement=False)  # 0=Monday ... 6=Sunday
+    level = Column(Float, nullable=False)
+    variance = Column(Float, nullable=False)
+    observations = Column(Integer, nullable=False)
+
+
+class ForecastState(Base):
+    """Single row: the last closed day folded into forecast_params and the smoothing used."""
+    __tablename__ = 'forecast_state'
+    id = Column(Integer, primary_key=True)
+    fitted_through = Column(Date, nullable=False)
+    alpha = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ProfitabilityMonth(Base):
+    """Margin rollup of one closed month per customer and product (see profitability.py)."""
+    __tablename__ = 'profitability_months'
+    month = Column(Date, primary_key=True)  # first day of the month
+    customer_id = Column(Integer, primary_key=True, autoincrement=False)
+    product_id = Column(Integer, primary_key=True, autoincrement=False)
+    quantity = Column(Integer, nullable=False)
+    revenue = Column(Numeric(14, 2), nullable=False)
+    cost = Column(Numeric(14, 2), nullable=False)
+    uncosted_revenue = Column(Numeric(14, 2), nullable=False)  # revenue of products without cost_price
+
+
+class ProfitabilityPeriod(Base):
+    """Months whose rollup is stored in profitability_months (also when it has no rows)."""
+    __tablename__ = 'profitability_periods'
+    month = Column(Date, primary_key=True)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Settings(Base):
     __tablename__ = 'settings'
     id = Column(Integer, primary_key=True)
@@ -0,0 +1,337 @@
+"""Transactional outbox for order lifecycle events.
+
+crud writes an outbox_events row in the same transaction as the order change, so an
+event exists if and only if the change was committed, and requests never wait for the
+systems that consume them:
+
+    order.created     any new order (manual, generated weekly delivery, monthly payment)
+    order.paid        status changed to pago
+    order.delivered   status changed to delivered
+
+The dispatcher (`python maintenance.py outbox`, or a thread in each API worker with
+OUTBOX_DISPATCHER=true) claims due events in batches (FOR UPDATE SKIP LOCKED on
+Postgres, so several dispatchers share the work), hands each batch to every sink in
+OUTBOX_SINKS and marks the events dispatched once all sinks have them. A sink that
+fails gets the batch again later, with exponential backoff; sinks that succeeded are
+not sent it twice. After OUTBOX_MAX_ATTEMPTS an event is marked failed.
+
+Delivery is at least once: consumers should ignore event ids they have already seen.
+Ids increase in commit order, but an event that is retried arrives after later ones.
+Sinks: webhook (POST JSON to OUTBOX_WEBHOOK_URL), file (JSON lines), redis (XADD to a
+stream) and memory (kept in a list, for tests); register_sink() adds others.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+ENABLED = os.getenv('OUTBOX_ENABLED', '').lower() in ('1', 'true', 'yes')
+SINKS = [s.strip() for s in os.getenv('OUTBOX_SINKS', '').split(',') if s.strip()]
+BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '2'))
+# Run a dispatcher thread in each API worker instead of `maintenance.py outbox`
+IN_APP_DISPATCHER = os.getenv('OUTBOX_DISPATCHER', '').lower() in ('1', 'true', 'yes')
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+BACKOFF_SECONDS = float(os.getenv('OUTBOX_BACKOFF_SECONDS', '5'))
+MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', '600'))
+WEBHOOK_URL = os.getenv('OUTBOX_WEBHOOK_URL', '')
+# When set, webhook requests carry X-Outbox-Signature: sha256=<HMAC of the body>
+WEBHOOK_SECRET = os.getenv('OUTBOX_WEBHOOK_SECRET', '')
+WEBHOOK_TIMEOUT = float(os.getenv('OUTBOX_WEBHOOK_TIMEOUT', '10'))
+OUTBOX_FILE = os.getenv('OUTBOX_FILE', '/tmp/fam_outbox.jsonl')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+REDIS_STREAM = os.getenv('OUTBOX_REDIS_STREAM', 'fam:orders')
+
+logger = logging.getLogger(__name__)
+
+STATUS_EVENTS = {
+    models.OrderStatus.pago: 'order.paid',
+    models.OrderStatus.delivered: 'order.delivered',
+}
+
+_ORDER_COLUMNS = (
+    models.Order.id, models.Order.customer_id, models.Order.status, models.Order.total,
+    models.Order.delivery_date, models.Order.recurring_plan_id, models.Order.is_monthly_payment,
+    models.Order.is_auto_generated,
+)
+
+
+# --- Recording (inside the caller's transaction) ---
+
+def _payload(order) -> dict:
+    status = order.status
+    return {
+        'order_id': order.id,
+        'customer_id': order.customer_id,
+        'status': status.value if isinstance(status, models.OrderStatus) else status,
+        'total': str(order.total) if order.total is not None else None,
+        'delivery_date': order.delivery_date.isoformat() if order.delivery_date else None,
+        'recurring_plan_id': order.recurring_plan_id,
+        'is_monthly_payment': bool(order.is_monthly_payment),
+        'is_auto_generated': bool(order.is_auto_generated),
+    }
+
+
+def record(db: Session, event_type: str, orders) -> int:
+    """Add one event per order to the session's transaction; `orders` are Order objects
+    or rows with the same attributes, flushed (they need an id). No-op unless
+    OUTBOX_ENABLED."""
+    if not ENABLED or not orders:
+        return 0
+    db.execute(insert(models.OutboxEvent), [
+        {'event_type': event_type, 'order_id': order.id, 'payload': _payload(order)} for order in orders
+    ])
+    db.info['outbox_recorded'] = True
+    return len(orders)
+
+
+def record_ids(db: Session, event_type: str, order_ids) -> int:
+    """record() for orders written with bulk statements: reads them back by id."""
+    if not ENABLED or not order_ids:
+        return 0
+    rows = db.query(*_ORDER_COLUMNS).filter(models.Order.id.in_(list(order_ids))).order_by(models.Order.id).all()
+    return record(db, event_type, rows)
+
+
+_wake = threading.Event()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_dispatcher(session):
+    # A dispatcher thread in this process picks committed events up without waiting a poll
+    if session.info.pop('outbox_recorded', False):
+        _wake.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_recorded(session):
+    session.info.pop('outbox_recorded', None)
+
+
+# --- Sinks ---
+
+class WebhookSink:
+    """POSTs {"events": [...]} as JSON; any 2xx response is success."""
+    name = 'webhook'
+
+    def __init__(self, url=None, secret=None, timeout=None):
+        self.url = url or WEBHOOK_URL
+        self.secret = WEBHOOK_SECRET if secret is None else secret
+        self.timeout = timeout or WEBHOOK_TIMEOUT
+        if not self.url:
+            raise ValueError('OUTBOX_WEBHOOK_URL is not set')
+
+    def send(self, events):
+        body = json.dumps({'events': events}, separators=(',', ':')).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            digest = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+            headers['X-Outbox-Signature'] = f'sha256={digest}'
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        urllib.request.urlopen(request, timeout=self.timeout).close()  # raises on 4xx/5xx
+
+
+class FileSink:
+    """Appends one JSON line per event."""
+    name = 'file'
+
+    def __init__(self, path=None):
+        self.path = path or OUTBOX_FILE
+
+    def send(self, events):
+        with open(self.path, 'a') as f:
+            f.writelines(json.dumps(e, separators=(',', ':')) + '\n' for e in events)
+
+
+class RedisStreamSink:
+    """XADDs each event to a Redis stream (field `event`, the JSON envelope)."""
+    name = 'redis'
+
+    def __init__(self, url=None, stream=None):
+        import redis  # only needed when this sink is configured
+
+        self.client = redis.Redis.from_url(url or REDIS_URL)
+        self.stream = stream or REDIS_STREAM
+
+    def send(self, events):
+        pipe = self.client.pipeline(transaction=False)
+        for e in events:
+            pipe.xadd(self.stream, {'event': json.dumps(e, separators=(',', ':'))})
+        pipe.execute()
+
+
+class MemorySink:
+    """Keeps delivered events in `events`; fail_times makes the next sends raise."""
+    name = 'memory'
+
+    def __init__(self, fail_times=0):
+        self.events = []
+        self.fail_times = fail_times
+
+    def send(self, events):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise ConnectionError('memory sink set to fail')
+        self.events.extend(events)
+
+
+_sink_factories = {
+    'webhook': WebhookSink,
+    'file': FileSink,
+    'redis': RedisStreamSink,
+    'memory': MemorySink,
+}
+
+
+def register_sink(name: str, factory) -> None:
+    """Make `name` usable in OUTBOX_SINKS; factory() returns an object with .name and
+    .send(events), which raises when the batch was not delivered."""
+    _sink_factories[name] = factory
+
+
+def configured_sinks(names=None):
+    sinks = []
+    for name in names if names is not None else SINKS:
+        if name not in _sink_factories:
+            raise ValueError(f'Unknown outbox sink {name!r}; choose from {", ".join(_sink_factories)}')
+        sinks.append(_sink_factories[name]())
+    return sinks
+
+
+# --- Dispatching ---
+
+def envelope(e: models.OutboxEvent) -> dict:
+    return {
+        'id': e.id,
+        'type': e.event_type,
+        'order_id': e.order_id,
+        'occurred_at': e.created_at.isoformat() if e.created_at else None,
+        'data': e.payload,
+    }
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before attempt number attempts + 1: exponential, capped, with jitter."""
+    delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def dispatch_batch(db: Session, sinks, batch_size: int = BATCH_SIZE, now=None) -> dict:
+    """Deliver one batch of due events to every sink. Returns counts of the events
+    claimed, dispatched, retried and failed."""
+    now = now or datetime.now(timezone.utc)
+    event_ = models.OutboxEvent
+    query = (
+        db.query(event_)
+        .filter(event_.dispatched_at.is_(None), event_.failed_at.is_(None), event_.available_at <= now)
+        .order_by(event_.id)
+        .limit(batch_size)
+    )
+    if db.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    events = query.all()
+    summary = {'claimed': len(events), 'dispatched': 0, 'retried': 0, 'failed': 0}
+    if not events:
+        db.commit()
+        return summary
+
+    errors = {}
+    for sink in sinks:
+        pending = [e for e in events if sink.name not in (e.delivered_to or [])]
+        if not pending:
+            continue
+        try:
+            sink.send([envelope(e) for e in pending])
+        except Exception as exc:
+            errors[sink.name] = f'{sink.name}: {type(exc).__name__}: {exc}'
+            continue
+        for e in pending:
+            e.delivered_to = [*(e.delivered_to or []), sink.name]
+
+    for e in events:
+        missing = [errors[s.name] for s in sinks if s.name not in (e.delivered_to or [])]
+        if not missing:
+            e.dispatched_at = now
+            summary['dispatched'] += 1
+            continue
+        e.attempts += 1
+        e.last_error = '; '.join(missing)[:2000]
+        if e.attempts >= MAX_ATTEMPTS:
+            e.failed_at = now
+            summary['failed'] += 1
+        else:
+            e.available_at = now + timedelta(seconds=backoff(e.attempts))
+            summary['retried'] += 1
+    db.commit()
+    for message in errors.values():
+        logger.warning('Outbox delivery failed, will retry: %s', message)
+    return summary
+
+
+def purge_dispatched(db: Session, older_than_days: int) -> int:
+    """Delete events dispatched more than older_than_days ago."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    deleted = (
+        db.query(models.OutboxEvent)
+        .filter(models.OutboxEvent.dispatched_at.isnot(None), models.OutboxEvent.dispatched_at < cutoff)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
+
+
+class Dispatcher:
+    """Runs dispatch_batch until the outbox is drained, then waits for a commit in this
+    process that recorded events, or at most POLL_SECONDS."""
+
+    def __init__(self, session_factory, sinks, batch_size: int = BATCH_SIZE, poll_seconds: float = POLL_SECONDS):
+        self.session_factory = session_factory
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def run_once(self) -> dict:
+        """Dispatch until no due event is left (or every due one failed this round)."""
+        totals = {'claimed': 0, 'dispatched': 0, 'retried': 0, 'failed': 0}
+        while not self.stopping.is_set():
+            db = self.session_factory()
+            try:
+                summary = dispatch_batch(db, self.sinks, self.batch_size)
+            finally:
+                db.close()
+            for key, value in summary.items():
+                totals[key] += value
+            if summary['claimed'] < self.batch_size or not summary['dispatched']:
+                break
+        return totals
+
+    def run_forever(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning('Outbox dispatcher error: %s', e)
+            _wake.wait(self.poll_seconds)
+            _wake.clear()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run_forever, name='fam-outbox', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self.stopping.set()
+        _wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,135 @@
+"""Monthly range partitioning on Postgres.
+
+order_status_history is partitioned by changed_at, one partition per month
+(`order_status_history_p202511`) plus a default partition that catches anything
+outside the created range. orders and order_items stay regular tables: other tables
+hold foreign keys to orders.id, and a partitioned table's primary key has to include
+the partition column. Old delivered orders are instead moved to the *_archive tables
+(crud.archive_delivered_orders).
+
+Every function takes an open connection and is a no-op on other databases.
+"""
+import re
+from datetime import date
+
+from sqlalchemy import text
+
+PARTITIONED_TABLES = {'order_status_history': 'changed_at'}
+
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def is_postgres(conn) -> bool:
+    return conn.dialect.name == 'postgresql'
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = :table
+    """), {'table': table}).scalar() is not None
+
+
+def list_partitions(conn, table: str):
+    return [row[0] for row in conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+        ORDER BY c.relname
+    """), {'table': table})]
+
+
+def ensure_monthly_partitions(conn, table: str, start: date, end: date) -> list:
+    """Create the monthly partitions covering [start, end]; returns the names created.
+
+    Rows already sitting in the default partition for a new month are moved into it,
+    which detaches the default partition and locks the table until commit; creating
+    partitions ahead of time (maintenance.py partitions) keeps that from happening.
+    """
+    column = PARTITIONED_TABLES[table]
+    existing = set(list_partitions(conn, table))
+    default = f'{table}_default'
+    created = []
+    month = month_start(start)
+    while month <= end:
+        name = f'{table}_p{month:%Y%m}'
+        if name not in existing:
+            upper = add_months(month, 1)
+            bounds = {'lower': month, 'upper': upper}
+            stranded = default in existing and conn.execute(text(
+                f'SELECT 1 FROM {default} WHERE {column} >= :lower AND {column} < :upper LIMIT 1'
+            ), bounds).scalar() is not None
+            if stranded:
+                conn.execute(text(f'ALTER TABLE {table} DETACH PARTITION {default}'))
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{month}') TO ('{upper}')"
+            ))
+            if stranded:
+                conn.execute(text(
+                    f'INSERT INTO {table} SELECT * FROM {default} WHERE {column} >= :lower AND {column} < :upper'
+                ), bounds)
+                conn.execute(text(f'DELETE FROM {default} WHERE {column} >= :lower AND {column} < :upper'), bounds)
+                conn.execute(text(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT'))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def drop_empty_partitions(conn, table: str, before: date) -> list:
+    """Drop monthly partitions that end on or before `before` and hold no rows."""
+    dropped = []
+    for name in list_partitions(conn, table):
+        match = PARTITION_NAME_RE.search(name)
+        if not match:
+            continue
+        upper = add_months(date(int(match.group(1)), int(match.group(2)), 1), 1)
+        if upper <= before and conn.execute(text(f'SELECT 1 FROM {name} LIMIT 1')).scalar() is None:
+            conn.execute(text(f'DROP TABLE {name}'))
+            dropped.append(name)
+    return dropped
+
+
+def partition_order_status_history(conn, months_ahead: int = 3) -> bool:
+    """Convert order_status_history into a monthly partitioned table; False if already done."""
+    if not is_postgres(conn) or is_partitioned(conn, 'order_status_history'):
+        return False
+    conn.execute(text("UPDATE order_status_history SET changed_at = NOW() WHERE changed_at IS NULL"))
+    conn.execute(text("ALTER TABLE order_status_history RENAME TO order_status_history_old"))
+    conn.execute(text(
+        "ALTER TABLE order_status_history_old RENAME CONSTRAINT order_status_history_pkey TO order_status_history_old_pkey"
+    ))
+    conn.execute(text("""
+        CREATE TABLE order_status_history (
+            id INTEGER NOT NULL DEFAULT nextval('order_status_history_id_seq'),
+            order_id INTEGER NOT NULL REFERENCES orders(id),
+            status orderstatus NOT NULL,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, changed_at)
+        ) PARTITION BY RANGE (changed_at)
+    """))
+    conn.execute(text("ALTER SEQUENCE order_status_history_id_seq OWNED BY order_status_history.id"))
+    conn.execute(text(
+        "CREATE INDEX ix_order_status_history_order_id ON order_status_history (order_id, changed_at)"
+    ))
+    conn.execute(text("CREATE TABLE order_status_history_default PARTITION OF order_status_history DEFAULT"))
+    oldest = conn.execute(text("SELECT MIN(changed_at) FROM order_status_history_old")).scalar()
+    today = date.today()
+    ensure_monthly_partitions(conn, 'order_status_history', (oldest.date() if oldest else today),
+                              add_months(month_start(today), months_ahead))
+    conn.execute(text("""
+        INSERT INTO order_status_history (id, order_id, status, changed_at)
+        SELECT id, order_id, status, changed_at FROM order_status_history_old
+    """))
+    conn.execute(text("DROP TABLE order_status_history_old"))
+    return True
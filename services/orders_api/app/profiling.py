@@ -0,0 +1,220 @@
+"""On-demand request profiling.
+
+Off unless PROFILING_ENABLED is set; when off the default route class is used and
+requests pay nothing. When on, a request is profiled if an admin sends the
+`X-Profile: 1` header (or `?profile=1`), or if it falls into the
+PROFILING_SAMPLE_RATE fraction of requests. The profile covers the endpoint body
+(crud and ORM work) and response validation, which is where lazy relationship
+loads happen. Profiles are written to PROFILE_DIR and only the newest PROFILE_KEEP
+files are kept; admins download them from /admin/profiles.
+"""
+import cProfile
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from jose import JWTError, jwt
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+from . import auth, models
+from .db import SessionLocal
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # optional, only needed for speedscope output
+    PyinstrumentProfiler = None
+
+ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/fam_profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+# 'pstats' (cProfile, stdlib) or 'speedscope' (requires pyinstrument)
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'pstats')
+
+PROFILE_ID_RE = re.compile(r'^[\w.-]+$')
+
+logger = logging.getLogger(__name__)
+
+_active_capture: contextvars.ContextVar = contextvars.ContextVar('fam_profile_capture', default=None)
+
+
+class CProfileCapture:
+    extension = '.pstats'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def save(self, path: str):
+        self.profiler.dump_stats(path)
+
+
+class SpeedscopeCapture:
+    extension = '.speedscope.json'
+
+    def __init__(self):
+        self.profiler = PyinstrumentProfiler(interval=0.0005)
+        self.session = None
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.session = self.profiler.stop()
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            f.write(SpeedscopeRenderer().render(self.session))
+
+
+def _new_capture():
+    if PROFILE_FORMAT == 'speedscope':
+        if PyinstrumentProfiler is None:
+            logger.warning('PROFILE_FORMAT=speedscope needs pyinstrument; falling back to pstats')
+        else:
+            return SpeedscopeCapture()
+    return CProfileCapture()
+
+
+def _is_admin(token: str) -> bool:
+    try:
+        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        return False
+    db = SessionLocal()
+    try:
+        user = auth.get_user_by_username(db, payload.get('sub') or '')
+        return bool(user and user.is_active and user.role == models.UserRole.admin)
+    finally:
+        db.close()
+
+
+async def _should_profile(request) -> bool:
+    requested = request.headers.get('x-profile') == '1' or request.query_params.get('profile') == '1'
+    if requested:
+        authorization = request.headers.get('authorization', '')
+        if authorization.lower().startswith('bearer '):
+            return await run_in_threadpool(_is_admin, authorization[7:])
+        return False
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def _save(capture, request) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    route = request.scope.get('route')
+    route_name = re.sub(r'[^\w]+', '_', route.path if route else request.url.path).strip('_') or 'root'
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{request.method}-{route_name}-{uuid.uuid4().hex[:6]}{capture.extension}"
+    capture.save(os.path.join(PROFILE_DIR, profile_id))
+    _trim()
+    return profile_id
+
+
+def _trim() -> None:
+    """Keep only the newest PROFILE_KEEP profiles on disk."""
+    entries = list_profiles()
+    for entry in entries[PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, entry['id']))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles() -> list:
+    """Stored profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        path = os.path.join(PROFILE_DIR, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append({'id': name, 'size': stat.st_size, 'created_at': stat.st_mtime})
+    entries.sort(key=lambda e: e['created_at'], reverse=True)
+    return entries
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id)
+    return path if os.path.isfile(path) else None
+
+
+def _wrap_endpoint(endpoint, route_ref: list):
+    """Run the endpoint (and its response validation) under the active capture.
+
+    Wrapping the endpoint itself means sync endpoints are profiled on the
+    threadpool thread that actually executes them.
+    """
+    def validate(result):
+        route = route_ref[0]
+        if route.response_field is None or isinstance(result, Response):
+            return result
+        value, errors = route.response_field.validate(result, {}, loc=('response',))
+        return result if errors else value
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            capture = _active_capture.get()
+            if capture is None:
+                return await endpoint(*args, **kwargs)
+            capture.start()
+            try:
+                return validate(await endpoint(*args, **kwargs))
+            finally:
+                capture.stop()
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        capture = _active_capture.get()
+        if capture is None:
+            return endpoint(*args, **kwargs)
+        capture.start()
+        try:
+            return validate(endpoint(*args, **kwargs))
+        finally:
+            capture.stop()
+    return wrapper
+
+
+class ProfilingRoute(APIRoute):
+    """APIRoute that can capture a profile of individual requests."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        route_ref = []
+        super().__init__(path, _wrap_endpoint(endpoint, route_ref), **kwargs)
+        route_ref.append(self)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            if not await _should_profile(request):
+                return await handler(request)
+            capture = _new_capture()
+            token = _active_capture.set(capture)
+            try:
+                response = await handler(request)
+            finally:
+                _active_capture.reset(token)
+            response.headers['X-Profile-Id'] = await run_in_threadpool(_save, capture, request)
+            return response
+
+        return profiled_handler
@@ -0,0 +1,203 @@
+"""Gross margin by product, customer and month from Product.cost_price.
+
+Revenue is item quantity x unit_price. Subscription deliveries (orders generated by a
+plan, total 0) are valued through the plan's monthly payment order for that month,
+whose items carry the month's quantities and prices: the generated orders are left out
+so nothing is counted twice. Generated orders of a month the plan has no payment
+order for still count their cost, with no revenue. Cost is quantity x the product's
+cost_price (as it was when a closed month was stored); revenue of products without a
+cost_price is reported separately (uncosted_revenue) and left out of the margin.
+
+The rollup per (month, customer, product) is one GROUP BY over live and archived
+orders together (orders + orders_archive, order_items + order_items_archive), so a
+month moved by `maintenance.py archive` keeps its figures whether it is stored before
+or after being archived. Closed months (before the current one) are stored in
+profitability_months the first time they are asked for and read from there
+afterwards; the current month is always computed. Reports group the monthly rows by
+product, customer or month with numpy.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import and_, case, exists, extract, func, insert, or_, select, text, union_all
+from sqlalchemy.orm import Session
+
+from . import models
+from .partitions import add_months, month_start
+
+
+def _orders_and_items(first_month: date, end_month: date):
+    """Orders delivered in [first_month, end_month) and their items, live and archived
+    (maintenance.py archive moves old delivered orders out of orders), as subqueries."""
+    orders = union_all(*(
+        select(o.id, o.customer_id, o.delivery_date, o.recurring_plan_id, o.is_monthly_payment)
+        .where(o.delivery_date >= first_month, o.delivery_date < end_month)
+        for o in (models.Order, models.OrderArchive)
+    )).subquery('orders_all')
+    items = union_all(*(
+        select(i.order_id, i.product_id, i.quantity, i.unit_price)
+        for i in (models.OrderItem, models.OrderItemArchive)
+    )).subquery('items_all')
+    return orders, items
+
+
+def _rollup_query(db: Session, first_month: date, end_month: date):
+    """(year, month, customer_id, product_id, quantity, revenue, cost, uncosted_revenue)
+    for deliveries in [first_month, end_month)."""
+    orders, item = _orders_and_items(first_month, end_month)
+    order, payment, product = orders.c, orders.alias('payment').c, models.Product
+    year = extract('year', order.delivery_date)
+    month = extract('month', order.delivery_date)
+    plan_was_billed = exists().where(
+        payment.recurring_plan_id == order.recurring_plan_id,
+        payment.is_monthly_payment.is_(True),
+        extract('year', payment.delivery_date) == year,
+        extract('month', payment.delivery_date) == month,
+    )
+    billed = or_(order.recurring_plan_id.is_(None), order.is_monthly_payment.is_(True))
+    value = item.c.quantity * item.c.unit_price
+    return (
+        db.query(
+            year, month, order.customer_id, item.c.product_id,
+            func.sum(item.c.quantity),
+            func.sum(case((billed, value), else_=0)),
+            func.sum(item.c.quantity * func.coalesce(product.cost_price, 0)),
+            func.sum(case((and_(billed, product.cost_price.is_(None)), value), else_=0)),
+        )
+        .select_from(item)
+        .join(orders, order.id == item.c.order_id)
+        .join(product, product.id == item.c.product_id)
+        .filter(or_(billed, ~plan_was_billed))
+        .group_by(year, month, order.customer_id, item.c.product_id)
+        .all()
+    )
+
+
+def _as_rows(result):
+    return [
+        (date(int(y), int(m), 1), customer_id, product_id, int(quantity), float(revenue or 0), float(cost or 0),
+         float(uncosted or 0))
+        for y, m, customer_id, product_id, quantity, revenue, cost, uncosted in result
+    ]
+
+
+def _store_closed_months(db: Session, months):
+    """Compute and store the rollups of closed months not stored yet."""
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext('fam_profitability'))"))
+    stored = {m for (m,) in db.query(models.ProfitabilityPeriod.month)
+              .filter(models.ProfitabilityPeriod.month.in_(months))}
+    missing = sorted(set(months) - stored)
+    if missing:
+        rows = [r for r in _as_rows(_rollup_query(db, missing[0], add_months(missing[-1], 1)))
+                if r[0] not in stored]
+        if rows:
+            db.execute(insert(models.ProfitabilityMonth), [
+                {'month': m, 'customer_id': c, 'product_id': p, 'quantity': q, 'revenue': round(r, 2),
+                 'cost': round(k, 2), 'uncosted_revenue': round(u, 2)}
+                for m, c, p, q, r, k, u in rows
+            ])
+        db.execute(insert(models.ProfitabilityPeriod), [{'month': m} for m in missing])
+    db.commit()
+    return len(missing)
+
+
+def monthly_rows(db: Session, first_month: date, last_month: date, today=None):
+    """Rollup rows for the months first_month..last_month; closed months come from (or
+    are added to) profitability_months. Returns (rows, months computed now)."""
+    current = month_start(today or date.today())
+    months = []
+    m = first_month
+    while m <= last_month:
+        months.append(m)
+        m = add_months(m, 1)
+    closed = [m for m in months if m < current]
+    computed = _store_closed_months(db, closed) if closed else 0
+
+    rows = []
+    if closed:
+        stored = models.ProfitabilityMonth
+        rows = [
+            (r.month, r.customer_id, r.product_id, r.quantity, float(r.revenue), float(r.cost),
+             float(r.uncosted_revenue))
+            for r in db.query(stored).filter(stored.month >= closed[0], stored.month <= closed[-1])
+        ]
+    open_months = [m for m in months if m >= current]
+    if open_months:
+        rows += _as_rows(_rollup_query(db, open_months[0], add_months(open_months[-1], 1)))
+    return rows, computed
+
+
+def _measures(revenue, cost, uncosted, quantity):
+    costed = revenue - uncosted
+    margin = costed - cost
+    return {
+        'quantity': int(quantity),
+        'revenue': round(float(revenue), 2),
+        'cost': round(float(cost), 2),
+        'gross_margin': round(float(margin), 2),
+        'margin_pct': round(float(margin / costed * 100), 1) if costed else None,
+        'uncosted_revenue': round(float(uncosted), 2),
+    }
+
+
+def report(db: Session, start: date, end: date, group_by: str = 'product', today=None):
+    """Gross margin for the whole months from start's to end's, grouped by product,
+    customer or month, highest margin first (months in order)."""
+    first_month, last_month = month_start(start), month_start(end)
+    rows, computed = monthly_rows(db, first_month, last_month, today=today)
+    result = {
+        'start': first_month,
+        'end': add_months(last_month, 1) - timedelta(days=1),
+        'group_by': group_by,
+        'months_computed': computed,
+        'totals': _measures(0, 0, 0, 0),
+        'rows': [],
+    }
+    if not rows:
+        return result
+
+    months, customer_ids, product_ids, quantity, revenue, cost, uncosted = (np.asarray(c) for c in zip(*rows))
+    key = {
+        'product': product_ids,
+        'customer': customer_ids,
+        'month': np.asarray([m.toordinal() for m in months]),
+    }[group_by].astype(np.int64)
+    keys, group = np.unique(key, return_inverse=True)
+    sums = {
+        name: np.bincount(group, weights=values.astype(float), minlength=len(keys))
+        for name, values in (('quantity', quantity), ('revenue', revenue), ('cost', cost), ('uncosted', uncosted))
+    }
+    result['totals'] = _measures(revenue.sum(), cost.sum(), uncosted.sum(), quantity.sum())
+
+    if group_by == 'product':
+        names = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(keys.tolist()))}
+        label = lambda k: {'product_id': k, 'sku': names[k].sku if k in names else None,
+                           'name': names[k].name if k in names else None}
+    elif group_by == 'customer':
+        names = {c.id: c.name for c in db.query(models.Customer.id, models.Customer.name)
+                 .filter(models.Customer.id.in_(keys.tolist()))}
+        label = lambda k: {'customer_id': k, 'name': names.get(k)}
+    else:
+        label = lambda k: {'month': date.fromordinal(k)}
+    result['rows'] = [
+        {**label(int(k)), **_measures(sums['revenue'][i], sums['cost'][i], sums['uncosted'][i], sums['quantity'][i])}
+        for i, k in enumerate(keys)
+    ]
+    if group_by != 'month':
+        result['rows'].sort(key=lambda r: r['gross_margin'], reverse=True)
+    return result
+
+
+def clear(db: Session, since=None) -> int:
+    """Forget stored months (from `since` on, or all) so they are recomputed, e.g. after
+    correcting old orders or cost prices. Returns the number of months cleared."""
+    periods = db.query(models.ProfitabilityPeriod)
+    rollups = db.query(models.ProfitabilityMonth)
+    if since is not None:
+        periods = periods.filter(models.ProfitabilityPeriod.month >= month_start(since))
+        rollups = rollups.filter(models.ProfitabilityMonth.month >= month_start(since))
+    rollups.delete(synchronize_session=False)
+    cleared = periods.delete(synchronize_session=False)
+    db.commit()
+    return cleared
@@ -0,0 +1,83 @@
+"""Sparse fieldsets for list endpoints.
+
+`fields` selects columns (`id,status,customer.name`) and `expand` selects
+relationships (`customer,items.product`). A dotted field implies expanding its
+relationship. Only the requested columns are loaded from the database, only the
+requested relationships are loaded at all, and serialize() touches nothing else, so
+no lazy loads are triggered.
+"""
+from typing import Any, Dict, Optional
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+
+def _node() -> Dict[str, Any]:
+    return {'columns': None, 'relations': {}}
+
+
+def _split(value: Optional[str]):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def _descend(root, model, path, full_path):
+    node, current = root, model
+    for part in path:
+        relationships = sa_inspect(current).relationships
+        if part not in relationships:
+            raise ValueError(f'Cannot expand {full_path!r}: unknown relationship {part!r}')
+        node = node['relations'].setdefault(part, _node())
+        current = relationships[part].mapper.class_
+    return node, current
+
+
+def parse_fieldset(model, fields: Optional[str], expand: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Parse fields/expand query parameters into a tree; None when neither is given."""
+    if not fields and not expand:
+        return None
+    root = _node()
+    for path in _split(expand):
+        _descend(root, model, path.split('.'), path)
+    for path in _split(fields):
+        *relation_path, column = path.split('.')
+        node, current = _descend(root, model, relation_path, path)
+        if column not in sa_inspect(current).column_attrs:
+            raise ValueError(f'Unknown field {path!r}')
+        if node['columns'] is None:
+            node['columns'] = []
+        if column not in node['columns']:
+            node['columns'].append(column)
+    return root
+
+
+def _columns(model, node):
+    return node['columns'] if node['columns'] is not None else list(sa_inspect(model).column_attrs.keys())
+
+
+def loader_options(model, node) -> list:
+    """load_only/selectinload/joinedload options for the parsed fieldset."""
+    mapper = sa_inspect(model)
+    load_columns = set(_columns(model, node))
+    options = []
+    for name, child in node['relations'].items():
+        relationship = mapper.relationships[name]
+        # Keep the local join columns so the related rows can be matched up
+        load_columns.update(c.key for c in relationship.local_columns if c.key in mapper.column_attrs)
+        attr = getattr(model, name)
+        loader = selectinload(attr) if relationship.uselist else joinedload(attr)
+        options.append(loader.options(*loader_options(relationship.mapper.class_, child)))
+    options.insert(0, load_only(*[getattr(model, c) for c in sorted(load_columns)]))
+    return options
+
+
+def serialize(obj, node) -> Dict[str, Any]:
+    """Build a dict with only the requested columns and relationships."""
+    model = type(obj)
+    data = {column: getattr(obj, column) for column in _columns(model, node)}
+    for name, child in node['relations'].items():
+        value = getattr(obj, name)
+        if isinstance(value, list):
+            data[name] = [serialize(v, child) for v in value]
+        else:
+            data[name] = serialize(value, child) if value is not None else None
+    return data
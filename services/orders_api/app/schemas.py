@@ -1,6 +1,6 @@
 from datetime import date, datetime
 from decimal import Decimal
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, EmailStr, Field
 
@@ -68,6 +68,8 @@ class OrderRead(BaseModel):
     recurring_plan_id: Optional[int] = None
     is_auto_generated: Optional[bool] = False
     is_monthly_payment: Optional[bool] = False
+    version: int = 1
+    archived: bool = False
     items: List[OrderItemRead] = []
     customer: Optional[CustomerRead] = None
     
@@ -75,10 +77,61 @@ class OrderRead(BaseModel):
         from_attributes = True
 
 
+class OrderSearchResult(BaseModel):
+    total: int
+    items: List[OrderRead] = []
+
+
+class OrderItemRef(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    unit_price: Decimal
+
+    class Config:
+        from_attributes = True
+
+
+class OrderRef(BaseModel):
+    """An order without its customer and products embedded; see OrdersBootstrap."""
+    id: int
+    customer_id: int
+    delivery_date: Optional[date]
+    status: str
+    total: Decimal
+    notes: Optional[str] = None
+    recurring_plan_id: Optional[int] = None
+    is_auto_generated: Optional[bool] = False
+    is_monthly_payment: Optional[bool] = False
+    version: int = 1
+    items: List[OrderItemRef] = []
+
+    class Config:
+        from_attributes = True
+
+
+class OrdersBootstrap(BaseModel):
+    total: int
+    urgent_count: int
+    orders: List[OrderRef] = []
+    customers: Dict[int, CustomerRead] = {}
+    products: Dict[int, ProductRead] = {}
+
+
 class OrderStatusUpdate(BaseModel):
     status: str
 
 
+class OrderBulkStatusUpdate(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    status: str
+
+
+class OrderTimelineEntry(BaseModel):
+    status: str
+    changed_at: Optional[datetime] = None
+
+
 class OrderStatusHistoryRead(BaseModel):
     id: Optional[int] = None
     status: str
@@ -94,6 +147,9 @@ class InactiveCustomerRead(BaseModel):
     email: Optional[str] = None
     phone: Optional[str] = None
     address: Optional[str] = None
+    last_order_at: Optional[datetime] = None
+    days_since_last_order: Optional[int] = None
+    lifetime_revenue: Decimal = Decimal('0')
 
     class Config:
         from_attributes = True
@@ -177,6 +233,173 @@ class RecurringPlanRead(BaseModel):
         from_attributes = True
 
 
+class BillingRunSummary(BaseModel):
+    month: int
+    year: int
+    plans_considered: int
+    created: int
+    already_billed: int
+    skipped_plan_ids: List[int] = []
+    total_amount: Decimal
+    order_ids: List[int] = []
+
+
+# Dispatch
+class PackingItem(BaseModel):
+    product_id: int
+    sku: str
+    name: str
+    quantity: int
+
+
+class PackingCustomer(BaseModel):
+    customer_id: int
+    name: str
+    total_quantity: int
+    items: List[PackingItem] = []
+
+
+class PackingLocation(BaseModel):
+    pickup_location: Optional[str] = None
+    total_quantity: int
+    products: List[PackingItem] = []
+    customers: List[PackingCustomer] = []
+
+
+class PackingLists(BaseModel):
+    start: date
+    end: date
+    total_quantity: int
+    locations: List[PackingLocation] = []
+
+
+# Bill of materials
+class IngredientCreate(BaseModel):
+    name: str
+    unit: str = 'kg'
+
+
+class IngredientRead(IngredientCreate):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+
+class RecipeIngredientCreate(BaseModel):
+    ingredient_id: int
+    quantity: Decimal = Field(..., gt=0)  # per batch, in the ingredient's unit
+
+
+class RecipeIngredientRead(RecipeIngredientCreate):
+    ingredient: Optional[IngredientRead] = None
+
+    class Config:
+        from_attributes = True
+
+
+class RecipeCreate(BaseModel):
+    batch_yield: Optional[int] = Field(None, gt=0)  # units per batch; default: the product's batch_size
+    notes: Optional[str] = None
+    ingredients: List[RecipeIngredientCreate] = []
+
+
+class RecipeRead(RecipeCreate):
+    id: int
+    product_id: int
+    ingredients: List[RecipeIngredientRead] = []
+
+    class Config:
+        from_attributes = True
+
+
+class IngredientNeed(BaseModel):
+    ingredient_id: int
+    name: str
+    unit: str
+    quantity: float
+
+
+class ProductionLine(BaseModel):
+    product_id: int
+    sku: str
+    name: str
+    quantity: int  # units to make, rounded up to batch_size per delivery date
+    batches: int
+    has_recipe: bool
+
+
+class IngredientNeedsDay(BaseModel):
+    date: date
+    ingredients: List[IngredientNeed] = []
+
+
+class IngredientNeeds(BaseModel):
+    start: date
+    end: date
+    ingredients: List[IngredientNeed] = []
+    products: List[ProductionLine] = []
+    by_date: Optional[List[IngredientNeedsDay]] = None
+
+
+# Forecast
+class ForecastLine(BaseModel):
+    product_id: int
+    sku: str
+    name: str
+    forecast: float  # expected one-off demand
+    lower: float
+    upper: float
+    ordered: int  # one-off orders already placed
+    subscription_ordered: int
+    suggested: int  # subscription + max(ordered, upper), rounded up to batch_size
+
+
+class ForecastDay(BaseModel):
+    date: date
+    products: List[ForecastLine] = []
+
+
+class DemandForecast(BaseModel):
+    fitted_through: date
+    alpha: float
+    confidence: float
+    days: List[ForecastDay] = []
+
+
+# Profitability
+class MarginRow(BaseModel):
+    product_id: Optional[int] = None
+    customer_id: Optional[int] = None
+    month: Optional[date] = None
+    sku: Optional[str] = None
+    name: Optional[str] = None
+    quantity: int
+    revenue: float
+    cost: float
+    gross_margin: float  # revenue of products with a cost_price minus their cost
+    margin_pct: Optional[float] = None
+    uncosted_revenue: float
+
+
+class MarginTotals(BaseModel):
+    quantity: int
+    revenue: float
+    cost: float
+    gross_margin: float
+    margin_pct: Optional[float] = None
+    uncosted_revenue: float
+
+
+class ProfitabilityReport(BaseModel):
+    start: date
+    end: date
+    group_by: str
+    months_computed: int
+    totals: MarginTotals
+    rows: List[MarginRow] = []
+
+
 # Settings
 class SettingsUpdate(BaseModel):
     production_day: Optional[int] = Field(None, ge=0, le=6)  # 0=Monday to 6=Sunday
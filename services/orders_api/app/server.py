@@ -0,0 +1,16 @@
+"""Gunicorn worker for the API (see gunicorn.conf.py)."""
+from uvicorn_worker import UvicornWorker
+
+
+class Worker(UvicornWorker):
+    """Uvicorn worker that drains in-flight requests on shutdown.
+
+    On SIGTERM (deploy, scale-down) or after max_requests the worker stops accepting
+    connections and lets running requests finish. It finishes a few seconds before
+    gunicorn's graceful_timeout would kill it, so the lifespan shutdown still runs and
+    disposes the connection pools.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.timeout_graceful_shutdown = max(1, self.cfg.graceful_timeout - 5)
@@ -0,0 +1,379 @@
+"""Request tracing: spans for each HTTP request, crud call and SQL statement.
+
+Off unless TRACING_ENABLED is set; when off nothing is installed and requests pay
+nothing. When on, a request is traced if its W3C `traceparent` header says the caller
+sampled it, or else with probability TRACING_SAMPLE_RATE. A traced request gets:
+
+    GET /orders/{order_id}          the request (route, status)
+      crud.get_order                every public function in crud, with the number of
+        SELECT orders               rows it returned, and every statement it ran, with
+                                    db.rows_affected
+
+Spans follow OpenTelemetry naming and are written in the OTLP/JSON encoding, by a
+background thread, either as JSON lines to TRACING_FILE (one export request per line)
+or POSTed to an OTLP/HTTP collector at TRACING_OTLP_ENDPOINT. Sampled responses
+carry an X-Trace-Id header. Statement text is recorded, parameters are not.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+
+ENABLED = os.getenv('TRACING_ENABLED', '').lower() in ('1', 'true', 'yes')
+SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '0.1'))
+# 'file' (JSON lines, OTLP/JSON) or 'otlp' (OTLP/HTTP JSON to a collector)
+EXPORTER = os.getenv('TRACING_EXPORTER', 'file')
+TRACE_FILE = os.getenv('TRACING_FILE', '/tmp/fam_traces.jsonl')
+OTLP_ENDPOINT = os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318')
+SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'fam-orders-api')
+# Finished traces waiting for export; when the exporter falls behind, new ones are dropped
+QUEUE_SIZE = int(os.getenv('TRACING_QUEUE_SIZE', '1000'))
+STATEMENT_MAX_CHARS = 2000
+
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+STATUS_ERROR = 2
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """The spans of one sampled request, exported together when it ends."""
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, trace, parent_id, name, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+        trace.spans.append(self)
+
+    def end(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('fam_trace_span', default=None)
+
+
+class span:
+    """Context manager for a child span of the current one; does nothing outside a
+    traced request.
+
+        with tracing.span('billing.plan', plan_id=plan.id) as s:
+            ...
+            if s: s.attributes['orders'] = len(created)
+    """
+
+    def __init__(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        self.span = Span(parent.trace, parent.span_id, self.name, self.kind, self.attributes)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            self.span.end(exc)
+            _current_span.reset(self.token)
+        return False
+
+
+# --- crud functions ---
+
+def _result_attributes(result):
+    if isinstance(result, (list, tuple)):
+        return {'result.rows': len(result)}
+    if isinstance(result, dict) and isinstance(result.get('orders'), list):
+        return {'result.rows': len(result['orders'])}
+    return {}
+
+
+def _traced(function, name):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        parent = _current_span.get()
+        if parent is None:
+            return function(*args, **kwargs)
+        current = Span(parent.trace, parent.span_id, name)
+        token = _current_span.set(current)
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            current.end(e)
+            raise
+        finally:
+            _current_span.reset(token)
+        current.attributes.update(_result_attributes(result))
+        current.end()
+        return result
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def instrument_module(module) -> int:
+    """Wrap the module's public functions in spans named `<module>.<function>`.
+    Calls between them go through the module globals, so they nest."""
+    prefix = module.__name__.rsplit('.', 1)[-1]
+    count = 0
+    for name, value in list(vars(module).items()):
+        if (name.startswith('_') or not inspect.isfunction(value) or value.__module__ != module.__name__
+                or getattr(value, '__traced__', False)):
+            continue
+        setattr(module, name, _traced(value, f'{prefix}.{name}'))
+        count += 1
+    return count
+
+
+# --- SQL statements ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'SQL'
+    attributes = {
+        'db.system': conn.dialect.name,
+        'db.operation': operation,
+        'db.statement': statement[:STATEMENT_MAX_CHARS],
+        'db.executemany': bool(executemany),
+    }
+    table = TABLE_RE.search(statement)
+    if table:
+        attributes['db.sql.table'] = table.group(1)
+    name = f'{operation} {table.group(1)}' if table else operation
+    conn.info.setdefault('fam_trace_spans', []).append(Span(parent.trace, parent.span_id, name, SPAN_KIND_CLIENT,
+                                                            attributes))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('fam_trace_spans')
+    if not spans:
+        return
+    current = spans.pop()
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        current.attributes['db.rows_affected'] = cursor.rowcount
+    current.end()
+
+
+def _handle_error(context):
+    spans = context.connection.info.get('fam_trace_spans') if context.connection is not None else None
+    if spans:
+        spans.pop().end(context.original_exception)
+
+
+def instrument() -> None:
+    """Install the crud wrappers and the SQLAlchemy statement hooks."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from . import crud
+
+    instrument_module(crud)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+# --- Export ---
+
+def _value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _encode(span_):
+    encoded = {
+        'traceId': span_.trace.trace_id,
+        'spanId': span_.span_id,
+        'name': span_.name,
+        'kind': span_.kind,
+        'startTimeUnixNano': str(span_.start_ns),
+        'endTimeUnixNano': str(span_.end_ns or span_.start_ns),
+        'attributes': [{'key': k, 'value': _value(v)} for k, v in span_.attributes.items()],
+    }
+    if span_.parent_id:
+        encoded['parentSpanId'] = span_.parent_id
+    if span_.error:
+        encoded['status'] = {'code': STATUS_ERROR, 'message': span_.error}
+    return encoded
+
+
+def export_request(traces) -> dict:
+    """An OTLP ExportTraceServiceRequest (JSON encoding) for finished traces."""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [
+            {'key': 'service.name', 'value': _value(SERVICE_NAME)},
+            {'key': 'process.pid', 'value': _value(os.getpid())},
+        ]},
+        'scopeSpans': [{
+            'scope': {'name': __name__},
+            'spans': [_encode(s) for trace in traces for s in trace.spans],
+        }],
+    }]}
+
+
+class Exporter:
+    """Writes finished traces from a queue in a background thread, so requests only
+    pay for an enqueue. Started lazily per process (gunicorn workers fork)."""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        self.pid = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, trace) -> None:
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+                    self.thread = threading.Thread(target=self._run, name='fam-trace-export', daemon=True)
+                    self.thread.start()
+                    self.pid = os.getpid()
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + 1.0
+            while len(batch) < 100 and time.monotonic() < deadline:
+                try:
+                    trace = self.queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                if trace is None:
+                    self._write(batch)
+                    return
+                batch.append(trace)
+            self._write(batch)
+
+    def _write(self, batch):
+        payload = json.dumps(export_request(batch), separators=(',', ':'))
+        try:
+            if EXPORTER == 'otlp':
+                request = urllib.request.Request(
+                    OTLP_ENDPOINT.rstrip('/') + '/v1/traces', data=payload.encode(),
+                    headers={'Content-Type': 'application/json'}, method='POST',
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+            else:
+                with open(TRACE_FILE, 'a') as f:
+                    f.write(payload + '\n')
+        except Exception as e:
+            logger.warning('Dropped %d traces, export failed: %s', len(batch), e)
+
+    def shutdown(self, timeout: float = 5) -> None:
+        """Export what is queued (worker shutdown)."""
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+exporter = Exporter()
+
+
+# --- Requests ---
+
+def _sampled(scope):
+    """(trace_id, parent span id or None) when the request is to be traced, else None."""
+    for key, value in scope.get('headers', ()):
+        if key == b'traceparent':
+            match = TRACEPARENT_RE.match(value.decode('latin-1').strip().lower())
+            if match:
+                trace_id, parent_id, flags = match.groups()
+                return (trace_id, parent_id) if int(flags, 16) & 1 else None
+            break
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return f'{random.getrandbits(128):032x}', None
+    return None
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the request span of sampled requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        sampled = _sampled(scope)
+        if sampled is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_id = sampled
+        request_span = Span(Trace(trace_id), parent_id, scope['method'], SPAN_KIND_SERVER, {
+            'http.request.method': scope['method'],
+            'url.path': scope['path'],
+        })
+        token = _current_span.set(request_span)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                request_span.attributes['http.response.status_code'] = message['status']
+                message['headers'] = [*message.get('headers', []), (b'x-trace-id', trace_id.encode())]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get('route')
+            if route is not None:
+                request_span.attributes['http.route'] = route.path
+                request_span.name = f"{scope['method']} {route.path}"
+            request_span.end(error)
+            if error is None and request_span.attributes.get('http.response.status_code', 500) >= 500:
+                request_span.error = f"HTTP {request_span.attributes.get('http.response.status_code', 500)}"
+            exporter.submit(request_span.trace)
@@ -0,0 +1,35 @@
+"""
+Month-end billing: create the monthly payment orders for every active subscription plan.
+Safe to re-run; plans already billed for the month are skipped.
+
+Usage: python billing.py [--month 11 --year 2025]
+"""
+import argparse
+import sys
+from datetime import date
+
+sys.path.insert(0, '/app')
+
+from app import crud
+from app.db import SessionLocal
+
+
+def run(month: int, year: int):
+    db = SessionLocal()
+    try:
+        summary = crud.run_monthly_billing(db, month, year)
+    finally:
+        db.close()
+    print(f"Billing {month}/{year}: {summary['created']} payment orders created "
+          f"({summary['total_amount']} EUR), {summary['already_billed']} already billed, "
+          f"{len(summary['skipped_plan_ids'])} plans without deliveries or items")
+    return summary
+
+
+if __name__ == '__main__':
+    today = date.today()
+    parser = argparse.ArgumentParser(description='Create monthly payment orders for all active plans')
+    parser.add_argument('--month', type=int, default=today.month)
+    parser.add_argument('--year', type=int, default=today.year)
+    args = parser.parse_args()
+    run(args.month, args.year)
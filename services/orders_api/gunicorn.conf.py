@@ -0,0 +1,57 @@
+"""
+Production server: gunicorn managing uvicorn workers (app/server.py).
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+Settings come from the environment:
+
+  WEB_CONCURRENCY              workers (default: CPUs available to the container)
+  PORT                         default 8000
+  GUNICORN_PRELOAD             import the app once in the master (default true)
+  GUNICORN_MAX_REQUESTS        recycle a worker after this many requests (0 = never)
+  GUNICORN_MAX_REQUESTS_JITTER spread recycling so workers don't restart together
+  GUNICORN_GRACEFUL_TIMEOUT    seconds a stopping worker gets to finish its requests
+  GUNICORN_TIMEOUT             seconds of silence before a worker is killed
+"""
+import math
+import os
+
+
+def available_cpus() -> int:
+    """CPUs this process may use, honouring a cgroup v2 quota (docker --cpus)."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Sync endpoints hold the GIL while serializing, so one worker per core
+workers = int(os.getenv('WEB_CONCURRENCY') or available_cpus())
+worker_class = 'app.server.Worker'
+# Workers fork from a master that already imported the app: they start in a fraction of
+# a cold import and share its memory. The app opens no connections at import
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '500'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Connections must never be shared across processes: drop any pool inherited from
+    # the master so each worker opens its own
+    from app import db
+
+    db.reset_after_fork()
+
+
+def when_ready(server):
+    server.log.info(f'Serving with {workers} workers (preload={preload_app}, max_requests={max_requests})')
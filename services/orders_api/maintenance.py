@@ -0,0 +1,155 @@
+"""
+Table maintenance for the orders database.
+
+  partitions  create the upcoming monthly partitions of order_status_history and
+              drop empty ones older than the archive horizon (Postgres only)
+  archive     move delivered orders older than N days, with items and status
+              history, into the *_archive tables
+  idempotency delete expired idempotency keys
+  profitability  forget stored monthly margin rollups (all, or --since a date) so
+              they are recomputed, e.g. after correcting old orders or cost prices
+  forecast    fold the days closed since the last run into the demand forecast
+              (--refit starts over from FORECAST_HISTORY_DAYS of history)
+  outbox      deliver order events to OUTBOX_SINKS until stopped (--once: until
+              the outbox is drained); --purge-older-than-days deletes dispatched ones
+
+Run partitions monthly (e.g. from cron) and archive as often as suits:
+
+  python maintenance.py partitions --months-ahead 3
+  python maintenance.py archive --older-than-days 730
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, '/app')
+
+from app import crud, idempotency, partitions
+from app.db import SessionLocal, engine
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '730'))
+
+
+def run_partitions(months_ahead: int, keep_months: int):
+    with engine.begin() as conn:
+        if not partitions.is_postgres(conn):
+            print('[INFO] Partitioning is only used on Postgres; nothing to do')
+            return
+        if not partitions.is_partitioned(conn, 'order_status_history'):
+            print('[WARN] order_status_history is not partitioned yet; run `alembic upgrade head` first')
+            return
+        this_month = partitions.month_start(date.today())
+        created = partitions.ensure_monthly_partitions(
+            conn, 'order_status_history', this_month, partitions.add_months(this_month, months_ahead)
+        )
+        dropped = partitions.drop_empty_partitions(
+            conn, 'order_status_history', partitions.add_months(this_month, -keep_months)
+        )
+    print(f"[SUCCESS] Partitions created: {', '.join(created) or 'none'}; dropped: {', '.join(dropped) or 'none'}")
+
+
+def run_archive(older_than_days: int, batch_size: int, dry_run: bool):
+    before = date.today() - timedelta(days=older_than_days)
+    db = SessionLocal()
+    try:
+        summary = crud.archive_delivered_orders(db, before, batch_size=batch_size, dry_run=dry_run)
+    finally:
+        db.close()
+    verb = 'would be archived' if dry_run else f"archived in {summary['batches']} batches"
+    print(f"[SUCCESS] {summary['orders']} delivered orders before {before} {verb}")
+    return summary
+
+
+def run_purge_idempotency():
+    db = SessionLocal()
+    try:
+        deleted = idempotency.purge_expired(db)
+    finally:
+        db.close()
+    print(f"[SUCCESS] {deleted} expired idempotency keys deleted")
+
+
+def run_clear_profitability(since):
+    from app import profitability
+
+    db = SessionLocal()
+    try:
+        cleared = profitability.clear(db, since)
+    finally:
+        db.close()
+    print(f"[SUCCESS] {cleared} stored months cleared; they are recomputed on the next report")
+
+
+def run_forecast(refit: bool):
+    from app import forecast
+
+    db = SessionLocal()
+    try:
+        model = forecast.refresh(db, refit=refit)
+    finally:
+        db.close()
+    print(f"[SUCCESS] Forecast fitted through {model.fitted_through} for {len(model.product_ids)} products")
+
+
+def run_outbox(once: bool, batch_size: int, purge_older_than_days):
+    from app import outbox
+
+    if purge_older_than_days is not None:
+        db = SessionLocal()
+        try:
+            deleted = outbox.purge_dispatched(db, purge_older_than_days)
+        finally:
+            db.close()
+        print(f"[SUCCESS] {deleted} dispatched outbox events deleted")
+        return
+    sinks = outbox.configured_sinks()
+    if not sinks:
+        print('[WARN] OUTBOX_SINKS is empty; nothing to deliver to')
+        return
+    dispatcher = outbox.Dispatcher(SessionLocal, sinks, batch_size=batch_size)
+    if once:
+        totals = dispatcher.run_once()
+        print(f"[SUCCESS] Outbox: {totals['dispatched']} dispatched, {totals['retried']} to retry, "
+              f"{totals['failed']} failed")
+        return
+    print(f"[INFO] Dispatching order events to {', '.join(s.name for s in sinks)} (Ctrl+C to stop)")
+    try:
+        dispatcher.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('partitions', help='create upcoming and drop empty old partitions')
+    p.add_argument('--months-ahead', type=int, default=3)
+    p.add_argument('--keep-months', type=int, default=ARCHIVE_AFTER_DAYS // 30,
+                   help='never drop partitions newer than this many months')
+    a = commands.add_parser('archive', help='move old delivered orders to the archive tables')
+    a.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    a.add_argument('--batch-size', type=int, default=500)
+    a.add_argument('--dry-run', action='store_true')
+    commands.add_parser('idempotency', help='delete expired idempotency keys')
+    m = commands.add_parser('profitability', help='clear stored monthly margin rollups')
+    m.add_argument('--since', type=date.fromisoformat, help='only months from this date on')
+    f = commands.add_parser('forecast', help='update the demand forecast parameters')
+    f.add_argument('--refit', action='store_true')
+    o = commands.add_parser('outbox', help='deliver order events to the configured sinks')
+    o.add_argument('--once', action='store_true', help='exit once the outbox is drained')
+    o.add_argument('--batch-size', type=int, default=int(os.getenv('OUTBOX_BATCH_SIZE', '100')))
+    o.add_argument('--purge-older-than-days', type=int, help='delete events dispatched before then, and exit')
+    args = parser.parse_args()
+    if args.command == 'partitions':
+        run_partitions(args.months_ahead, args.keep_months)
+    elif args.command == 'archive':
+        run_archive(args.older_than_days, args.batch_size, args.dry_run)
+    elif args.command == 'profitability':
+        run_clear_profitability(args.since)
+    elif args.command == 'forecast':
+        run_forecast(args.refit)
+    elif args.command == 'outbox':
+        run_outbox(args.once, args.batch_size, args.purge_older_than_days)
+    else:
+        run_purge_idempotency()
@@ -0,0 +1,248 @@
+"""
+Benchmark harness for the Orders API.
+
+Runs each scenario against a live server with a pool of keep-alive connections and
+reports throughput and p50/p95/p99 latency. Results are written as JSON so runs can
+be compared, e.g. before and after a change:
+
+    python -m perf.datagen --reset --end-date 2025-10-01
+    python -m perf.bench --output before.json
+    python -m perf.bench --output after.json --compare before.json
+"""
+import argparse
+import http.client
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+class Client:
+    """Minimal HTTP client keeping one persistent connection per thread."""
+
+    def __init__(self, base_url, token=None, timeout=60):
+        parsed = urllib.parse.urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self.https = parsed.scheme == 'https'
+        self.prefix = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """Return (status, response bytes); reconnects once on a dropped keep-alive."""
+        payload = json.dumps(body).encode() if body is not None else None
+        all_headers = {**self.headers, **(headers or {})}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, self.prefix + path, body=payload, headers=all_headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def json(self, method, path, body=None):
+        status, data = self.request(method, path, body)
+        if status >= 400:
+            raise RuntimeError(f'{method} {path} -> {status}: {data[:200]!r}')
+        return json.loads(data)
+
+
+def login(base_url, username, password):
+    parsed = urllib.parse.urlparse(base_url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+    body = urllib.parse.urlencode({'username': username, 'password': password})
+    conn.request('POST', parsed.path.rstrip('/') + '/auth/login', body=body,
+                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    data = response.read()
+    if response.status != 200:
+        raise RuntimeError(f'Login failed: {response.status} {data[:200]!r}')
+    return json.loads(data)['access_token']
+
+
+class Fixtures:
+    """Ids sampled once from the server so scenarios exercise realistic rows."""
+
+    def __init__(self, client, rng):
+        self.customers = [c['id'] for c in client.json('GET', '/customers')]
+        self.products = [(p['id'], p['unit_price']) for p in client.json('GET', '/products?active=true')]
+        orders = client.json('GET', '/orders')
+        self.orders = [o['id'] for o in orders if not o.get('is_monthly_payment') and not o.get('recurring_plan_id')]
+        dates = sorted({o['delivery_date'] for o in orders if o.get('delivery_date')})
+        self.delivery_dates = dates[-60:] or [datetime.now().date().isoformat()]
+        if not self.customers or not self.products or not self.orders:
+            raise SystemExit('Not enough data to benchmark; run `python -m perf.datagen` first.')
+        self.rng = rng
+
+
+def scenario_requests(fixtures):
+    """Scenario name -> callable producing (method, path, body) for one request."""
+    rng = fixtures.rng
+
+    def create_order():
+        items = []
+        for product_id, unit_price in rng.sample(fixtures.products, min(3, len(fixtures.products))):
+            items.append({'product_id': product_id, 'quantity': rng.randint(1, 6), 'unit_price': unit_price})
+        return 'POST', '/orders', {
+            'customer_id': rng.choice(fixtures.customers),
+            'delivery_date': rng.choice(fixtures.delivery_dates),
+            'notes': 'bench',
+            'items': items,
+        }
+
+    return {
+        'list_orders': lambda: ('GET', '/orders', None),
+        'dashboard': lambda: ('GET', '/analytics/dashboard?days=30', None),
+        'dashboard_year': lambda: ('GET', '/analytics/dashboard?days=365', None),
+        'production_needs': lambda: ('GET', f'/analytics/production-needs?date={rng.choice(fixtures.delivery_dates)}', None),
+        'status_patch': lambda: ('PATCH', f'/orders/{rng.choice(fixtures.orders)}/status',
+                                 {'status': rng.choice(['encomendado', 'preparing'])}),
+        'create_order': create_order,
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(client, make_request, requests, concurrency, warmup):
+    for _ in range(warmup):
+        client.request(*make_request())
+
+    latencies = []
+    errors = 0
+    bytes_received = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors, bytes_received
+        method, path, body = make_request()
+        start = time.perf_counter()
+        try:
+            status, data = client.request(method, path, body)
+            failed = status >= 400
+        except Exception:
+            status, data, failed = 0, b'', True
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            bytes_received += len(data)
+            if failed:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(requests / wall, 2) if wall else None,
+        'mean_ms': ms(statistics.fmean(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+        'avg_response_bytes': round(bytes_received / requests) if requests else 0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f'\nCompared with {baseline_path}:')
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        parts = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if before.get(key) and current.get(key) is not None:
+                change = (current[key] - before[key]) / before[key] * 100
+                parts.append(f'{key} {change:+.1f}%')
+        print(f'  {name:<18} ' + '  '.join(parts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--scenarios', default='list_orders,dashboard,production_needs,status_patch,create_order',
+                        help='comma-separated scenario names')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--username', help='log in first and send the bearer token')
+    parser.add_argument('--password')
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--compare', help='previous results JSON to diff against')
+    args = parser.parse_args(argv)
+
+    token = login(args.base_url, args.username, args.password) if args.username else None
+    client = Client(args.base_url, token)
+    fixtures = Fixtures(client, random.Random(args.seed))
+    available = scenario_requests(fixtures)
+
+    results = {}
+    for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        if name not in available:
+            raise SystemExit(f'Unknown scenario {name!r}; choose from {", ".join(available)}')
+        results[name] = run_scenario(client, available[name], args.requests, args.concurrency, args.warmup)
+        r = results[name]
+        print(f"{name:<18} {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']}ms  p95 {r['p95_ms']}ms  "
+              f"p99 {r['p99_ms']}ms  errors {r['errors']}")
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'base_url': args.base_url,
+        'settings': {'requests': args.requests, 'concurrency': args.concurrency, 'seed': args.seed},
+        'scenarios': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Cold-start time of one API worker.
+
+Starts `uvicorn app.main:app` with a single worker, repeatedly, and measures from
+process start until /health/live answers (the worker is serving), until
+/health/ready answers (database reachable and migrated), and the latency of the first
+and second real request. The database URL is taken from the environment as usual.
+
+    python -m perf.coldstart --runs 5
+    python -m perf.coldstart --runs 5 --imports      # also the slowest imports
+    DATABASE_URL=postgresql+psycopg2://nobody@10.255.255.1/x python -m perf.coldstart
+        # boot with an unreachable database: live should still come up
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get(port, path, timeout=10):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def wait_for(port, path, started, deadline, want=200):
+    """Seconds since `started` until `path` returns `want`; None on timeout."""
+    while time.perf_counter() < deadline:
+        try:
+            if get(port, path, timeout=2) == want:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def timed_get(port, path):
+    started = time.perf_counter()
+    status = get(port, path, timeout=60)
+    return time.perf_counter() - started, status
+
+
+def one_run(path, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', '1', '--log-level', 'warning'],
+        cwd=SERVICE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    result = {}
+    try:
+        deadline = started + timeout
+        result['live'] = wait_for(port, '/health/live', started, deadline)
+        result['ready'] = wait_for(port, '/health/ready', started, deadline) if result['live'] else None
+        if result['ready']:
+            result['first_request'], result['first_status'] = timed_get(port, path)
+            result['second_request'], _ = timed_get(port, path)
+        return result
+    finally:
+        process.terminate()
+        try:
+            _, stderr = process.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            _, stderr = process.communicate()
+        if not result.get('live'):
+            print(stderr[-2000:], file=sys.stderr)
+
+
+def slowest_imports(top):
+    """Cumulative import time of the slowest modules when importing app.main."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app.main'],
+                               cwd=SERVICE_DIR, capture_output=True, text=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative) / 1e6, name))
+    total = next((seconds for seconds, name in rows if name == 'app.main'), None)
+    return total, sorted(rows, reverse=True)[:top]
+
+
+def summarize(runs, key):
+    values = [r[key] for r in runs if r.get(key) is not None]
+    if not values:
+        return None
+    return {'median': statistics.median(values), 'max': max(values), 'n': len(values)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/orders?fields=id,status&status=pago',
+                        help='request timed after the worker is ready')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a worker')
+    parser.add_argument('--imports', action='store_true', help='also list the slowest imports')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    runs = []
+    for i in range(args.runs):
+        run = one_run(args.path, args.timeout)
+        runs.append(run)
+        print(f'run {i + 1}: ' + ', '.join(
+            f'{key} {value * 1000:.0f}ms' if isinstance(value, float) else f'{key} {value}'
+            for key, value in run.items()
+        ))
+
+    summary = {key: summarize(runs, key) for key in ('live', 'ready', 'first_request', 'second_request')}
+    print()
+    for key, stats in summary.items():
+        if stats is None:
+            print(f'{key:>15}: n/a')
+        else:
+            print(f"{key:>15}: median {stats['median'] * 1000:.0f}ms, max {stats['max'] * 1000:.0f}ms ({stats['n']} runs)")
+
+    if args.imports:
+        total, rows = slowest_imports(15)
+        print(f'\nimport app.main: {total * 1000:.0f}ms cumulative' if total else '\nimport app.main failed')
+        for seconds, name in rows:
+            print(f'  {seconds * 1000:8.1f}ms  {name}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs': runs, 'summary': summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Synthetic bakery dataset generator for performance work.
+
+Produces customers, products, years of orders with items and status history, and
+subscription plans with their monthly payment and weekly delivery orders. Output is
+deterministic for a given --seed and --end-date so benchmark runs are comparable.
+
+Example:
+    python -m perf.datagen --customers 5000 --products 300 --years 3 --reset
+"""
+import argparse
+import random
+import sys
+import time
+from calendar import monthrange
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from decimal import Decimal
+
+sys.path.insert(0, '/app')
+
+from sqlalchemy import text
+
+from app import history, migrations, models
+from app.db import Base, engine
+
+FIRST_NAMES = [
+    'Ana', 'Beatriz', 'Carla', 'Diana', 'Eva', 'Filipa', 'Gabriela', 'Helena', 'Inês', 'Joana',
+    'Leonor', 'Mariana', 'Nuno', 'Pedro', 'Rui', 'Tiago', 'João', 'Miguel', 'André', 'Bruno',
+    'Carlos', 'Duarte', 'Francisco', 'Gonçalo', 'Henrique', 'Luís', 'Manuel', 'Ricardo', 'Sofia', 'Vasco',
+]
+LAST_NAMES = [
+    'Silva', 'Santos', 'Ferreira', 'Pereira', 'Oliveira', 'Costa', 'Rodrigues', 'Martins', 'Jesus', 'Sousa',
+    'Fernandes', 'Gonçalves', 'Gomes', 'Lopes', 'Marques', 'Alves', 'Almeida', 'Ribeiro', 'Pinto', 'Carvalho',
+]
+PICKUP_LOCATIONS = [
+    'Loja Centro', 'Loja Campo de Ourique', 'Mercado de Arroios', 'Escritório Parque das Nações',
+    'Café da Graça', 'Ginásio Alvalade', 'Entrega ao domicílio', None,
+]
+PRODUCT_FAMILIES = [
+    ('Pão de Fermentação Natural', 3.5, 6.5), ('Baguete', 1.2, 2.5), ('Broa', 2.0, 4.0),
+    ('Croissant', 1.1, 2.2), ('Pastel de Nata', 1.0, 1.6), ('Bolo', 12.0, 28.0),
+    ('Focaccia', 3.0, 6.0), ('Brioche', 2.5, 5.5), ('Bolacha', 0.8, 2.0), ('Tarte', 14.0, 30.0),
+]
+VARIANTS = [
+    'Clássico', 'Integral', 'Centeio', 'Espelta', 'Sementes', 'Azeitona', 'Nozes', 'Chocolate',
+    'Amêndoa', 'Laranja', 'Canela', 'Mel', 'Alecrim', 'Figo', 'Limão', 'Avelã',
+]
+STATUS_FLOW = [
+    models.OrderStatus.encomendado, models.OrderStatus.pago,
+    models.OrderStatus.preparing, models.OrderStatus.delivered,
+]
+# Relative order volume per weekday (0=Monday); weekends are busier
+WEEKDAY_WEIGHT = [0.8, 0.9, 0.9, 1.0, 1.3, 1.6, 1.2]
+
+
+class IdSequence:
+    """Hands out explicit primary keys so rows can reference each other before insert."""
+
+    def __init__(self, conn, table):
+        current = conn.execute(text(f'SELECT MAX(id) FROM {table}')).scalar()
+        self.next_id = (current or 0) + 1
+
+    def __call__(self):
+        value = self.next_id
+        self.next_id += 1
+        return value
+
+
+class Writer:
+    """Buffers rows per table and flushes them with executemany inserts."""
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+        # Parents are flushed before children to satisfy foreign keys
+        self.order = [
+            models.Customer.__table__, models.Product.__table__, models.RecurringPlan.__table__,
+            models.RecurringPlanItem.__table__, models.Order.__table__, models.OrderItem.__table__,
+            models.OrderStatusHistory.__table__,
+        ]
+
+    def add(self, table, row):
+        buf = self.buffers.setdefault(table, [])
+        buf.append(row)
+        if len(buf) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for table in self.order:
+            rows = self.buffers.get(table)
+            if rows:
+                self.conn.execute(table.insert(), rows)
+                self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+                self.buffers[table] = []
+
+
+def weighted_index(rng, cumulative):
+    """Pick an index from a cumulative weight list."""
+    x = rng.random() * cumulative[-1]
+    lo, hi = 0, len(cumulative) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if cumulative[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def zipf_cumulative(n, s=1.1):
+    total = 0.0
+    out = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** s
+        out.append(total)
+    return out
+
+
+def at(day, rng, start_hour=7, end_hour=21):
+    seconds = rng.randint(start_hour * 3600, end_hour * 3600)
+    return datetime.combine(day, dtime(0, 0), tzinfo=timezone.utc) + timedelta(seconds=seconds)
+
+
+def add_status_history(writer, next_history_id, order_id, final_status, created_at, rng):
+    changed_at = created_at
+    for status in STATUS_FLOW:
+        writer.add(models.OrderStatusHistory.__table__, {
+            'id': next_history_id(), 'order_id': order_id, 'status': status, 'changed_at': changed_at,
+        })
+        if status == final_status:
+            break
+        changed_at += timedelta(hours=rng.uniform(1, 36))
+
+
+def final_status_for(delivery_date, end_date, rng):
+    if delivery_date < end_date - timedelta(days=2):
+        return models.OrderStatus.delivered if rng.random() < 0.97 else models.OrderStatus.pago
+    if delivery_date <= end_date:
+        return rng.choice(STATUS_FLOW[1:])
+    return rng.choice(STATUS_FLOW[:2])
+
+
+def reset(conn):
+    for table in reversed(Base.metadata.sorted_tables):
+        if table.name in ('users', 'settings'):
+            continue
+        conn.execute(table.delete())
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    end_date = args.end_date
+    start_date = end_date - timedelta(days=int(365 * args.years))
+    started = time.perf_counter()
+
+    migrations.upgrade()
+    with engine.begin() as conn:
+        if args.reset:
+            reset(conn)
+        # The backdated timelines below replace what the status trigger would record
+        history.drop_triggers(conn)
+
+        writer = Writer(conn, args.batch_size)
+        ids = {name: IdSequence(conn, name) for name in (
+            'customers', 'products', 'orders', 'order_items', 'order_status_history',
+            'recurring_plans', 'recurring_plan_items',
+        )}
+
+        # Products, with Zipf popularity so a few items dominate like in a real shop
+        products = []
+        for i in range(args.products):
+            family, low, high = PRODUCT_FAMILIES[i % len(PRODUCT_FAMILIES)]
+            variant = VARIANTS[(i // len(PRODUCT_FAMILIES)) % len(VARIANTS)]
+            edition = i // (len(PRODUCT_FAMILIES) * len(VARIANTS))
+            unit_price = Decimal(str(round(rng.uniform(low, high), 2)))
+            product = {
+                'id': ids['products'](),
+                'sku': f'GEN-{args.seed}-{i:05d}',
+                'name': f'{family} {variant}' + (f' {edition + 1}' if edition else ''),
+                'description': f'{family} ({variant.lower()})',
+                'unit_price': unit_price,
+                'cost_price': (unit_price * Decimal(str(round(rng.uniform(0.3, 0.55), 2)))).quantize(Decimal('0.01')),
+                'active': rng.random() > 0.05,
+                'batch_size': rng.choice([None, None, 6, 12, 24]),
+                'created_at': at(start_date, rng),
+            }
+            writer.add(models.Product.__table__, product)
+            products.append(product)
+        rng.shuffle(products)
+        product_weights = zipf_cumulative(len(products))
+
+        # Customers, also Zipf-weighted so regulars order far more often
+        customers = []
+        for i in range(args.customers):
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            customer = {
+                'id': ids['customers'](),
+                'name': name,
+                'email': f'cliente{i}.{args.seed}@example.com',
+                'phone': f'9{rng.randint(10000000, 99999999)}',
+                'address': f'Rua {rng.choice(LAST_NAMES)} {rng.randint(1, 300)}, Lisboa',
+                'pickup_location': rng.choice(PICKUP_LOCATIONS),
+                'is_subscription': rng.random() < args.subscribers,
+                'created_at': at(start_date + timedelta(days=rng.randint(0, 60)), rng),
+            }
+            writer.add(models.Customer.__table__, customer)
+            customers.append(customer)
+        customer_weights = zipf_cumulative(len(customers), s=0.8)
+
+        # One-off and walk-in orders with weekly seasonality and mild growth
+        total_days = (end_date - start_date).days
+        for offset in range(total_days + 1):
+            day = start_date + timedelta(days=offset)
+            growth = 0.6 + 0.8 * offset / max(total_days, 1)
+            expected = args.orders_per_day * WEEKDAY_WEIGHT[day.weekday()] * growth
+            for _ in range(max(0, int(rng.gauss(expected, expected ** 0.5)))):
+                customer = customers[weighted_index(rng, customer_weights)]
+                created_at = at(day, rng)
+                delivery_date = day + timedelta(days=rng.choice([0, 1, 1, 2, 3, 5, 7]))
+                order_id = ids['orders']()
+                total = Decimal('0')
+                chosen = set()
+                for _ in range(rng.choice([1, 1, 2, 2, 3, 4, 5])):
+                    product = products[weighted_index(rng, product_weights)]
+                    if product['id'] in chosen:
+                        continue
+                    chosen.add(product['id'])
+                    quantity = rng.choice([1, 1, 2, 2, 3, 4, 6, 12])
+                    writer.add(models.OrderItem.__table__, {
+                        'id': ids['order_items'](), 'order_id': order_id, 'product_id': product['id'],
+                        'quantity': quantity, 'unit_price': product['unit_price'], 'created_at': created_at,
+                    })
+                    total += product['unit_price'] * quantity
+                status = final_status_for(delivery_date, end_date, rng)
+                writer.add(models.Order.__table__, {
+                    'id': order_id, 'customer_id': customer['id'], 'delivery_date': delivery_date,
+                    'status': status, 'total': total, 'notes': rng.choice([None, None, None, 'Sem glúten', 'Fatiado', 'Embrulhar para oferta']),
+                    'is_auto_generated': False, 'is_monthly_payment': False, 'created_at': created_at,
+                })
+                add_status_history(writer, ids['order_status_history'], order_id, status, created_at, rng)
+
+        # Subscription plans with a monthly payment order and weekly deliveries
+        for customer in customers:
+            if not customer['is_subscription']:
+                continue
+            plan_start = start_date + timedelta(days=rng.randint(0, max(total_days - 30, 0)))
+            plan = {
+                'id': ids['recurring_plans'](), 'customer_id': customer['id'], 'day_of_week': rng.randint(0, 5),
+                'start_date': plan_start, 'end_date': None, 'active': True, 'prepaid_month': True,
+                'created_at': at(plan_start, rng),
+            }
+            writer.add(models.RecurringPlan.__table__, plan)
+            plan_items = []
+            for product in rng.sample(products[:50], min(len(products), rng.randint(1, 3))):
+                item = {'id': ids['recurring_plan_items'](), 'plan_id': plan['id'], 'product_id': product['id'],
+                        'quantity': rng.randint(1, 4)}
+                writer.add(models.RecurringPlanItem.__table__, item)
+                plan_items.append((item, product))
+
+            year, month = plan_start.year, plan_start.month
+            while date(year, month, 1) <= end_date:
+                last_day = date(year, month, monthrange(year, month)[1])
+                dates = [d for d in (date(year, month, 1) + timedelta(days=n) for n in range(last_day.day))
+                         if d.weekday() == plan['day_of_week'] and plan_start <= d <= end_date]
+                if dates:
+                    weeks = len(dates)
+                    for index, delivery_date in enumerate(dates):
+                        is_payment = index == 0
+                        created_at = at(delivery_date - timedelta(days=7 if is_payment else 0), rng)
+                        order_id = ids['orders']()
+                        total = Decimal('0')
+                        for item, product in plan_items:
+                            quantity = item['quantity'] * (weeks if is_payment else 1)
+                            writer.add(models.OrderItem.__table__, {
+                                'id': ids['order_items'](), 'order_id': order_id, 'product_id': product['id'],
+                                'quantity': quantity, 'unit_price': product['unit_price'], 'created_at': created_at,
+                            })
+                            total += product['unit_price'] * quantity
+                        status = final_status_for(delivery_date, end_date, rng)
+                        writer.add(models.Order.__table__, {
+                            'id': order_id, 'customer_id': customer['id'], 'delivery_date': delivery_date,
+                            'status': status, 'total': total if is_payment else 0,
+                            'notes': f'Pagamento Mensal - {month}/{year} ({weeks} entregas)' if is_payment
+                            else 'Entrega semanal - Pagamento coberto pelo plano mensal',
+                            'recurring_plan_id': plan['id'], 'is_auto_generated': not is_payment,
+                            'is_monthly_payment': is_payment, 'created_at': created_at,
+                        })
+                        add_status_history(writer, ids['order_status_history'], order_id, status, created_at, rng)
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        writer.flush()
+
+        conn.execute(text(
+            """
+            UPDATE customers SET last_order_at = (
+                SELECT MAX(orders.created_at) FROM orders WHERE orders.customer_id = customers.id
+            )
+            """
+        ))
+        history.install_triggers(conn)
+        if conn.dialect.name == 'postgresql':
+            for table in ids:
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"
+                ))
+
+    elapsed = time.perf_counter() - started
+    for table, count in writer.counts.items():
+        print(f'{table:>24}: {count}')
+    print(f'Generated {start_date} .. {end_date} in {elapsed:.1f}s')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=3000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--orders-per-day', type=float, default=40, help='average one-off orders per day')
+    parser.add_argument('--subscribers', type=float, default=0.08, help='fraction of customers on a subscription')
+    parser.add_argument('--end-date', type=date.fromisoformat, default=date.today(),
+                        help='last day of generated history (fix it for reproducible datasets)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--reset', action='store_true', help='delete existing business data first (keeps users and settings)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    generate(parse_args())
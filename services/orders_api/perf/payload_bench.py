@@ -0,0 +1,97 @@
+"""
+Payload size and response time of the orders view: separate calls vs /orders/bootstrap.
+
+Each variant is the set of requests the orders page makes for one load, sent in
+parallel as the browser does. For every variant prints the total response bytes, the
+median and max wall time of the whole load, and the median time of its slowest call:
+
+    full_lists      GET /orders + /customers + /products (every order embeds its
+                    customer and every item its product)
+    search_page     GET /orders/search page + urgent count + /customers + /products
+    bootstrap       GET /orders/bootstrap page, referenced customers/products only
+    bootstrap_all   GET /orders/bootstrap page with catalog=true (first load)
+
+    python -m perf.payload_bench --runs 10 --limit 50
+    python -m perf.payload_bench --variants search_page,bootstrap,bootstrap_all
+        # skip full_lists on large databases, it serializes every order
+"""
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from perf.bench import Client, login
+
+
+def variants(limit):
+    page = f'sort=delivery_date&skip=0&limit={limit}'
+    return {
+        'full_lists': ['/orders', '/customers', '/products'],
+        'search_page': [f'/orders/search?{page}', '/orders/search?urgent_hours=24&limit=0',
+                        '/customers', '/products'],
+        'bootstrap': [f'/orders/bootstrap?{page}'],
+        'bootstrap_all': [f'/orders/bootstrap?{page}&catalog=true'],
+    }
+
+
+def timed(client, path):
+    started = time.perf_counter()
+    status, data = client.request('GET', path)
+    if status >= 400:
+        raise RuntimeError(f'GET {path} -> {status}: {data[:200]!r}')
+    return time.perf_counter() - started, len(data)
+
+
+def load_once(client, pool, paths):
+    """(wall seconds, slowest call seconds, total bytes) for one parallel load."""
+    started = time.perf_counter()
+    results = list(pool.map(lambda path: timed(client, path), paths))
+    wall = time.perf_counter() - started
+    return wall, max(seconds for seconds, _ in results), sum(size for _, size in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--variants', default='full_lists,search_page,bootstrap,bootstrap_all')
+    parser.add_argument('--runs', type=int, default=10, help='loads per variant')
+    parser.add_argument('--limit', type=int, default=50, help='orders per page')
+    parser.add_argument('--username', help='log in first and send the bearer token')
+    parser.add_argument('--password')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    token = login(args.base_url, args.username, args.password) if args.username else None
+    client = Client(args.base_url, token, timeout=300)
+    available = variants(args.limit)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for name in [v.strip() for v in args.variants.split(',') if v.strip()]:
+            if name not in available:
+                raise SystemExit(f'Unknown variant {name!r}; choose from {", ".join(available)}')
+            paths = available[name]
+            load_once(client, pool, paths)  # warm-up
+            loads = [load_once(client, pool, paths) for _ in range(args.runs)]
+            walls = [wall for wall, _, _ in loads]
+            results[name] = {
+                'requests': len(paths),
+                'bytes': loads[-1][2],
+                'median_ms': round(statistics.median(walls) * 1000, 1),
+                'max_ms': round(max(walls) * 1000, 1),
+                'slowest_call_ms': round(statistics.median(slowest for _, slowest, _ in loads) * 1000, 1),
+            }
+
+    print(f"{'variant':<14} {'requests':>8} {'bytes':>12} {'median ms':>10} {'max ms':>9} {'slowest call':>13}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['requests']:>8} {r['bytes']:>12,} {r['median_ms']:>10} {r['max_ms']:>9} "
+              f"{r['slowest_call_ms']:>13}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Stress test for subscription order generation under concurrent requests.
+
+Creates a throwaway subscription customer with a weekly plan, then for each month
+fires concurrent requests at the same plan and month: monthly payment creation and
+billing runs, then PATCH /orders/{id}/status to `pago` on the payment order and on
+other orders of the same subscriber (each paid order generates the month's weekly
+orders) alongside explicit generate-orders calls. Afterwards the plan must have
+exactly one payment order and exactly one generated order per delivery date; the
+script exits non-zero otherwise.
+
+    python -m perf.stress_subscriptions --base-url http://localhost:8000 --concurrency 16
+
+Run it against Postgres with several workers; the billing runs also bill every other
+active plan in the database for the months used.
+"""
+import argparse
+import sys
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from perf.bench import Client, login
+
+
+def create_subscriber(client, start):
+    customer = client.json('POST', '/customers', {
+        'name': f'Stress {uuid.uuid4().hex[:8]}', 'is_subscription': True,
+    })
+    product = client.json('POST', '/products', {
+        'sku': f'STRESS-{uuid.uuid4().hex[:8]}', 'name': 'Stress loaf', 'unit_price': 3.0,
+    })
+    plan = client.json('POST', '/recurring/plans', {
+        'customer_id': customer['id'], 'day_of_week': 1, 'start_date': start.isoformat(),
+        'items': [{'product_id': product['id'], 'quantity': 2}],
+    })
+    return customer, product, plan
+
+
+def fire(client, requests, concurrency):
+    """Send all (method, path, body) requests at once; returns the status codes."""
+    barrier = threading.Barrier(min(concurrency, len(requests)))
+
+    def one(request):
+        try:
+            barrier.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+        return client.request(*request)[0]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, requests))
+
+
+def expected_dates(plan, month, year):
+    first = date(year, month, 1)
+    day = first.toordinal() + (plan['day_of_week'] - first.weekday()) % 7
+    dates = []
+    while date.fromordinal(day).month == month:
+        dates.append(date.fromordinal(day).isoformat())
+        day += 7
+    return dates
+
+
+def check_month(client, customer, plan, month, year):
+    orders = client.json(
+        'GET', f"/orders?customer_id={customer['id']}"
+               '&fields=id,delivery_date,recurring_plan_id,is_auto_generated,is_monthly_payment'
+    )
+    in_month = [o for o in orders if o['delivery_date'] and o['delivery_date'].startswith(f'{year}-{month:02d}')]
+    payments = [o for o in in_month if o['is_monthly_payment']]
+    generated = Counter(o['delivery_date'] for o in in_month if o['is_auto_generated'])
+    dates = expected_dates(plan, month, year)
+    problems = []
+    if len(payments) != 1:
+        problems.append(f'{len(payments)} payment orders')
+    duplicates = {d: n for d, n in generated.items() if n > 1}
+    if duplicates:
+        problems.append(f'duplicate generated orders {duplicates}')
+    if sorted(generated) != dates[1:]:
+        problems.append(f'generated dates {sorted(generated)} != {dates[1:]}')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--months', type=int, default=3, help='rounds, one month each')
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2031, 1, 1),
+                        help='first month (far future by default, away from real data)')
+    parser.add_argument('--username', help='log in first and send the bearer token')
+    parser.add_argument('--password')
+    args = parser.parse_args(argv)
+
+    token = login(args.base_url, args.username, args.password) if args.username else None
+    client = Client(args.base_url, token)
+    customer, product, plan = create_subscriber(client, args.start.replace(day=1))
+    print(f"Plan {plan['id']} for customer {customer['id']}, {args.concurrency} concurrent requests per step")
+
+    failures = 0
+    for offset in range(args.months):
+        index = args.start.year * 12 + args.start.month - 1 + offset
+        year, month = divmod(index, 12)
+        month += 1
+        period = f'month={month}&year={year}'
+        base = f"/recurring/plans/{plan['id']}"
+
+        payment_requests = [('POST', f'{base}/create-monthly-payment?{period}')] * (args.concurrency // 2)
+        payment_requests += [('POST', f'/recurring/billing-run?{period}')] * (args.concurrency - len(payment_requests))
+        codes = fire(client, payment_requests, args.concurrency)
+        payment = client.json('POST', f'{base}/create-monthly-payment?{period}')
+
+        # Distinct orders of the same subscriber, so optimistic locking doesn't reject any
+        extra_orders = [
+            client.json('POST', '/orders', {
+                'customer_id': customer['id'], 'delivery_date': payment['delivery_date'],
+                'items': [{'product_id': product['id'], 'quantity': 1, 'unit_price': product['unit_price']}],
+            })
+            for _ in range(args.concurrency // 2 - 1)
+        ]
+        generate_requests = [('PATCH', f"/orders/{order['id']}/status", {'status': 'pago'})
+                             for order in [payment, *extra_orders]]
+        generate_requests += [('POST', f'{base}/generate-orders?{period}')] * (args.concurrency - len(generate_requests))
+        codes += fire(client, generate_requests, args.concurrency)
+
+        problems = check_month(client, customer, plan, month, year)
+        errors = Counter(code for code in codes if code >= 400)
+        if errors:
+            problems.append(f'error responses {dict(errors)}')
+        status = 'OK' if not problems else 'FAIL: ' + '; '.join(problems)
+        print(f'{year}-{month:02d}: {len(codes)} requests, {status}')
+        failures += bool(problems)
+
+    if failures:
+        sys.exit(f'{failures} of {args.months} months produced duplicate or missing orders')
+    print('Exactly one set of orders per month')
+
+
+if __name__ == '__main__':
+    main()
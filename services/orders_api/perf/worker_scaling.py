@@ -0,0 +1,151 @@
+"""
+Throughput of the production server by worker count.
+
+For each worker count, starts `gunicorn -c gunicorn.conf.py app.main:app` on a free
+port, waits for /health/ready, runs the perf.bench scenarios against it and stops it
+with SIGTERM. Prints requests/s per scenario and the speedup over the smallest worker
+count. Scaling flattens once workers exceed the cores available to the server (and
+the database's), so run it on the target host size:
+
+    python -m perf.worker_scaling --workers 1,2,4,8 --scenarios dashboard,production_needs
+
+--drain also checks graceful shutdown: it sends SIGTERM while requests are in flight
+and reports how many of them still completed. Requests a worker had accepted finish;
+connections still queued in the listen backlog are reset, which is why the load
+balancer should stop routing to an instance (readiness) before it is sent SIGTERM.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from perf.bench import Client, Fixtures, login, run_scenario, scenario_requests
+from perf.coldstart import SERVICE_DIR, free_port, wait_for
+
+
+def start_server(workers, port, timeout):
+    env = {**os.environ, 'WEB_CONCURRENCY': str(workers), 'PORT': str(port)}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null',
+         'app.main:app'],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    started = time.perf_counter()
+    if wait_for(port, '/health/ready', started, started + timeout) is None:
+        stop_server(process)
+        raise SystemExit(f'Server with {workers} workers did not become ready:\n{process.stderr.read()[-2000:]}')
+    return process
+
+
+def stop_server(process, timeout=60):
+    """SIGTERM and wait; returns seconds until the master exited."""
+    started = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    return time.perf_counter() - started
+
+
+def drain_check(client, make_request, process, in_flight):
+    """Send `in_flight` requests, SIGTERM the server once all of them are on the wire,
+    then count how many still get a successful response."""
+    sent = threading.Barrier(in_flight + 1)
+
+    def one(_):
+        method, path, body = make_request()
+        conn = http.client.HTTPConnection(client.host, client.port, timeout=120)
+        try:
+            conn.request(method, client.prefix + path, body=json.dumps(body).encode() if body else None,
+                         headers=client.headers)
+            sent.wait()
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except Exception:
+            return 0
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=in_flight) as pool:
+        futures = [pool.submit(one, i) for i in range(in_flight)]
+        sent.wait()
+        shutdown_seconds = stop_server(process)
+        statuses = [future.result() for future in futures]
+    return {
+        'in_flight': in_flight,
+        'completed': sum(1 for s in statuses if 200 <= s < 400),
+        'failed': sum(1 for s in statuses if not 200 <= s < 400),
+        'shutdown_seconds': round(shutdown_seconds, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--scenarios', default='dashboard,production_needs,status_patch')
+    parser.add_argument('--requests', type=int, default=400, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--drain', action='store_true', help='also check graceful shutdown')
+    parser.add_argument('--drain-scenario', default='dashboard_year',
+                        help='requests in flight during the drain check (should finish within the graceful timeout)')
+    parser.add_argument('--username', help='log in first and send the bearer token')
+    parser.add_argument('--password')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    worker_counts = [int(w) for w in args.workers.split(',') if w.strip()]
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    print(f'Server CPUs: {os.cpu_count()}, concurrency {args.concurrency}, {args.requests} requests per scenario')
+
+    results = {}
+    for workers in worker_counts:
+        port = free_port()
+        process = start_server(workers, port, args.startup_timeout)
+        base_url = f'http://127.0.0.1:{port}'
+        token = login(base_url, args.username, args.password) if args.username else None
+        client = Client(base_url, token)
+        available = scenario_requests(Fixtures(client, random.Random(args.seed)))
+        results[workers] = {}
+        for name in scenarios:
+            if name not in available:
+                stop_server(process)
+                raise SystemExit(f'Unknown scenario {name!r}; choose from {", ".join(available)}')
+            results[workers][name] = run_scenario(client, available[name], args.requests, args.concurrency,
+                                                  args.warmup)
+        if args.drain:
+            results[workers]['drain'] = drain_check(client, available[args.drain_scenario], process, args.concurrency)
+        else:
+            stop_server(process)
+
+    baseline = results[worker_counts[0]]
+    print(f"\n{'workers':>7}  {'scenario':<18} {'req/s':>8} {'speedup':>8} {'p95 ms':>8} {'errors':>6}")
+    for workers, by_scenario in results.items():
+        for name in scenarios:
+            r = by_scenario[name]
+            speedup = r['throughput_rps'] / baseline[name]['throughput_rps'] if baseline[name]['throughput_rps'] else 0
+            print(f"{workers:>7}  {name:<18} {r['throughput_rps']:>8} {speedup:>7.2f}x {r['p95_ms']:>8} {r['errors']:>6}")
+        if 'drain' in by_scenario:
+            d = by_scenario['drain']
+            print(f"{workers:>7}  SIGTERM with {d['in_flight']} in flight: {d['completed']} completed, "
+                  f"{d['failed']} failed, stopped in {d['shutdown_seconds']}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
 from decimal import Decimal
 
-from app import auth, crud, models, schemas
-from app.db import Base, SessionLocal, engine
+from app import auth, crud, migrations, models, schemas
+from app.db import SessionLocal
 
 
 def run():
-    Base.metadata.create_all(bind=engine)
+    migrations.upgrade()
     db = SessionLocal()
 
     # Create default admin user